@@ -610,7 +610,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         const errorText = await processResponse.text();
                         console.error(`Error al procesar soluciones 'likeadas': ${processResponse.status}`, errorText);
                     } else {
-                        console.log(`Solución con ID ${messageId} procesada y añadida al vectorstore.`);
+                        console.log(`Solución con ID ${messageId} encolada para añadirse al vectorstore.`);
                     }
                 } catch (processError) {
                     console.error("Error de red al procesar soluciones 'likeadas':", processError);
@@ -699,6 +699,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         let latestBotMessageId = null;
         let finalMetadata = {};
+        let streamReferences = null; // Referencias que el servidor envía antes del primer token
         let accumulatedText = "";
         let botMessageElement = null; // Referencia al elemento DOM del mensaje del bot
 
@@ -737,82 +738,82 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const reader = response.body.getReader();
             const decoder = new TextDecoder("utf-8");
+            let sseBuffer = "";
+            let streamError = null;
+
+            const renderBotMessage = () => {
+                if (!botMessageElement) {
+                    hideSpinner();
+                    botMessageElement = appendMessage("bot", "", latestBotMessageId);
+                }
+                // Update content with Markdown parsing for each chunk
+                if (typeof marked !== "undefined") {
+                    botMessageElement.innerHTML = marked.parse(accumulatedText);
+                } else {
+                    const tempDiv = document.createElement('div');
+                    tempDiv.textContent = accumulatedText;
+                    botMessageElement.innerHTML = tempDiv.innerHTML.replace(/\n/g, '<br>');
+                }
+                chatbox.scrollTop = chatbox.scrollHeight;
+            };
+
+            // El servidor responde con eventos SSE: references, token, final, error y heartbeat
+            const handleEvent = (eventName, data) => {
+                switch (eventName) {
+                    case 'references':
+                        latestBotMessageId = data.message_id;
+                        streamReferences = data.references;
+                        break;
+                    case 'token':
+                        accumulatedText += data.text;
+                        renderBotMessage();
+                        break;
+                    case 'final':
+                        latestBotMessageId = data.message_id;
+                        finalMetadata = data.metadata;
+                        break;
+                    case 'error':
+                        streamError = data.message;
+                        break;
+                    default:
+                        break; // heartbeat: solo mantiene viva la conexión
+                }
+            };
 
             while (true) {
                 const { value, done } = await reader.read();
                 if (done) break;
 
-                const chunkValue = decoder.decode(value, { stream: true });
-
-                // MODIFICADO: Intentar extraer el JSON final del chunk.
-                // Esto maneja el caso donde el último token de texto y el JSON vienen juntos.
-                const finalDataRegex = /(.*?)({.*"final_message_data":.*})\s*$/s; // '\s*$' para capturar posibles espacios/saltos de línea al final
-                const match = chunkValue.match(finalDataRegex);
-
-                if (match) {
-                    // Si hay un match, el chunk contiene texto + JSON final
-                    const textPart = match[1];
-                    const jsonPart = match[2];
-
-                    // Añadir la parte de texto al acumulado
-                    accumulatedText += textPart;
-
-                    // Asegurar que el elemento del bot existe y actualizar su contenido con el texto
-                    if (!botMessageElement) {
-                        hideSpinner();
-                        botMessageElement = appendMessage("bot", "", latestBotMessageId);
-                    }
-                    // Update content with Markdown parsing for each chunk
-                    if (typeof marked !== "undefined") {
-                        botMessageElement.innerHTML = marked.parse(accumulatedText);
-                    } else {
-                        const tempDiv = document.createElement('div');
-                        tempDiv.textContent = accumulatedText;
-                        botMessageElement.innerHTML = tempDiv.innerHTML.replace(/\n/g, '<br>');
+                sseBuffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, "\n");
+                // Cada evento termina con una línea en blanco; lo incompleto espera al siguiente chunk
+                let boundary;
+                while ((boundary = sseBuffer.indexOf("\n\n")) !== -1) {
+                    const block = sseBuffer.slice(0, boundary);
+                    sseBuffer = sseBuffer.slice(boundary + 2);
+                    let eventName = "message";
+                    const dataLines = [];
+                    for (const line of block.split("\n")) {
+                        if (line.startsWith("event:")) {
+                            eventName = line.slice(6).trim();
+                        } else if (line.startsWith("data:")) {
+                            dataLines.push(line.slice(5).trimStart());
+                        }
                     }
-                    chatbox.scrollTop = chatbox.scrollHeight;
-
-                    // Intentar parsear la parte JSON
+                    if (dataLines.length === 0) continue;
                     try {
-                        const parsedFinalChunk = JSON.parse(jsonPart);
-                        if (parsedFinalChunk.final_message_data) {
-                            latestBotMessageId = parsedFinalChunk.final_message_data.message_id;
-                            finalMetadata = parsedFinalChunk.final_message_data.metadata;
-                            // ¡Hemos encontrado el JSON final! Salir del bucle de streaming.
-                            break;
-                        }
+                        handleEvent(eventName, JSON.parse(dataLines.join("\n")));
                     } catch (e) {
-                        console.error("Error al parsear la parte JSON final:", e);
-                        // Si el parseo de la parte JSON falla, añadirla al texto como fallback (no deseado, pero mejor que perderla)
-                        accumulatedText += jsonPart;
-                        if (typeof marked !== "undefined") {
-                            botMessageElement.innerHTML = marked.parse(accumulatedText);
-                        } else {
-                            const tempDiv = document.createElement('div');
-                            tempDiv.textContent = accumulatedText;
-                            botMessageElement.innerHTML = tempDiv.innerHTML.replace(/\n/g, '<br>');
-                        }
+                        console.error(`Error al parsear el evento ${eventName}:`, e);
                     }
-                } else {
-                    // Si no hay match, el chunk es texto puro (o un JSON que no es el final_message_data)
-                    // En tu caso, los chunks intermedios no deberían ser JSONs válidos, así que se tratarán como texto.
-                    accumulatedText += chunkValue;
-                    if (!botMessageElement) {
-                        hideSpinner();
-                        botMessageElement = appendMessage("bot", "", latestBotMessageId);
-                    }
-                    // Update content with Markdown parsing for each chunk
-                    if (typeof marked !== "undefined") {
-                        botMessageElement.innerHTML = marked.parse(accumulatedText);
-                    } else {
-                        const tempDiv = document.createElement('div');
-                        tempDiv.textContent = accumulatedText;
-                        botMessageElement.innerHTML = tempDiv.innerHTML.replace(/\n/g, '<br>');
-                    }
-                    chatbox.scrollTop = chatbox.scrollHeight;
                 }
             }
 
+            if (streamError) {
+                console.error("Error durante la generación:", streamError);
+                accumulatedText += `\n\n*Error al generar la respuesta: ${streamError}*`;
+                renderBotMessage();
+            }
+
             // --- Procesamiento Post-streaming (después de que el bucle de lectura haya terminado) ---
             hideSpinner();
 
@@ -822,9 +823,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     botMessageElement.dataset.messageId = latestBotMessageId;
                 }
 
-                // 1. Mostrar metadatos usando el finalMetadata recibido
-                if (finalMetadata && finalMetadata.references) {
-                    window.fetchAndDisplayMetadata(botMessageElement, finalMetadata.references);
+                // 1. Mostrar las referencias recibidas al inicio del stream
+                if (streamReferences && streamReferences.length > 0) {
+                    window.fetchAndDisplayMetadata(botMessageElement, streamReferences);
                 }
 
                 // 2. Añadir el icono de "me gusta"
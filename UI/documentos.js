@@ -1,3 +1,26 @@
+/**
+ * Consulta un trabajo en segundo plano hasta que termina.
+ * @param {string} jobId - El id devuelto al encolar el trabajo.
+ * @param {function} onProgress - Se llama con el trabajo en cada consulta.
+ * @returns {Promise<object>} El trabajo terminado (completed, failed o cancelled).
+ */
+async function waitForJob(jobId, onProgress, intervalMs = 1000) {
+    while (true) {
+        const response = await fetch(`${window.API_ENDPOINT}/jobs/${jobId}`);
+        if (!response.ok) {
+            throw new Error(`No se pudo consultar el trabajo ${jobId}: ${response.statusText}`);
+        }
+        const job = await response.json();
+        if (onProgress) {
+            onProgress(job);
+        }
+        if (['completed', 'failed', 'cancelled'].includes(job.status)) {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     // const apiEndpoint = "http://localhost:8000";
     const documentUploadInput = document.getElementById('documentUploadInput');
@@ -67,16 +90,37 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const result = await response.json();
 
-            if (response.ok) {
-                showStatus(uploadStatusDiv, `Archivos subidos exitosamente: ${result.files.map(f => f.filename).join(', ')}`, 'success');
-                // Consider calling fetchAndDisplayDocuments here to refresh the list
-                fetchAndDisplayDocuments();
-                documentUploadInput.value = ''; // Clear input
-                selectedFilesPreviewDiv.innerHTML = ''; // Clear preview
-                selectedFilesPreviewDiv.style.display = 'none'; // Hide preview
-            } else {
+            if (!response.ok) {
                 showStatus(uploadStatusDiv, `Error al subir archivos: ${result.detail || response.statusText}`, 'error');
+                return;
+            }
+
+            const uploadedNames = result.files.map(f => f.filename).join(', ');
+            // Archivos que no se pudieron subir (los demás se indexan igual)
+            const failedNote = (result.failed || []).length
+                ? ` No se subieron: ${result.failed.map(f => `${f.filename} (${f.detail})`).join(', ')}.`
+                : '';
+            documentUploadInput.value = ''; // Clear input
+            selectedFilesPreviewDiv.innerHTML = ''; // Clear preview
+            selectedFilesPreviewDiv.style.display = 'none'; // Hide preview
+            showStatus(uploadStatusDiv, `Archivos subidos: ${uploadedNames}. Indexando...`, '', true);
+
+            // La ingesta de los archivos subidos corre en segundo plano
+            const job = await waitForJob(result.job.id, (current) => {
+                const progress = current.progress || {};
+                if (current.status === 'running' && progress.files_total) {
+                    showStatus(uploadStatusDiv, `Indexando... ${progress.files_done}/${progress.files_total} PDFs, ${progress.chunks} chunks`, '', true);
+                }
+            });
+
+            if (job.status === 'completed') {
+                showStatus(uploadStatusDiv, `Archivos subidos e indexados: ${uploadedNames} (${job.result.chunks_count} chunks nuevos).${failedNote}`, failedNote ? 'error' : 'success');
+            } else if (job.status === 'cancelled') {
+                showStatus(uploadStatusDiv, `Archivos subidos (${uploadedNames}), pero su indexado se canceló.${failedNote}`, 'error');
+            } else {
+                showStatus(uploadStatusDiv, `Archivos subidos (${uploadedNames}), pero falló su indexado: ${job.error}.${failedNote}`, 'error');
             }
+            fetchAndDisplayDocuments();
         } catch (error) {
             console.error("Error al subir archivos:", error);
             showStatus(uploadStatusDiv, `Error de red al subir archivos: ${error.message}`, 'error');
@@ -207,14 +251,30 @@ document.addEventListener('DOMContentLoaded', () => {
                 headers: { 'Content-Type': 'application/json' }
             });
 
-            const result = await response.json();
+            const queued = await response.json();
 
-            if (response.ok) {
-                showStatus(processStatusDiv, `Procesamiento completado. Documentos: ${result[0]}, Nuevos: ${result[1]}, Chunks: ${result[2]}`, 'success');
-                fetchAndDisplayDocuments(); // Refresh the list to reflect processed state
+            if (!response.ok) {
+                showStatus(processStatusDiv, `Error al procesar documentos: ${queued.detail || response.statusText}`, 'error');
+                return;
+            }
+
+            // La carga corre en segundo plano: se consulta el trabajo hasta que termine
+            const job = await waitForJob(queued.id, (current) => {
+                const progress = current.progress || {};
+                if (current.status === 'running' && progress.files_total) {
+                    showStatus(processStatusDiv, `Procesando documentos... ${progress.files_done}/${progress.files_total} PDFs, ${progress.chunks} chunks`, '', true);
+                }
+            });
+
+            if (job.status === 'completed') {
+                const result = job.result;
+                showStatus(processStatusDiv, `Procesamiento completado. Documentos: ${result.docs_count}, Nuevos: ${result.new_docs_count}, Chunks: ${result.chunks_count}`, 'success');
+            } else if (job.status === 'cancelled') {
+                showStatus(processStatusDiv, 'Procesamiento cancelado.', 'error');
             } else {
-                showStatus(processStatusDiv, `Error al procesar documentos: ${result.detail || response.statusText}`, 'error');
+                showStatus(processStatusDiv, `Error al procesar documentos: ${job.error}`, 'error');
             }
+            fetchAndDisplayDocuments(); // Refresh the list to reflect processed state
         } catch (error) {
             console.error("Error al procesar documentos:", error);
             showStatus(processStatusDiv, `Error de red al procesar documentos: ${error.message}`, 'error');
@@ -195,13 +195,19 @@ document.addEventListener('DOMContentLoaded', () => {
                 headers: { 'Content-Type': 'application/json' }
             });
 
-            const result = await response.json();
+            const queued = await response.json();
 
-            if (response.ok) {
-                showStatus(processSolutionsStatusDiv, `Procesamiento completado. Se añadieron ${result.count} nuevas soluciones.`, 'success');
+            if (!response.ok) {
+                showStatus(processSolutionsStatusDiv, `Error al procesar soluciones: ${queued.detail || response.statusText}`, 'error');
+                return;
+            }
+
+            const job = await waitForJob(queued.id); // Definida en documentos.js
+            if (job.status === 'completed') {
+                showStatus(processSolutionsStatusDiv, `Procesamiento completado. Se añadieron ${job.result.count} nuevas soluciones.`, 'success');
                 loadLikedSolutions(userName); // Reload to show updated list
             } else {
-                showStatus(processSolutionsStatusDiv, `Error al procesar soluciones: ${result.detail || response.statusText}`, 'error');
+                showStatus(processSolutionsStatusDiv, `Error al procesar soluciones: ${job.error || job.status}`, 'error');
             }
         } catch (error) {
             console.error("Error al procesar soluciones 'likeadas':", error);
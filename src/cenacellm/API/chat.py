@@ -1,14 +1,26 @@
 import os
-import shutil
+import re
+import hashlib
+import anyio
 from pathlib import Path
-from cenacellm.rag import RAG
+from uuid import uuid4
+from cenacellm.rag import RAG, TicketSortField
+from cenacellm.rerank import make_reranker
+from cenacellm.jobs import JobContext, JobQueue
+from cenacellm.sse import SSE_HEADERS, sse_stream
 from pydantic import BaseModel
-from typing import AsyncGenerator, List, Dict, Any, Union, Optional
+from typing import AsyncGenerator, List, Dict, Any, Union, Optional, Tuple
 from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
-from cenacellm.settings.config import VECTORS_DIR, DOCUMENTS_DIR
+from cenacellm.settings.config import VECTORS_DIR, DOCUMENTS_DIR, MAX_UPLOAD_BYTES, RERANKER
 from fastapi import FastAPI, UploadFile, File, HTTPException, Body # Importa Body
 from bson.objectid import ObjectId # Import ObjectId for new conversation IDs
-rag = RAG(vectorstore_path=VECTORS_DIR)
+rag = RAG(vectorstore_path=VECTORS_DIR, reranker=make_reranker(RERANKER))
+# Ingestas y procesado de soluciones se ejecutan de uno en uno fuera de las peticiones;
+# su estado se guarda en Mongo para que cualquier worker de la API pueda consultarlo
+jobs = JobQueue(max_workers=1, collection=rag.db["jobs"])
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+_UNSAFE_FILENAME = re.compile(r"[^\w\-. ()]+")
 
 class QueryRequest(BaseModel):
     user_id: str
@@ -16,6 +28,8 @@ class QueryRequest(BaseModel):
     query: str
     k : int = 10
     filter_metadata: dict = None
+    hybrid : bool = True  # Fusiona la búsqueda vectorial con BM25
+    rerank : bool = True  # Pasa los candidatos por el reranker configurado
 
 # Nuevo modelo Pydantic para actualizar los metadatos de un mensaje
 class UpdateMetadataRequest(BaseModel):
@@ -51,41 +65,40 @@ class CreateConversationRequest(BaseModel):
 
 
 async def async_chat_stream(request: QueryRequest) -> StreamingResponse:
-    """Función asíncrona para manejar el streaming del chat."""
-    token_generator = rag.answer(
+    """
+    Función asíncrona para manejar el streaming del chat (sin pasar por el threadpool).
+    Responde con eventos SSE: references, token, final, error y heartbeat.
+    """
+    events = rag.aanswer(
         request.user_id,
         request.conversation_id, # Pass conversation_id
         request.query,
         k=request.k,
-        filter_metadata=request.filter_metadata
+        filter_metadata=request.filter_metadata,
+        hybrid=request.hybrid,
+        rerank=request.rerank
     )
-    return StreamingResponse(token_generator, media_type="text/event-stream")
-
-def metadata_generator():
-    """Generador para obtener metadatos del último chat."""
-    # Asegúrate de que `rag.last_chunks` sea accesible y contenga los datos esperados.
-    # El formato exacto de los metadatos dependerá de cómo los almacenes en `rag`.
-    if hasattr(rag, 'last_chunks') and rag.last_chunks:
-        # Extraer solo los metadatos relevantes de cada chunk
-        metadata_list = [
-            {"reference": chunk.metadata.reference, "metadata": chunk.metadata.model_dump()}
-            for chunk in rag.last_chunks if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'reference')
-        ]
-        return {"references": metadata_list}
-    return {"references": []}
-
-def get_chat_history(user_id: str, conversation_id: str): # Added conversation_id
+    return StreamingResponse(sse_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def get_message_references(message_id: str):
+    """Obtiene las referencias usadas en una respuesta del bot."""
+    references = rag.get_message_references(message_id)
+    if references is None:
+        raise HTTPException(status_code=404, detail="Mensaje no encontrado.")
+    return {"message_id": message_id, "references": references}
+
+async def get_chat_history(user_id: str, conversation_id: str): # Added conversation_id
     """Obtiene el historial de chat de un usuario y conversación específica."""
-    return rag.get_user_history(user_id, conversation_id) # Pass conversation_id
+    return await rag.aget_user_history(user_id, conversation_id) # Pass conversation_id
 
-def clear_user_history(user_id: str, conversation_id: str): # Added conversation_id
+async def clear_user_history(user_id: str, conversation_id: str): # Added conversation_id
     """Borra el historial de chat de un usuario y conversación específica."""
-    return rag.clear_user_history(user_id, conversation_id) # Pass conversation_id
+    return await rag.aclear_user_history(user_id, conversation_id) # Pass conversation_id
 
-def load_documents(collection_name: str, force_reload: bool = False):
-    """Carga y procesa documentos."""
+def _load_documents_job(ctx: JobContext, collection_name: str, force_reload: bool):
     docs_count, new_docs_count, chunks_count = rag.load_documents(
-        DOCUMENTS_DIR, collection_name, force_reload
+        DOCUMENTS_DIR, collection_name, force_reload,
+        on_progress=lambda report: ctx.report(report.model_dump())
     )
     return {
         "docs_count": docs_count,
@@ -93,55 +106,154 @@ def load_documents(collection_name: str, force_reload: bool = False):
         "chunks_count": chunks_count,
     }
 
+def load_documents(collection_name: str, force_reload: bool = False):
+    """Encola la carga y el procesado de documentos; devuelve el trabajo sin esperar."""
+    return jobs.submit("load_documents", _load_documents_job, collection_name, force_reload).model_dump()
+
+def get_job(job_id: str):
+    """Obtiene el estado, el avance y el resultado de un trabajo."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job.model_dump()
+
+def list_jobs(kind: Optional[str] = None):
+    """Lista los trabajos recientes, del más nuevo al más viejo."""
+    return [job.model_dump() for job in jobs.list(kind)]
+
+def cancel_job(job_id: str):
+    """Pide cancelar un trabajo pendiente o en curso."""
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return {"status": "success" if jobs.cancel(job_id) else "finished", "job": jobs.get(job_id).model_dump()}
+
 def get_preprocessed_files():
     """Obtiene la lista de archivos preprocesados."""
     return rag.processed_files
 
-async def upload_documents(files: List[UploadFile]):
-    """Sube documentos a la carpeta de documentos."""
-    uploaded_files_info = []
-    
+def get_embedding_cache_stats():
+    """Obtiene los contadores de la caché de embeddings."""
+    cache = rag.embedder.cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats.model_dump(), "hit_rate": cache.stats.hit_rate}
+
+def safe_filename(filename: Optional[str]) -> str:
+    """Nombre con el que se guarda una subida: sin rutas ni caracteres raros y siempre .pdf."""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    name = _UNSAFE_FILENAME.sub("_", name).strip(" ._")
+    if not name.lower().endswith(".pdf") or len(name) <= len(".pdf"):
+        raise HTTPException(status_code=400, detail=f"Solo se aceptan archivos PDF: {filename!r}")
+    return name
+
+async def _save_upload(file: UploadFile, destination: str, max_bytes: int) -> Tuple[int, str]:
+    """
+    Copia la subida a disco por bloques con E/S asíncrona y calcula su sha256
+    a la vez. Se escribe en un `.part` propio de esta subida que solo se
+    renombra al terminar, así que una subida cortada o demasiado grande no
+    deja un PDF a medias y dos subidas con el mismo nombre no se mezclan.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    partial = f"{destination}.{uuid4().hex}.part"
+    try:
+        async with await anyio.open_file(partial, "wb") as out:
+            while block := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(block)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"{file.filename} supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB"
+                    )
+                digest.update(block)
+                await out.write(block)
+        await anyio.to_thread.run_sync(os.replace, partial, destination)
+    except BaseException:
+        # Aunque la petición se haya cancelado, el .part se borra
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(_remove_partial, partial)
+        raise
+    return size, digest.hexdigest()
+
+def _remove_partial(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _load_files_job(ctx: JobContext, files: List[Tuple[str, str]], collection_name: str):
+    docs_count, new_docs_count, chunks_count = rag.load_files(
+        files, collection_name,
+        on_progress=lambda report: ctx.report(report.model_dump())
+    )
+    return {
+        "docs_count": docs_count,
+        "new_docs_count": new_docs_count,
+        "chunks_count": chunks_count,
+    }
+
+async def upload_documents(files: List[UploadFile], collection_name: str = "documentos",
+                           max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Sube documentos a la carpeta de documentos y encola su ingesta.
+
+    Solo se indexan los archivos recibidos (con el hash calculado durante la
+    subida), sin volver a recorrer toda la carpeta. Si un archivo falla (p. ej.
+    por tamaño) los demás se guardan y encolan igual, y el fallido se informa
+    en `failed`; solo si fallan todos se responde con el error.
+    """
+    # Se validan todos los nombres antes de escribir nada
+    names = [safe_filename(file.filename) for file in files]
+
     # Crear carpeta si no existe
-    Path(DOCUMENTS_DIR).mkdir(parents=True, exist_ok=True)
+    await anyio.to_thread.run_sync(lambda: Path(DOCUMENTS_DIR).mkdir(parents=True, exist_ok=True))
 
-    for file in files:
-        file_location = os.path.join(DOCUMENTS_DIR, file.filename)
+    uploaded_files_info = []
+    failed: List[HTTPException] = []
+    failed_files_info = []
+    to_ingest = []
+    for file, name in zip(files, names):
+        file_location = os.path.join(DOCUMENTS_DIR, name)
         try:
-            with open(file_location, "wb+") as file_object:
-                shutil.copyfileobj(file.file, file_object)
-            uploaded_files_info.append({"filename": file.filename, "size": file.size})
+            size, digest = await _save_upload(file, file_location, max_bytes)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error al subir el archivo {file.filename}: {e}")
-    return {"status": "success", "files": uploaded_files_info}
+            error = e if isinstance(e, HTTPException) else \
+                HTTPException(status_code=500, detail=f"Error al subir el archivo {file.filename}: {e}")
+            failed.append(error)
+            failed_files_info.append({"filename": name, "status_code": error.status_code, "detail": error.detail})
+            continue
+        uploaded_files_info.append({"filename": name, "size": size, "hash": digest})
+        to_ingest.append((file_location, digest))
+
+    if not to_ingest:
+        raise failed[0]
+    # submit guarda el trabajo en Mongo (pymongo síncrono): fuera del event loop
+    job = await anyio.to_thread.run_sync(jobs.submit, "load_documents", _load_files_job, to_ingest, collection_name)
+    return {
+        "status": "partial" if failed else "success",
+        "files": uploaded_files_info,
+        "failed": failed_files_info,
+        "job": job.model_dump(),
+    }
 
 def delete_document(request: DeleteDocumentsRequest): # Ahora espera DeleteDocumentsRequest
     """Elimina documentos del servidor y del vectorstore."""
-    deleted_count = 0
-    for reference_id in request.reference_ids:
-        # Primero eliminar del vectorstore usando la referencia
-        rag.delete_from_vectorstore(reference_id)
-        # Luego eliminar del registro de archivos procesados (si es un documento)
-        # Necesitas buscar el file_key por reference_id si no lo tienes directamente
-        # Esto asume que reference_id es único y se puede usar para encontrar el file_key
-        # Una forma es iterar o tener un mapeo inverso si la referencia es un UUID de documento
-        file_key_to_delete = None
-        for key, value in rag.processed_files.items():
-            if value.get("reference") == reference_id:
-                file_key_to_delete = key
-                break
-        
-        if file_key_to_delete:
-            rag._delete_processed_file([file_key_to_delete])
-            # Eliminar el archivo físico si es un documento
-            file_path = os.path.join(DOCUMENTS_DIR, file_key_to_delete)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            deleted_count += 1
-        else:
-            # Si no es un documento (ej. es una solución), solo se elimina del vectorstore
-            # y el _delete_processed_file ya no es el método principal para soluciones.
-            # La eliminación de soluciones ya se maneja en delete_solution_by_reference
-            pass
+    # Primero eliminar del vectorstore todas las referencias en una sola pasada
+    rag.delete_many_from_vectorstore(request.reference_ids)
+
+    # Luego eliminar del registro de archivos procesados (si es un documento).
+    # Si no es un documento (ej. es una solución), solo se elimina del vectorstore;
+    # la eliminación de soluciones ya se maneja en delete_solution_by_reference
+    # Se resuelven en Mongo, no en la caché de este worker: otro pudo ingerir el archivo
+    file_keys_to_delete = rag.file_keys_for_references(request.reference_ids)
+    if file_keys_to_delete:
+        rag._delete_processed_file(file_keys_to_delete)
+    for file_key in file_keys_to_delete:
+        # Eliminar el archivo físico si es un documento
+        file_path = os.path.join(DOCUMENTS_DIR, file_key)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    deleted_count = len(file_keys_to_delete)
     rag.refresh_processed_data() # Refresh cache after deletion
     return {"status": "success", "deleted_count": deleted_count}
 
@@ -160,23 +272,24 @@ def update_message_metadata(user_id: str, message_id: str, new_metadata: Dict[st
         return {"status": "success", "message": "Metadatos del mensaje actualizados."}
     raise HTTPException(status_code=404, detail="Mensaje no encontrado.")
 
-def get_liked_solutions(user_id: str):
-    """Obtiene soluciones "likeadas" de un usuario."""
-    return rag.assistant.get_liked_solutions(user_id)
+def get_liked_solutions(user_id: str, skip: int = 0, limit: Optional[int] = None):
+    """Obtiene soluciones "likeadas" de un usuario, opcionalmente paginadas."""
+    return rag.assistant.get_liked_solutions(user_id, skip=skip, limit=limit)
 
-def process_liked_solutions_to_vectorstore(user_id: str):
-    """Procesa soluciones "likeadas" y las añade al vectorstore."""
+def _process_liked_solutions_job(ctx: JobContext, user_id: str):
     count = rag.add_liked_solutions_to_vectorstore(user_id)
     return {"status": "success", "count": count}
 
+def process_liked_solutions_to_vectorstore(user_id: str):
+    """Encola el procesado de las soluciones "likeadas"; devuelve el trabajo sin esperar."""
+    return jobs.submit("process_liked_solutions", _process_liked_solutions_job, user_id).model_dump()
+
 def delete_solution_by_reference(reference_ids: List[str]):
     """Elimina soluciones del vectorstore por su ID de referencia."""
-    deleted_count = 0
-    for ref_id in reference_ids:
-        rag.delete_from_vectorstore(ref_id)
-        # También elimina del registro de processed_files_registro si existe
-        rag.processed_files_collection.delete_one({"reference": ref_id, "collection": "soluciones"})
-        deleted_count += 1
+    rag.delete_many_from_vectorstore(reference_ids)
+    # También elimina del registro de processed_files_registro si existe
+    rag.processed_files_collection.delete_many({"reference": {"$in": reference_ids}, "collection": "soluciones"})
+    deleted_count = len(reference_ids)
     rag.refresh_processed_data() # Refresh cache
     return {"status": "success", "deleted_count": deleted_count}
 
@@ -197,9 +310,10 @@ def delete_conversation(user_id: str, conversation_id: str): # New function
     rag.delete_conversation(user_id, conversation_id)
     return {"status": "success", "message": f"Conversación {conversation_id} eliminada."}
 
-def get_tickets_list():
-    """Obtiene la lista de tickets desde el RAG."""
-    return rag.get_tickets()
+def get_tickets_list(skip: int = 0, limit: Optional[int] = None, sort_by: Optional[TicketSortField] = None,
+                     descending: bool = False, fields: Optional[List[str]] = None):
+    """Obtiene la lista de tickets desde el RAG, paginada y ordenada en Mongo."""
+    return rag.get_tickets(skip=skip, limit=limit, sort_by=sort_by, descending=descending, fields=fields)
 
 def add_ticket_to_db(request: AddTicketRequest):
     """Añade un nuevo ticket a la base de datos."""
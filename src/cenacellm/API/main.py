@@ -1,15 +1,20 @@
-from fastapi import FastAPI, UploadFile, File, Request, Body
+from fastapi import FastAPI, UploadFile, File, Request, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
+from cenacellm.rag import TicketSortField
 from cenacellm.API.chat import (
     async_chat_stream,
-    metadata_generator,
+    get_message_references,
     clear_user_history,
     load_documents,
+    get_job,
+    list_jobs,
+    cancel_job,
+    get_embedding_cache_stats,
     QueryRequest,
     UpdateMetadataRequest, # Importa el nuevo modelo de solicitud
     DeleteSolutionsRequest, # Import the new model for deleting solutions
@@ -51,36 +56,58 @@ async def chat(request: QueryRequest):
     """Endpoint principal para el chat con el modelo."""
     return await async_chat_stream(request)
 
-@app.get("/metadata")
-async def metadata():
-    """Endpoint para obtener metadatos de la última respuesta del chat."""
-    return metadata_generator()
+@app.get("/metadata/{message_id}")
+def metadata(message_id: str):
+    """Endpoint para obtener las referencias de una respuesta del chat."""
+    return get_message_references(message_id)
 
 @app.get("/history/{user_id}/{conversation_id}") # Modified route
 async def history(user_id: str, conversation_id: str): # Added conversation_id
     """Endpoint para obtener el historial de chat de un usuario y conversación."""
-    return get_chat_history(user_id, conversation_id) # Pass conversation_id
+    return await get_chat_history(user_id, conversation_id) # Pass conversation_id
 
 @app.delete("/history/{user_id}/{conversation_id}") # Modified route
 async def delete_history(user_id: str, conversation_id: str): # Added conversation_id
     """Endpoint para borrar el historial de chat de una conversación específica."""
-    clear_user_history(user_id, conversation_id) # Pass conversation_id
+    await clear_user_history(user_id, conversation_id) # Pass conversation_id
     return {"status": "success", "message": "Historial de conversación borrado."}
 
-@app.post("/load_documents")
-async def load_docs(collection_name: str, force_reload: bool = False):
-    """Endpoint para cargar documentos en el sistema RAG."""
+# La cola de trabajos consulta Mongo con pymongo (síncrono): estos handlers son `def`
+# para que FastAPI los ejecute en su pool de hilos y no bloqueen el event loop
+@app.post("/load_documents", status_code=202)
+def load_docs(collection_name: str, force_reload: bool = False):
+    """Endpoint para cargar documentos en el sistema RAG. Responde de inmediato con el trabajo encolado."""
     return load_documents(collection_name, force_reload)
 
+@app.get("/jobs")
+def jobs_list(kind: Optional[str] = None):
+    """Endpoint para listar los trabajos en segundo plano."""
+    return list_jobs(kind)
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """Endpoint para consultar el estado y el avance de un trabajo."""
+    return get_job(job_id)
+
+@app.delete("/jobs/{job_id}")
+def job_cancel(job_id: str):
+    """Endpoint para cancelar un trabajo pendiente o en curso."""
+    return cancel_job(job_id)
+
 @app.get("/documents")
 async def documents():
     """Endpoint para obtener la lista de documentos preprocesados."""
     return get_preprocessed_files()
 
-@app.post("/upload_documents")
-async def upload_doc(files: List[UploadFile] = File(...)):
-    """Endpoint para subir documentos PDF al servidor."""
-    return await upload_documents(files)
+@app.get("/embedding_cache")
+async def embedding_cache():
+    """Endpoint para consultar aciertos, fallos y tamaño de la caché de embeddings."""
+    return get_embedding_cache_stats()
+
+@app.post("/upload_documents", status_code=202)
+async def upload_doc(files: List[UploadFile] = File(...), collection_name: str = "documentos"):
+    """Endpoint para subir documentos PDF al servidor. Su ingesta queda encolada como trabajo."""
+    return await upload_documents(files, collection_name)
 
 # MODIFICADO: Ahora espera el modelo DeleteDocumentsRequest
 @app.post("/delete_document")
@@ -102,16 +129,18 @@ async def patch_message_metadata(user_id: str, message_id: str, request: UpdateM
     return update_message_metadata(user_id, message_id, request.new_metadata)
 
 @app.get("/solutions/{user_id}")
-async def solutions(user_id: str):
+def solutions(user_id: str, skip: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
     """
     Endpoint para obtener una lista de soluciones (mensajes del bot) que han sido marcadas como 'liked'.
+    Admite paginación con `skip` y `limit`.
     """
-    return get_liked_solutions(user_id)
+    return get_liked_solutions(user_id, skip, limit)
 
-@app.post("/process_liked_solutions/{user_id}")
-async def process_liked_solutions(user_id: str):
+@app.post("/process_liked_solutions/{user_id}", status_code=202)
+def process_liked_solutions(user_id: str):
     """
     Endpoint para procesar las soluciones "likeadas" de un usuario y añadirlas al vectorstore.
+    Responde de inmediato con el trabajo encolado.
     """
     return process_liked_solutions_to_vectorstore(user_id)
 
@@ -145,11 +174,18 @@ def delete_conv(request: DeleteConversationRequest):
     return delete_conversation(request.user_id, request.conversation_id)
 
 @app.get("/tickets")
-def tickets_list(): # Renamed function to avoid conflict with imported get_tickets_list
+def tickets_list( # Renamed function to avoid conflict with imported get_tickets_list
+        skip: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1),
+        sort_by: Optional[TicketSortField] = None,
+        descending: bool = False,
+        fields: Optional[List[str]] = Query(None)):
     """
     Endpoint para obtener la lista de tickets.
+    Admite paginación (`skip`, `limit`), orden (`sort_by`, `descending`) y
+    selección de campos (`fields`, repetible).
     """
-    return get_tickets_list()
+    return get_tickets_list(skip, limit, sort_by, descending, fields)
 
 @app.post("/tickets") # NUEVO endpoint para agregar tickets
 def add_ticket(request: AddTicketRequest):
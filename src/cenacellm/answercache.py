@@ -0,0 +1,113 @@
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+from cenacellm.types import Vector
+
+
+class CachedAnswer(NamedTuple):
+    tokens : List[str]
+    metadata : Dict[str, Any]   # CallMetadata de la respuesta original
+    created_at : float
+
+
+class _Entry(NamedTuple):
+    vector : Vector             # Embedding normalizado de la pregunta
+    chunk_ids : Tuple[int, ...]
+    answer : CachedAnswer
+
+
+class AnswerCache:
+    """
+    Caché semántica de respuestas del RAG.
+
+    Una entrada se reutiliza si la pregunta nueva recuperó exactamente los
+    mismos chunks y su embedding tiene similitud coseno >= `threshold` con el
+    de la pregunta original, dentro de `ttl` segundos. Se invalida en cuanto
+    alguno de sus chunks se borra o cambia de metadata (ver `invalidate_ids`).
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_chunks: Dict[Tuple[int, ...], Set[int]] = {}
+        self._by_chunk_id: Dict[int, Set[int]] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector: Vector) -> Vector:
+        vector = np.asarray(vector, dtype="float32").ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, key: int):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        bucket = self._by_chunks.get(entry.chunk_ids)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._by_chunks[entry.chunk_ids]
+        for idx in set(entry.chunk_ids):
+            keys = self._by_chunk_id.get(idx)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_chunk_id[idx]
+
+    def get(self, query_vector: Vector, chunk_ids: Sequence[int]) -> Optional[CachedAnswer]:
+        chunk_ids = tuple(chunk_ids)
+        vector = self._unit(query_vector)
+        now = time.time()
+        with self._lock:
+            best, best_score = None, self.threshold
+            for key in list(self._by_chunks.get(chunk_ids, ())):
+                entry = self._entries[key]
+                if now - entry.answer.created_at > self.ttl:
+                    self._drop(key)
+                    continue
+                score = float(np.dot(vector, entry.vector))
+                if score >= best_score:
+                    best, best_score = key, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best].answer
+
+    def put(self, query_vector: Vector, chunk_ids: Sequence[int], tokens: List[str], metadata: Dict[str, Any]):
+        chunk_ids = tuple(chunk_ids)
+        entry = _Entry(self._unit(query_vector), chunk_ids, CachedAnswer(list(tokens), metadata, time.time()))
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = entry
+            self._by_chunks.setdefault(chunk_ids, set()).add(key)
+            for idx in set(chunk_ids):
+                self._by_chunk_id.setdefault(idx, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_ids(self, ids: Iterable[int]) -> int:
+        """Descarta las respuestas que usaron alguno de esos chunks. Devuelve cuántas."""
+        with self._lock:
+            keys = set()
+            for idx in ids:
+                keys |= self._by_chunk_id.get(int(idx), set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+            self._by_chunk_id.clear()
@@ -0,0 +1,243 @@
+import json
+import mmap
+import os
+import numpy as np
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from cenacellm.types import Text, TextMetadata
+
+# Una fila por chunk, ordenadas por id. El texto y la metadata (JSON) viven en el blob;
+# reference y collection se guardan además como códigos de una tabla de strings
+# para poder reconstruir los índices inversos sin materializar ningún Text.
+ROW_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("content_off", "<i8"),
+    ("content_len", "<i4"),
+    ("meta_off", "<i8"),
+    ("meta_len", "<i4"),
+    ("reference", "<i4"),
+    ("collection", "<i4"),
+])
+
+NO_STRING = -1
+
+
+class _Snapshot(NamedTuple):
+    """Archivos abiertos de un snapshot; se sustituye entero para que los lectores vean un estado coherente."""
+    rows: np.ndarray
+    strings: List[str]
+    blob: Optional[mmap.mmap]
+
+
+_EMPTY = _Snapshot(np.empty(0, dtype=ROW_DTYPE), [], None)
+
+
+def chunk_paths(folder_path: str, prefix: str) -> Tuple[str, str, str]:
+    return (
+        os.path.join(folder_path, f"{prefix}.rows.npy"),
+        os.path.join(folder_path, f"{prefix}.blob"),
+        os.path.join(folder_path, f"{prefix}.strings.json"),
+    )
+
+
+class ChunkStore(Mapping):
+    """
+    Almacén de chunks en disco: `<prefix>.rows.npy` (tabla columnar, mmap),
+    `<prefix>.blob` (UTF-8, mmap) y `<prefix>.strings.json` (tabla de strings).
+
+    Se comporta como un diccionario id -> Text de solo lectura; los Text se
+    materializan bajo demanda. Los cambios posteriores a la última escritura
+    se guardan en memoria hasta `write()`.
+    """
+
+    def __init__(self, folder_path: str, prefix: str = "chunks"):
+        self.folder_path = folder_path
+        self.prefix = prefix
+        self._base = _EMPTY
+
+        self._pending: Dict[int, Text] = {}   # Chunks nuevos aún no escritos
+        self._updated: Dict[int, Text] = {}   # Chunks escritos con metadata modificada
+        self._deleted: Set[int] = set()       # Chunks escritos que ya no existen
+        self._open()
+
+    def _open(self):
+        rows_path, blob_path, strings_path = chunk_paths(self.folder_path, self.prefix)
+        if not os.path.exists(rows_path):
+            self._base = _EMPTY
+            return
+        rows = np.load(rows_path, mmap_mode="r")
+        with open(strings_path, encoding="utf-8") as f:
+            strings = json.load(f)
+        blob = None
+        if os.path.getsize(blob_path):
+            with open(blob_path, "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._base = _Snapshot(rows, strings, blob)
+
+    def close(self):
+        # Los mmap se liberan cuando ningún lector conserva el snapshot anterior
+        self._base = _EMPTY
+
+    @staticmethod
+    def remove_files(folder_path: str, prefix: str):
+        for path in chunk_paths(folder_path, prefix):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # --- Lectura -------------------------------------------------------------
+
+    @staticmethod
+    def _row(base: _Snapshot, idx: int) -> Optional[int]:
+        ids = base.rows["id"]
+        pos = int(np.searchsorted(ids, idx))
+        if pos < len(ids) and ids[pos] == idx:
+            return pos
+        return None
+
+    @staticmethod
+    def _read_bytes(base: _Snapshot, pos: int) -> Tuple[bytes, bytes]:
+        row = base.rows[pos]
+        content = base.blob[row["content_off"]:row["content_off"] + row["content_len"]]
+        meta = base.blob[row["meta_off"]:row["meta_off"] + row["meta_len"]]
+        return content, meta
+
+    def __getitem__(self, idx: int) -> Text:
+        idx = int(idx)
+        if idx in self._pending:
+            return self._pending[idx]
+        if idx in self._deleted:
+            raise KeyError(idx)
+        if idx in self._updated:
+            return self._updated[idx]
+        base = self._base
+        pos = self._row(base, idx)
+        if pos is None:
+            raise KeyError(idx)
+        content, meta = self._read_bytes(base, pos)
+        return Text(content=content.decode("utf-8"), metadata=TextMetadata.model_validate_json(meta))
+
+    def __contains__(self, idx) -> bool:
+        idx = int(idx)
+        return idx in self._pending or (idx not in self._deleted and self._row(self._base, idx) is not None)
+
+    def __len__(self) -> int:
+        return len(self._base.rows) - len(self._deleted) + len(self._pending)
+
+    def __iter__(self) -> Iterator[int]:
+        for idx in self._base.rows["id"].tolist():
+            if idx not in self._deleted:
+                yield idx
+        yield from list(self._pending)
+
+    @staticmethod
+    def _string(base: _Snapshot, code: int) -> Optional[str]:
+        return None if code == NO_STRING else base.strings[code]
+
+    def reverse_index(self) -> Tuple[Dict[str, Set[int]], Dict[str, Set[int]]]:
+        """Índices inversos reference -> ids y collection -> ids a partir de las columnas."""
+        by_reference: Dict[str, Set[int]] = {}
+        by_collection: Dict[str, Set[int]] = {}
+        base = self._base
+        live = ~np.isin(base.rows["id"], np.fromiter(self._deleted | self._updated.keys(), dtype="int64"))
+        rows = base.rows[live]
+        for column, index in (("reference", by_reference), ("collection", by_collection)):
+            codes = rows[column]
+            order = np.argsort(codes, kind="stable")
+            uniques, starts = np.unique(codes[order], return_index=True)
+            for code, ids in zip(uniques.tolist(), np.split(rows["id"][order], starts[1:])):
+                index[self._string(base, code)] = set(ids.tolist())
+        for idx, text in [*self._updated.items(), *self._pending.items()]:
+            by_reference.setdefault(text.metadata.reference, set()).add(idx)
+            by_collection.setdefault(text.metadata.collection, set()).add(idx)
+        return by_reference, by_collection
+
+    # --- Escritura -----------------------------------------------------------
+
+    def add(self, idx: int, text: Text):
+        self._pending[int(idx)] = text
+
+    def update(self, idx: int, text: Text):
+        idx = int(idx)
+        if idx in self._pending:
+            self._pending[idx] = text
+        elif idx in self:
+            self._updated[idx] = text
+        else:
+            raise KeyError(idx)
+
+    def delete(self, idx: int):
+        idx = int(idx)
+        if self._pending.pop(idx, None) is None:
+            self._updated.pop(idx, None)
+            self._deleted.add(idx)
+
+    def write(self, prefix: Optional[str] = None):
+        """
+        Escribe un snapshot compacto con todos los chunks vivos en `prefix`
+        (por defecto el actual) y pasa a leer de él.
+        Los bytes de los chunks ya escritos se copian del blob sin materializar Text.
+        """
+        os.makedirs(self.folder_path, exist_ok=True)
+        prefix = prefix or self.prefix
+        rows_path, blob_path, strings_path = chunk_paths(self.folder_path, prefix)
+        base = self._base
+        strings: Dict[str, int] = {}
+
+        def code(value: Optional[str]) -> int:
+            if value is None:
+                return NO_STRING
+            return strings.setdefault(value, len(strings))
+
+        ids = sorted(self)
+        rows = np.empty(len(ids), dtype=ROW_DTYPE)
+        tmp_blob = blob_path + ".tmp"
+        offset = 0
+        with open(tmp_blob, "wb") as blob:
+            for n, idx in enumerate(ids):
+                text = self._pending.get(idx)
+                if text is None:
+                    text = self._updated.get(idx)
+                if text is not None:
+                    content = text.content.encode("utf-8")
+                    meta = text.metadata.model_dump_json().encode("utf-8")
+                    reference, collection = text.metadata.reference, text.metadata.collection
+                else:
+                    pos = self._row(base, idx)
+                    content, meta = self._read_bytes(base, pos)
+                    row = base.rows[pos]
+                    reference = self._string(base, row["reference"])
+                    collection = self._string(base, row["collection"])
+                blob.write(content)
+                blob.write(meta)
+                rows[n] = (idx, offset, len(content), offset + len(content), len(meta),
+                           code(reference), code(collection))
+                offset += len(content) + len(meta)
+
+            blob.flush()
+            os.fsync(blob.fileno())
+
+        tmp_rows = rows_path + ".tmp.npy"
+        with open(tmp_rows, "wb") as f:
+            np.save(f, rows)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_strings = strings_path + ".tmp"
+        with open(tmp_strings, "w", encoding="utf-8") as f:
+            json.dump(list(strings), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if prefix == self.prefix:
+            # Sobrescribir archivos mapeados falla en Windows
+            self.close()
+        os.replace(tmp_blob, blob_path)
+        os.replace(tmp_strings, strings_path)
+        os.replace(tmp_rows, rows_path)
+        self.prefix = prefix
+        # Primero el snapshot nuevo y después se vacían los cambios que ya contiene
+        self._open()
+        self._pending.clear()
+        self._updated.clear()
+        self._deleted.clear()
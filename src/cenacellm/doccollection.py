@@ -9,6 +9,14 @@ from cenacellm.types import Text, TextMetadata
 import uuid
 from uuid import uuid4
 import os
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _splitter(chunk_size: int, max_overlap: int) -> TextSplitter:
+    # Un splitter por configuración y proceso, en lugar de uno por llamada
+    return TextSplitter(chunk_size, max_overlap)
+
 
 class DisjointCollection(DocCollection):
     def __init__(self):
@@ -16,7 +24,7 @@ class DisjointCollection(DocCollection):
         self.max_overlap = 200
 
     def get_chunks(self, texts: Union[Text, List[Text]]):
-        splitter = TextSplitter(self.chunk_size, self.max_overlap)
+        splitter = _splitter(self.chunk_size, self.max_overlap)
         if isinstance(texts, Text):
             texts = [texts]
 
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+from pydantic import BaseModel
+from cenacellm.types import Vector
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Forma canónica para la clave: NFC y espacios colapsados."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class CacheStats(BaseModel):
+    memory_hits : int = 0
+    disk_hits : int = 0
+    misses : int = 0
+    memory_entries : int = 0
+    disk_entries : int = 0
+    evicted : int = 0          # Entradas borradas del disco por superar el límite
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total else 0.0
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings en dos niveles: un LRU en memoria delante de una tabla
+    sqlite. La clave es sha256(modelo + texto normalizado), así que cambiar de
+    modelo nunca devuelve vectores de otro.
+
+    Los aciertos en memoria no tocan el disco; un acierto en disco sube la
+    entrada al LRU y renueva su `last_used`. Cuando la tabla supera `max_disk`
+    entradas se borran las menos usadas recientemente.
+    Es segura entre hilos y varios procesos pueden compartir el archivo.
+    """
+
+    def __init__(self, path: str, max_memory: int = 10_000, max_disk: int = 1_000_000):
+        self.path = str(path)
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, Vector]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._db.commit()
+        self.stats.disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _remember(self, key: str, vector: Vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[Vector]]:
+        """Vectores en caché para cada texto (None si no está)."""
+        keys = [cache_key(model, text) for text in texts]
+        found: List[Optional[Vector]] = [None] * len(keys)
+        with self._lock:
+            missing = {}
+            for n, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[n] = vector
+                    self.stats.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(n)
+
+            if missing:
+                rows = []
+                pending = list(missing)
+                # sqlite limita el número de parámetros por consulta
+                for start in range(0, len(pending), 500):
+                    chunk = pending[start:start + 500]
+                    rows += self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype="float32").copy()
+                    self._remember(key, vector)
+                    for n in missing.pop(key):
+                        found[n] = vector
+                        self.stats.disk_hits += 1
+                if rows:
+                    now = time.time()
+                    self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key, _ in rows])
+                    self._db.commit()
+                self.stats.misses += sum(len(positions) for positions in missing.values())
+            self.stats.memory_entries = len(self._memory)
+        return found
+
+    def get(self, model: str, text: str) -> Optional[Vector]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Vector]):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                vector = np.asarray(vector, dtype="float32")
+                self._remember(key, vector)
+                rows.append((key, model, len(vector), vector.tobytes(), now))
+            inserted = self._db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows).rowcount
+            self._db.commit()
+            self.stats.disk_entries += max(inserted, 0)
+            if self.stats.disk_entries > self.max_disk:
+                # Otros procesos también insertan: se recuenta antes de desalojar
+                self.stats.disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if self.stats.disk_entries > self.max_disk:
+                    self._evict()
+            self.stats.memory_entries = len(self._memory)
+
+    def _evict(self):
+        # Se baja a un 90 % del límite para no desalojar en cada inserción
+        excess = self.stats.disk_entries - int(self.max_disk * 0.9)
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._db.commit()
+        self.stats.evicted += excess
+        self.stats.disk_entries -= excess
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM embeddings")
+            self._db.commit()
+            self.stats = CacheStats()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
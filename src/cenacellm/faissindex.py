@@ -0,0 +1,112 @@
+import math
+import faiss
+import numpy as np
+from typing import Literal, Optional
+from pydantic import BaseModel
+
+type IndexType = Literal["flat", "ivf_flat", "ivf_pq", "hnsw"]
+
+IVF_TYPES = ("ivf_flat", "ivf_pq")
+
+
+class IndexConfig(BaseModel):
+    index_type : IndexType = "flat"       # Tipo de índice deseado
+    auto_ivf_threshold : Optional[int] = 100_000  # Con "flat", pasar a IVF-Flat al superar este ntotal
+    train_min : int = 10_000               # Vectores mínimos para entrenar un IVF
+    nlist : Optional[int] = None           # Listas IVF (None = 4·sqrt(n))
+    pq_m : int = 64                        # Subcuantizadores de IVF-PQ
+    pq_nbits : int = 8
+    hnsw_m : int = 32
+    ef_construction : int = 200
+    nprobe : int = 16                      # Valor por defecto por consulta en IVF
+    ef_search : int = 64                   # Valor por defecto por consulta en HNSW
+
+
+def index_kind(index: faiss.Index) -> IndexType:
+    """Identifica el tipo de un índice creado por `build_index`."""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def _nlist_for(config: IndexConfig, n: int) -> int:
+    if config.nlist:
+        return config.nlist
+    # Regla habitual de FAISS (~4·sqrt(n)), con al menos 39 puntos de entrenamiento por lista
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _pq_m_for(config: IndexConfig, dim: int) -> int:
+    # PQ exige que m divida a la dimensión
+    return next(m for m in range(min(config.pq_m, dim), 0, -1) if dim % m == 0)
+
+
+def build_index(kind: IndexType, dim: int, config: IndexConfig, training: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Crea un índice vacío que acepta ids propios (`add_with_ids`).
+    Los IVF se entrenan con `training` y gestionan los ids de forma nativa;
+    Flat y HNSW se envuelven en un IndexIDMap2.
+    """
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    if kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        hnsw.hnsw.efConstruction = config.ef_construction
+        hnsw.hnsw.efSearch = config.ef_search
+        return faiss.IndexIDMap2(hnsw)
+
+    if training is None or not len(training):
+        raise ValueError(f"El índice {kind} necesita vectores de entrenamiento")
+    nlist = _nlist_for(config, len(training))
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m_for(config, dim), config.pq_nbits)
+    else:
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    index.own_fields = True
+    quantizer.this.disown()
+    index.train(training)
+    prepare_index(index, config)
+    return index
+
+
+def prepare_index(index: faiss.Index, config: IndexConfig) -> None:
+    """Ajusta un índice recién creado o leído de disco para su uso en el store."""
+    if isinstance(index, faiss.IndexIVF):
+        # El mapa directo permite reconstruct() y borrados por id externo
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.nprobe = config.nprobe
+
+
+def search_params(
+        index: faiss.Index,
+        selector: Optional[faiss.IDSelector] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+) -> Optional[faiss.SearchParameters]:
+    """Parámetros de búsqueda por consulta según el tipo de índice."""
+    kind = index_kind(index)
+    # Pasar sel al constructor hace que el wrapper de Python mantenga viva la referencia
+    extra = {"sel": selector} if selector is not None else {}
+    if kind in IVF_TYPES:
+        return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, **extra)
+    if kind == "hnsw":
+        ef = ef_search or faiss.downcast_index(index.index).hnsw.efSearch
+        return faiss.SearchParametersHNSW(efSearch=ef, **extra)
+    return faiss.SearchParameters(**extra) if extra else None
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    return index_kind(index) != "hnsw"
+
+
+def remove_ids(index: faiss.Index, ids: np.ndarray) -> int:
+    """Borra ids externos; el mapa directo de los IVF solo acepta IDSelectorArray."""
+    if index_kind(index) in IVF_TYPES:
+        return index.remove_ids(faiss.IDSelectorArray(ids))
+    return index.remove_ids(ids)
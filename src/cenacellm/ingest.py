@@ -0,0 +1,307 @@
+import hashlib
+import multiprocessing
+import os
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from pydantic import BaseModel, Field, computed_field
+from cenacellm.tools.doccollection import DocCollection
+from cenacellm.tools.embedder import Embedder
+from cenacellm.types import Chunks, Matrix, Text
+
+
+class IngestConfig(BaseModel):
+    extract_workers : Optional[int] = None     # Procesos que extraen y dividen PDFs (None = núcleos disponibles)
+    max_pending_files : Optional[int] = None   # PDFs en vuelo en el pool (None = 2 por proceso)
+    embed_workers : int = 2                    # Peticiones de embedding concurrentes
+    embed_batch_size : int = 64                # Chunks por petición de embedding
+    max_pending_batches : int = 16             # Lotes esperando embedding antes de frenar la extracción
+
+
+class StageStats(BaseModel):
+    items : int = 0             # Documentos (extracción) o chunks (embedding, guardado) terminados
+    busy_seconds : float = 0.0  # Tiempo de trabajo acumulado de la etapa
+    pending : int = 0           # Trabajo encolado o en curso
+
+    @computed_field
+    @property
+    def per_second(self) -> float:
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class IngestReport(BaseModel):
+    files_total : int = 0
+    files_done : int = 0
+    files_failed : List[str] = Field(default_factory=list)
+    chunks : int = 0            # Chunks embebidos y añadidos
+    chunks_reused : int = 0     # Chunks sin cambios que conservan su vector
+    chunks_removed : int = 0    # Chunks que ya no están en el documento
+    elapsed : float = 0.0
+    stages : Dict[str, StageStats] = Field(
+        default_factory=lambda: {name: StageStats() for name in ("extract", "embed", "store")}
+    )
+
+    def summary(self) -> str:
+        parts = [f"{name}: {stage.items} en {stage.busy_seconds:.1f}s ({stage.per_second:.1f}/s)"
+                 for name, stage in self.stages.items()]
+        return (f"{self.files_done}/{self.files_total} PDFs, {self.chunks} chunks nuevos, "
+                f"{self.chunks_reused} reutilizados, {self.chunks_removed} retirados en {self.elapsed:.1f}s; "
+                + "; ".join(parts))
+
+
+class IngestFile(NamedTuple):
+    file_key : str
+    path : str
+    collection : Optional[str]
+    reference : Optional[str] = None   # Documento ya indexado: se reindexa de forma incremental
+
+
+class IngestedFile(NamedTuple):
+    file_key : str
+    path : str
+    reference : Optional[str]
+    chunks : int      # Chunks del documento tras la ingesta
+    embedded : int    # Chunks nuevos o modificados que se embebieron
+
+
+def file_hash(path: str) -> str:
+    """sha256 del contenido de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# --- Etapa de extracción (se ejecuta en los procesos del pool) --------------
+
+_worker_collection: Optional[DocCollection] = None
+
+
+def _init_worker(collection: DocCollection):
+    global _worker_collection
+    _worker_collection = collection
+
+
+def _extract(path: str, collection_name: Optional[str], collection: Optional[DocCollection] = None) -> Tuple[Chunks, float]:
+    """Lee un PDF y lo divide en chunks; devuelve también el tiempo empleado."""
+    collection = collection or _worker_collection
+    start = time.perf_counter()
+    texts = collection.load_pdf(path, collection=collection_name)
+    chunks = [
+        Text(content=chunk.content,
+             metadata=chunk.metadata.model_copy(update={"content_hash": chunk_hash(chunk.content)}))
+        for chunk in collection.get_chunks(texts)
+    ]
+    return chunks, time.perf_counter() - start
+
+
+def _embed(embedder: Embedder, contents: List[str]) -> Tuple[Matrix, float]:
+    start = time.perf_counter()
+    vectors = embedder.vectorize_many(contents, batch_size=len(contents))
+    return vectors, time.perf_counter() - start
+
+
+class _Document:
+    """
+    Cambios de un PDF a la espera de que terminen sus lotes de embedding:
+    `chunks` son los que hay que embeber, `updates` los que conservan su vector
+    pero cambian de metadata y `stale` los ids que ya no forman parte del documento.
+    """
+
+    def __init__(self, file: IngestFile, chunks: Chunks, total: int,
+                 updates: List[Tuple[int, Text]], stale: List[int], batch_size: int):
+        self.file = file
+        self.chunks = chunks
+        self.total = total
+        self.updates = updates
+        self.stale = stale
+        self.batches = -(-len(chunks) // batch_size)
+        self.vectors: List[Optional[Matrix]] = [None] * self.batches
+        self.remaining = self.batches
+        self.failed = False
+
+
+class IngestPipeline:
+    """
+    Ingesta de PDFs por etapas:
+
+    1. extracción + división en chunks, en un pool de procesos;
+    2. embedding por lotes, con un número acotado de peticiones concurrentes;
+    3. alta en el vectorstore con un `add_texts` por documento.
+
+    La extracción solo recibe PDFs nuevos mientras haya hueco en el pool y la
+    cola de lotes de embedding no supere `max_pending_batches`, de modo que la
+    memoria queda acotada aunque el embedding sea la etapa lenta.
+    `run` es un generador: entrega cada documento en cuanto queda guardado.
+    """
+
+    def __init__(self, collection: DocCollection, embedder: Embedder, vectorstore, config: Optional[IngestConfig] = None):
+        self.collection = collection
+        self.embedder = embedder
+        self.vectorstore = vectorstore
+        self.config = config or IngestConfig()
+        self.report = IngestReport()
+
+    def _diff(self, file: IngestFile, chunks: Chunks, batch_size: int) -> _Document:
+        """
+        Compara los chunks extraídos con los que el documento ya tiene en el
+        vectorstore, por hash de contenido: solo los nuevos o modificados se
+        embeben; los demás conservan id y vector.
+        """
+        if file.reference is None:
+            return _Document(file, chunks, len(chunks), [], [], batch_size)
+
+        # El documento conserva su reference aunque load_pdf genere una nueva
+        chunks = [chunk.model_copy(update={"metadata": chunk.metadata.model_copy(update={"reference": file.reference})})
+                  for chunk in chunks]
+        previous: Dict[str, Deque[Tuple[int, Text]]] = {}
+        for idx in sorted(self.vectorstore.ids_for(reference=file.reference)):
+            old = self.vectorstore.chunks[idx]
+            digest = getattr(old.metadata, "content_hash", None) or chunk_hash(old.content)
+            previous.setdefault(digest, deque()).append((idx, old))
+
+        fresh: Chunks = []
+        updates: List[Tuple[int, Text]] = []
+        for chunk in chunks:
+            matches = previous.get(chunk.metadata.content_hash)
+            if not matches:
+                fresh.append(chunk)
+                continue
+            idx, old = matches.popleft()
+            if old != chunk:
+                updates.append((idx, chunk))
+        stale = [idx for matches in previous.values() for idx, _ in matches]
+        return _Document(file, fresh, len(chunks), updates, stale, batch_size)
+
+    def _extract_pool(self, files: int) -> Tuple[Executor, int]:
+        workers = max(1, min(self.config.extract_workers or os.cpu_count() or 1, files))
+        if workers == 1:
+            # Con un solo proceso no compensa arrancar un pool
+            return ThreadPoolExecutor(max_workers=1), workers
+        # spawn evita heredar hilos (uvicorn, compactación, OpenMP) en los procesos hijos
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.collection,),
+        )
+        return pool, workers
+
+    def run(
+            self,
+            files: Iterable[IngestFile],
+            on_progress: Optional[Callable[[IngestReport], None]] = None,
+    ) -> Iterator[IngestedFile]:
+        files = list(files)
+        self.report = report = IngestReport(files_total=len(files))
+        if not files:
+            return
+        extract, embed, store = (report.stages[name] for name in ("extract", "embed", "store"))
+        start = time.perf_counter()
+
+        extract_pool, workers = self._extract_pool(len(files))
+        inline = isinstance(extract_pool, ThreadPoolExecutor)
+        embed_pool = ThreadPoolExecutor(max_workers=self.config.embed_workers)
+        max_pending_files = self.config.max_pending_files or 2 * workers
+        batch_size = self.config.embed_batch_size
+
+        queue: Deque[IngestFile] = deque(files)
+        batches: Deque[Tuple[_Document, int]] = deque()  # Lotes esperando hueco en el pool de embedding
+        extracting: Dict[Future, IngestFile] = {}
+        embedding: Dict[Future, Tuple[_Document, int]] = {}
+
+        def fail(file: IngestFile, error: Exception):
+            print(f"Error procesando {file.path}: {error}")
+            report.files_failed.append(file.file_key)
+
+        def finish(document: _Document) -> IngestedFile:
+            began = time.perf_counter()
+            # Primero se añade lo nuevo y luego se retira lo viejo, para que el
+            # documento no desaparezca de las búsquedas durante el cambio
+            if document.chunks:
+                self.vectorstore.add_texts(np.vstack(document.vectors), document.chunks)
+            if document.updates:
+                self.vectorstore.update_texts(document.updates)
+            if document.stale:
+                self.vectorstore.delete_ids(document.stale)
+            store.busy_seconds += time.perf_counter() - began
+            store.items += len(document.chunks)
+            report.chunks += len(document.chunks)
+            report.chunks_reused += document.total - len(document.chunks)
+            report.chunks_removed += len(document.stale)
+            report.files_done += 1
+
+            reference = document.file.reference
+            if reference is None and document.chunks:
+                reference = document.chunks[0].metadata.reference
+            return IngestedFile(document.file.file_key, document.file.path, reference,
+                                document.total, len(document.chunks))
+
+        def refill():
+            while batches and len(embedding) < self.config.embed_workers * 2:
+                document, n = batches.popleft()
+                if document.failed:
+                    continue
+                contents = [c.content for c in document.chunks[n * batch_size:(n + 1) * batch_size]]
+                embedding[embed_pool.submit(_embed, self.embedder, contents)] = (document, n)
+            while queue and len(extracting) < max_pending_files and len(batches) < self.config.max_pending_batches:
+                file = queue.popleft()
+                args = (file.path, file.collection, self.collection) if inline else (file.path, file.collection)
+                extracting[extract_pool.submit(_extract, *args)] = file
+            extract.pending = len(queue) + len(extracting)
+            embed.pending = len(batches) + len(embedding)
+
+        try:
+            refill()
+            while extracting or embedding:
+                done, _ = wait([*extracting, *embedding], return_when=FIRST_COMPLETED)
+                ready: List[_Document] = []
+                for future in done:
+                    if future in extracting:
+                        file = extracting.pop(future)
+                        try:
+                            chunks, seconds = future.result()
+                        except Exception as e:
+                            fail(file, e)
+                            continue
+                        extract.items += 1
+                        extract.busy_seconds += seconds
+                        document = self._diff(file, chunks, batch_size)
+                        if not document.batches:
+                            ready.append(document)
+                        batches.extend((document, n) for n in range(document.batches))
+                    else:
+                        document, n = embedding.pop(future)
+                        if document.failed:
+                            continue
+                        try:
+                            vectors, seconds = future.result()
+                        except Exception as e:
+                            document.failed = True
+                            fail(document.file, e)
+                            continue
+                        embed.items += len(vectors)
+                        embed.busy_seconds += seconds
+                        document.vectors[n] = vectors
+                        document.remaining -= 1
+                        if not document.remaining:
+                            ready.append(document)
+                refill()
+                for document in ready:
+                    yield finish(document)
+                report.elapsed = time.perf_counter() - start
+                if on_progress:
+                    on_progress(report)
+        finally:
+            # Si el consumidor abandona el generador, no se sigue procesando nada
+            embed_pool.shutdown(wait=False, cancel_futures=True)
+            extract_pool.shutdown(wait=True, cancel_futures=True)
+            report.elapsed = time.perf_counter() - start
+            print(f"Ingesta: {report.summary()}")
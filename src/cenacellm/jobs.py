@@ -0,0 +1,206 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Literal, Optional
+from uuid import uuid4
+from pydantic import BaseModel, Field
+from pymongo.collection import Collection
+
+type JobStatus = Literal["pending", "running", "completed", "failed", "cancelled"]
+
+FINISHED: tuple = ("completed", "failed", "cancelled")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro de un trabajo cuando alguien pidió cancelarlo."""
+
+
+class Job(BaseModel):
+    id : str
+    kind : str                                   # p. ej. "load_documents"
+    status : JobStatus = "pending"
+    progress : Dict[str, Any] = Field(default_factory=dict)
+    result : Any = None
+    error : Optional[str] = None
+    created_at : str = Field(default_factory=_now)
+    started_at : Optional[str] = None
+    finished_at : Optional[str] = None
+
+
+class JobContext:
+    """Lo que recibe la función de un trabajo para informar avance y atender la cancelación."""
+
+    def __init__(self, job: Job, cancel: threading.Event, queue: Optional["JobQueue"] = None):
+        self.job = job
+        self._cancel = cancel
+        self._queue = queue
+
+    @property
+    def cancelled(self) -> bool:
+        # La cancelación puede llegar por otro worker: se consulta también el registro compartido
+        if not self._cancel.is_set() and self._queue is not None and self._queue.cancel_requested(self.job.id):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.job.id)
+
+    def report(self, progress: Dict[str, Any]):
+        """Publica el avance; es también el punto en el que se atiende una cancelación."""
+        self.job.progress = progress
+        if self._queue is not None:
+            self._queue._save(self.job, "progress")
+        self.check_cancelled()
+
+
+class JobQueue:
+    """
+    Cola de trabajos largos (ingesta, soluciones) sobre un pool de hilos acotado,
+    para que no ocupen el event loop ni el threadpool de las peticiones.
+
+    Cada trabajo tiene un id, un estado y un avance consultables mientras corre.
+    La cancelación es cooperativa: un trabajo pendiente no llega a empezar y uno
+    en curso se detiene en su siguiente `report`/`check_cancelled`.
+    Se conservan los últimos `max_finished` trabajos terminados.
+
+    Con `collection` el registro de trabajos vive en Mongo y no en la memoria
+    del proceso: el worker que ejecuta un trabajo escribe ahí su estado, avance
+    y resultado, y cualquier worker de la API puede consultarlo o cancelarlo
+    (con varios workers de gunicorn cada petición puede caer en uno distinto).
+    Un trabajo cuyo proceso muere a medias se queda como "running".
+    """
+
+    def __init__(self, max_workers: int = 1, max_finished: int = 100,
+                 collection: Optional[Collection] = None, cancel_poll_interval: float = 1.0):
+        self.max_finished = max_finished
+        self.collection = collection
+        self.cancel_poll_interval = cancel_poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._cancel: Dict[str, threading.Event] = {}
+        self._last_poll: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        if collection is not None:
+            collection.create_index([("kind", 1), ("created_at", -1)])
+            collection.create_index([("status", 1), ("finished_at", 1)])
+
+    # --- Registro compartido (Mongo) -------------------------------------------
+
+    def _save(self, job: Job, *fields: str):
+        """Escribe en Mongo los campos indicados del trabajo (todos si no se indica ninguno)."""
+        if self.collection is None:
+            return
+        data = job.model_dump(include=set(fields) if fields else None, exclude={"id"})
+        self.collection.update_one({"_id": job.id}, {"$set": data}, upsert=True)
+
+    @staticmethod
+    def _from_doc(doc: Optional[Dict[str, Any]]) -> Optional[Job]:
+        if doc is None:
+            return None
+        doc.pop("cancel_requested", None)
+        return Job(id=doc.pop("_id"), **doc)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        """Si alguien pidió cancelar el trabajo en el registro compartido (como mucho una consulta por intervalo)."""
+        if self.collection is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_poll.get(job_id, 0.0) < self.cancel_poll_interval:
+                return False
+            self._last_poll[job_id] = now
+        doc = self.collection.find_one({"_id": job_id}, {"cancel_requested": 1})
+        return bool(doc and doc.get("cancel_requested"))
+
+    # --- Ejecución ---------------------------------------------------------------
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """Encola `fn(ctx, *args, **kwargs)` y devuelve el trabajo sin esperar a que termine."""
+        job = Job(id=uuid4().hex, kind=kind)
+        cancel = threading.Event()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._cancel[job.id] = cancel
+            self._prune()
+        self._save(job)
+        self._executor.submit(self._run, job, cancel, fn, args, kwargs)
+        return job.model_copy()
+
+    def _run(self, job: Job, cancel: threading.Event, fn: Callable[..., Any], args, kwargs):
+        ctx = JobContext(job, cancel, self if self.collection is not None else None)
+        if ctx.cancelled:
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        job.started_at = _now()
+        self._save(job, "status", "started_at")
+        try:
+            job.result = fn(ctx, *args, **kwargs)
+            self._finish(job, "completed")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            self._finish(job, "failed")
+
+    def _finish(self, job: Job, status: JobStatus):
+        job.status = status
+        job.finished_at = _now()
+        self._save(job, "status", "finished_at", "result", "error", "progress")
+        with self._lock:
+            self._cancel.pop(job.id, None)
+            self._last_poll.pop(job.id, None)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+        if self.collection is not None:
+            old = self.collection.find({"status": {"$in": list(FINISHED)}}, {"_id": 1}) \
+                .sort("finished_at", -1).skip(self.max_finished)
+            old_ids = [doc["_id"] for doc in old]
+            if old_ids:
+                self.collection.delete_many({"_id": {"$in": old_ids}})
+
+    # --- Consulta y cancelación --------------------------------------------------
+
+    def get(self, job_id: str) -> Optional[Job]:
+        if self.collection is not None:
+            return self._from_doc(self.collection.find_one({"_id": job_id}))
+        job = self._jobs.get(job_id)
+        return job.model_copy() if job is not None else None
+
+    def list(self, kind: Optional[str] = None) -> List[Job]:
+        if self.collection is not None:
+            query = {"kind": kind} if kind else {}
+            return [self._from_doc(doc) for doc in self.collection.find(query).sort("created_at", -1)]
+        return [job.model_copy() for job in reversed(self._jobs.values()) if kind is None or job.kind == kind]
+
+    def cancel(self, job_id: str) -> bool:
+        """Pide cancelar un trabajo. Devuelve False si no existe o ya terminó."""
+        with self._lock:
+            cancel = self._cancel.get(job_id)
+        if cancel is not None:
+            cancel.set()
+        if self.collection is not None:
+            # El trabajo puede estar en otro worker: la marca la ve en su siguiente `report`
+            result = self.collection.update_one(
+                {"_id": job_id, "status": {"$nin": list(FINISHED)}},
+                {"$set": {"cancel_requested": True}}
+            )
+            return cancel is not None or result.matched_count > 0
+        return cancel is not None
+
+    def shutdown(self):
+        for cancel in list(self._cancel.values()):
+            cancel.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
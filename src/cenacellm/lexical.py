@@ -0,0 +1,282 @@
+import json
+import os
+import re
+import unicodedata
+import numpy as np
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+# Parámetros habituales de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constante de Reciprocal Rank Fusion: amortigua la ventaja de los primeros puestos
+RRF_K = 60
+
+# Un término es una secuencia alfanumérica, incluidos los códigos con guiones,
+# puntos o barras (SE-1234, 52-T1, 3.5); de esos también se indexan las partes
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+# "se" no está: en los documentos suele ser la abreviatura de subestación
+STOPWORDS = frozenset(
+    "a al como con de del e el en es la las lo los o para por que su sus un una y".split()
+)
+
+POSTING_DTYPE = np.dtype([("id", "<i8"), ("tf", "<i4")])
+DOC_DTYPE = np.dtype([("id", "<i8"), ("length", "<i4")])
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos de un texto: en minúsculas, sin acentos y con los códigos enteros y por partes."""
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    terms = []
+    for token in _TOKEN.findall(text):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in _PART.findall(token) if part not in STOPWORDS)
+    return terms
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = RRF_K) -> List[Tuple[float, int]]:
+    """
+    Combina varias listas de ids ordenadas (la mejor primero) con Reciprocal
+    Rank Fusion: cada id suma 1 / (rrf_k + puesto) por lista en la que aparece.
+    Devuelve los `k` mejores como pares (puntuación, id), de mayor a menor.
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(((score, idx) for idx, score in scores.items()), key=lambda hit: (-hit[0], hit[1]))[:k]
+
+
+def lexical_paths(folder_path: str, prefix: str) -> Tuple[str, str, str, str]:
+    return (
+        os.path.join(folder_path, f"{prefix}.terms.json"),
+        os.path.join(folder_path, f"{prefix}.offsets.npy"),
+        os.path.join(folder_path, f"{prefix}.postings.npy"),
+        os.path.join(folder_path, f"{prefix}.docs.npy"),
+    )
+
+
+class _Snapshot(NamedTuple):
+    terms: List[str]
+    vocab: Dict[str, int]         # término -> fila en `offsets`
+    offsets: np.ndarray           # postings del término i: postings[offsets[i]:offsets[i + 1]]
+    postings: np.ndarray          # (id, tf), ordenados por término y por id
+    docs: np.ndarray              # (id, longitud), ordenados por id
+
+
+_EMPTY = _Snapshot([], {}, np.zeros(1, dtype="int64"), np.empty(0, dtype=POSTING_DTYPE),
+                   np.empty(0, dtype=DOC_DTYPE))
+
+
+class LexicalIndex:
+    """
+    Índice invertido BM25 sobre el texto de los chunks, con la misma forma que
+    el vector store: un snapshot en disco (`<prefix>.*.npy`, mmap) más los
+    cambios posteriores en memoria. Los chunks añadidos después del snapshot
+    van a un índice pequeño en diccionarios (`delta`) y los borrados o
+    modificados del snapshot se ocultan (`masked`) hasta el siguiente `write`.
+
+    No es seguro entre hilos por sí mismo: `FAISSVectorStore` lo usa siempre
+    con su `_index_lock`.
+    """
+
+    def __init__(self, folder_path: str, prefix: str = "bm25"):
+        self.folder_path = folder_path
+        self.prefix = prefix
+        self._base = _EMPTY
+        self.persisted = False
+
+        self._delta: Dict[str, Dict[int, int]] = {}      # término -> {id: tf}
+        self._delta_docs: Dict[int, Counter] = {}        # id -> términos del chunk
+        self.masked: Set[int] = set()                    # Ids del snapshot que ya no cuentan
+        self.n_docs = 0
+        self.total_length = 0
+        self._open()
+
+    def _open(self):
+        terms_path, offsets_path, postings_path, docs_path = lexical_paths(self.folder_path, self.prefix)
+        if not os.path.exists(terms_path):
+            return
+        with open(terms_path, encoding="utf-8") as f:
+            terms = json.load(f)
+        docs = np.load(docs_path, mmap_mode="r")
+        self._base = _Snapshot(
+            terms,
+            {term: row for row, term in enumerate(terms)},
+            np.load(offsets_path, mmap_mode="r"),
+            np.load(postings_path, mmap_mode="r"),
+            docs,
+        )
+        self.persisted = True
+        self.n_docs = len(docs)
+        self.total_length = int(docs["length"].sum())
+
+    @staticmethod
+    def remove_files(folder_path: str, prefix: str):
+        for path in lexical_paths(folder_path, prefix):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    # --- Escritura -----------------------------------------------------------
+
+    def _base_length(self, idx: int) -> Optional[int]:
+        docs = self._base.docs
+        pos = int(np.searchsorted(docs["id"], idx))
+        if pos < len(docs) and docs["id"][pos] == idx:
+            return int(docs["length"][pos])
+        return None
+
+    def add(self, idx: int, content: str):
+        """Indexa (o reindexa, si ya estaba) el texto de un chunk."""
+        idx = int(idx)
+        self.remove(idx)
+        counts = Counter(tokenize(content))
+        self._delta_docs[idx] = counts
+        for term, tf in counts.items():
+            self._delta.setdefault(term, {})[idx] = tf
+        self.n_docs += 1
+        self.total_length += sum(counts.values())
+
+    def remove(self, idx: int):
+        idx = int(idx)
+        counts = self._delta_docs.pop(idx, None)
+        if counts is not None:
+            for term in counts:
+                postings = self._delta[term]
+                del postings[idx]
+                if not postings:
+                    del self._delta[term]
+            self.n_docs -= 1
+            self.total_length -= sum(counts.values())
+        if idx not in self.masked:
+            length = self._base_length(idx)
+            if length is not None:
+                self.masked.add(idx)
+                self.n_docs -= 1
+                self.total_length -= length
+
+    def write(self, prefix: Optional[str] = None):
+        """
+        Escribe un snapshot compacto con el estado actual (snapshot anterior sin
+        los ocultos, más el delta) en `prefix`. No cambia lo que se lee: para
+        eso se abre un `LexicalIndex` nuevo sobre los archivos escritos.
+        """
+        prefix = prefix or self.prefix
+        base = self._base
+        masked = np.fromiter(self.masked, dtype="int64", count=len(self.masked))
+
+        # Postings del snapshot como columnas (fila del término, id, tf), sin los ocultos
+        rows = np.repeat(np.arange(len(base.terms), dtype="int64"), np.diff(base.offsets))
+        ids, tfs = np.asarray(base.postings["id"]), np.asarray(base.postings["tf"])
+        docs = np.asarray(base.docs)
+        if len(masked):
+            live = ~np.isin(ids, masked)
+            rows, ids, tfs = rows[live], ids[live], tfs[live]
+            docs = docs[~np.isin(docs["id"], masked)]
+
+        terms, vocab = list(base.terms), dict(base.vocab)
+        delta_rows, delta_ids, delta_tfs = [], [], []
+        for term, postings in self._delta.items():
+            row = vocab.get(term)
+            if row is None:
+                row = vocab[term] = len(terms)
+                terms.append(term)
+            delta_rows += [row] * len(postings)
+            delta_ids += postings.keys()
+            delta_tfs += postings.values()
+        rows = np.concatenate([rows, np.array(delta_rows, dtype="int64")])
+        ids = np.concatenate([ids, np.array(delta_ids, dtype="int64")])
+        tfs = np.concatenate([tfs, np.array(delta_tfs, dtype="int32")])
+
+        # Se descartan los términos que se quedaron sin postings
+        counts = np.bincount(rows, minlength=len(terms))
+        used = counts > 0
+        rows = (np.cumsum(used) - 1)[rows]
+        order = np.lexsort((ids, rows))
+        postings = np.empty(len(order), dtype=POSTING_DTYPE)
+        postings["id"], postings["tf"] = ids[order], tfs[order]
+        offsets = np.concatenate([[0], np.cumsum(counts[used])]).astype("int64")
+        terms = [term for term, keep in zip(terms, used.tolist()) if keep]
+
+        delta_docs = np.array([(idx, sum(doc_terms.values())) for idx, doc_terms in self._delta_docs.items()],
+                              dtype=DOC_DTYPE)
+        docs = np.concatenate([docs, delta_docs])
+        docs = docs[np.argsort(docs["id"], kind="stable")]
+
+        os.makedirs(self.folder_path, exist_ok=True)
+        terms_path, *array_paths = lexical_paths(self.folder_path, prefix)
+        # Los arrays antes que los términos: sin terms.json el snapshot no cuenta como escrito
+        for path, array in zip(array_paths, (offsets, postings, docs)):
+            tmp = path[:-len(".npy")] + ".tmp.npy"
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        with open(terms_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(terms_path + ".tmp", terms_path)
+
+    # --- Búsqueda ------------------------------------------------------------
+
+    def _postings(self, term: str, masked: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ids, frecuencias y longitudes de los chunks vivos que contienen `term`."""
+        ids, tfs, lengths = [], [], []
+        base = self._base
+        row = base.vocab.get(term)
+        if row is not None:
+            postings = base.postings[base.offsets[row]:base.offsets[row + 1]]
+            if len(masked):
+                postings = postings[~np.isin(postings["id"], masked)]
+            ids.append(postings["id"])
+            tfs.append(postings["tf"])
+            lengths.append(base.docs["length"][np.searchsorted(base.docs["id"], postings["id"])])
+        delta = self._delta.get(term)
+        if delta:
+            ids.append(np.fromiter(delta.keys(), dtype="int64", count=len(delta)))
+            tfs.append(np.fromiter(delta.values(), dtype="int32", count=len(delta)))
+            lengths.append(np.fromiter((sum(self._delta_docs[idx].values()) for idx in delta),
+                                       dtype="int64", count=len(delta)))
+        if not ids:
+            return np.empty(0, dtype="int64"), np.empty(0), np.empty(0)
+        return np.concatenate(ids), np.concatenate(tfs).astype("float64"), np.concatenate(lengths)
+
+    def search(self, query: str, k: int, allowed: Optional[Set[int]] = None) -> List[Tuple[float, int]]:
+        """Los `k` chunks con mayor puntuación BM25 para `query`, restringidos a `allowed`; pares (puntuación, id)."""
+        terms = set(tokenize(query))
+        if k <= 0 or not terms or not self.n_docs or allowed is not None and not allowed:
+            return []
+        avg_length = max(self.total_length / self.n_docs, 1.0)
+        masked = np.fromiter(self.masked, dtype="int64", count=len(self.masked))
+
+        all_ids, all_scores = [], []
+        for term in terms:
+            ids, tfs, lengths = self._postings(term, masked)
+            if not len(ids):
+                continue
+            idf = np.log(1 + (self.n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not all_ids:
+            return []
+
+        ids, scores = np.concatenate(all_ids), np.concatenate(all_scores)
+        if allowed is not None:
+            keep = np.isin(ids, np.fromiter(allowed, dtype="int64", count=len(allowed)))
+            ids, scores = ids[keep], scores[keep]
+        unique, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        top = np.lexsort((unique, -totals))[:k]
+        return [(float(totals[i]), int(unique[i])) for i in top]
@@ -1,17 +1,24 @@
 import os
 import json
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Generator, Dict, Any, List, Tuple, Optional
-from pymongo import MongoClient
+from typing import AsyncGenerator, Generator, Dict, Any, List, Set, Tuple, Optional
+from pymongo import AsyncMongoClient, MongoClient
 from bson.objectid import ObjectId
 from ollama import GenerateResponse
 
-from cenacellm.settings.clients import ollama as api, mongo_uri, db_name
+from cenacellm.settings.clients import ollama as api, ollama_async as async_api, mongo_uri, db_name
+from cenacellm.prompt import PromptBuilder
 from cenacellm.tools.assistant import Assistant
 from cenacellm.types import (
     LLMError,
     CallMetadata,
+    ConversationMemory,
+    PromptReport,
+    RerankReport,
     call_metadata,
     Question,
     Chunks,
@@ -20,7 +27,15 @@ from cenacellm.types import (
 class OllamaAssistant(Assistant):
     def __init__(self):
         self.model = "gemma3:4b"
-        self.memory_window_size = 5
+        self.memory_window_size = 5 # Mensajes que se leen del historial; el prompt builder decide cuántos caben
+        self.summary_max_tokens = 256 # Longitud máxima del resumen de una conversación
+        self.prompt_builder = PromptBuilder(self)
+
+        # Los resúmenes se calculan en segundo plano tras cada turno, uno por conversación a la vez
+        self._summary_executor = ThreadPoolExecutor(max_workers=1)
+        self._summary_tasks: Set[asyncio.Task] = set()
+        self._summarizing: Set[Tuple[str, str]] = set()
+        self._summarizing_lock = threading.Lock()
 
         self.mongo_uri = mongo_uri
         self.db_name = db_name
@@ -32,9 +47,18 @@ class OllamaAssistant(Assistant):
         self.collection = self.db[self.collection_name]
         self.collection_backup = self.db[self.collection_backup_name]
 
+        # Cliente asíncrono para la ruta del chat; no bloquea el event loop
+        self.async_client = AsyncMongoClient(self.mongo_uri)
+        self.async_db = self.async_client[self.db_name]
+        self.async_collection = self.async_db[self.collection_name]
+        self.async_collection_backup = self.async_db[self.collection_backup_name]
+
         # Create indexes for efficient querying
         self.collection.create_index([("user_id", 1), ("conversation_id", 1)])
         self.collection.create_index([("user_id", 1), ("messages.id", 1)]) # For updating specific messages
+        self.collection.create_index([("user_id", 1), ("messages.metadata.disable", 1)]) # Soluciones "likeadas"
+        self.collection.create_index("conversation_id") # Búsqueda desde los tickets (solucion_id)
+        self.collection.create_index("messages.id") # Referencias de un mensaje por su id
 
 
     def load_history(self, user_id: str, conversation_id: str) -> list:
@@ -57,6 +81,171 @@ class OllamaAssistant(Assistant):
             upsert=True
         )
 
+    def _window_projection(self) -> Dict[str, Any]:
+        return {"_id": 0, "messages": {"$slice": -self.memory_window_size}}
+
+    def history_window(self, user_id: str, conversation_id: str) -> list:
+        """Últimos mensajes de la conversación que entran en el prompt; Mongo solo envía esos."""
+        doc = self.collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                       self._window_projection())
+        return doc.get("messages", []) if doc else []
+
+    def _memory_projection(self) -> Dict[str, Any]:
+        return {"_id": 0, "summary": 1, "messages": {"$slice": -self.memory_window_size}}
+
+    @staticmethod
+    def _memory(doc: Optional[Dict[str, Any]]) -> ConversationMemory:
+        """Resumen guardado y los mensajes de la ventana que todavía no cubre."""
+        if not doc:
+            return ConversationMemory(None, [])
+        messages = doc.get("messages", [])
+        summary = doc.get("summary") or {}
+        ids = [m.get("id") for m in messages]
+        if summary.get("last_id") in ids:
+            messages = messages[ids.index(summary["last_id"]) + 1:]
+        return ConversationMemory(summary.get("text"), messages)
+
+    def memory(self, user_id: str, conversation_id: str) -> ConversationMemory:
+        """
+        Memoria de la conversación para el prompt: el resumen de los turnos
+        anteriores y los mensajes recientes que aún no incluye (normalmente
+        solo el último turno).
+        """
+        doc = self.collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                       self._memory_projection())
+        return self._memory(doc)
+
+    # --- Resúmenes de conversación ---------------------------------------------
+
+    @staticmethod
+    def _summary_projection() -> Dict[str, Any]:
+        return {"_id": 0, "summary": 1, "messages.id": 1, "messages.role": 1, "messages.content": 1}
+
+    @staticmethod
+    def _pending_summary(doc: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], list]:
+        """Resumen actual y los mensajes que le faltan; el último turno se deja fuera, va literal en el prompt."""
+        if not doc:
+            return {}, []
+        summary = doc.get("summary") or {}
+        messages = doc.get("messages", [])[:-2]
+        ids = [m.get("id") for m in messages]
+        if summary.get("last_id") in ids:
+            messages = messages[ids.index(summary["last_id"]) + 1:]
+        return summary, messages
+
+    def _summary_request(self, summary: Dict[str, Any], messages: list) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": self.summary_user(summary.get("text"), messages),
+            "options": {"temperature": 0, "num_predict": self.summary_max_tokens},
+            "stream": False,
+        }
+
+    @staticmethod
+    def _summary_update(user_id: str, conversation_id: str, summary: Dict[str, Any], messages: list,
+                        text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Filtro y actualización que guardan el resumen nuevo. Solo se aplica si
+        el resumen no cambió mientras se calculaba (`last_id` sigue igual).
+        """
+        query = {"user_id": user_id, "conversation_id": conversation_id, "summary.last_id": summary.get("last_id")}
+        update = {"$set": {"summary": {
+            "text": text.strip(),
+            "last_id": messages[-1].get("id"),
+            "updated_at": datetime.now(),
+        }}}
+        return query, update
+
+    def summarize(self, user_id: str, conversation_id: str):
+        """Incorpora al resumen de la conversación los mensajes anteriores al último turno que aún no cubre."""
+        doc = self.collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                       self._summary_projection())
+        summary, messages = self._pending_summary(doc)
+        if not messages:
+            return
+        response = api.generate(**self._summary_request(summary, messages))
+        self.collection.update_one(*self._summary_update(user_id, conversation_id, summary, messages,
+                                                         response.response))
+
+    async def asummarize(self, user_id: str, conversation_id: str):
+        """Versión asíncrona de `summarize`."""
+        doc = await self.async_collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                                   self._summary_projection())
+        summary, messages = self._pending_summary(doc)
+        if not messages:
+            return
+        response = await async_api.generate(**self._summary_request(summary, messages))
+        await self.async_collection.update_one(*self._summary_update(user_id, conversation_id, summary, messages,
+                                                                     response.response))
+
+    def _claim_summary(self, key: Tuple[str, str]) -> bool:
+        """Marca la conversación como en resumen; False si ya hay uno en curso (el siguiente turno lo retoma)."""
+        with self._summarizing_lock:
+            if key in self._summarizing:
+                return False
+            self._summarizing.add(key)
+            return True
+
+    def _release_summary(self, key: Tuple[str, str]):
+        with self._summarizing_lock:
+            self._summarizing.discard(key)
+
+    def schedule_summary(self, user_id: str, conversation_id: str):
+        """Actualiza el resumen en segundo plano, sin retrasar la respuesta que acaba de terminar."""
+        key = (user_id, conversation_id)
+        if not self._claim_summary(key):
+            return
+
+        def run():
+            try:
+                self.summarize(user_id, conversation_id)
+            except Exception as e:
+                print(f"No se pudo resumir la conversación {conversation_id}: {e}")
+            finally:
+                self._release_summary(key)
+
+        self._summary_executor.submit(run)
+
+    def aschedule_summary(self, user_id: str, conversation_id: str):
+        """Versión asíncrona de `schedule_summary`: una tarea en el event loop."""
+        key = (user_id, conversation_id)
+        if not self._claim_summary(key):
+            return
+
+        async def run():
+            try:
+                await self.asummarize(user_id, conversation_id)
+            except Exception as e:
+                print(f"No se pudo resumir la conversación {conversation_id}: {e}")
+            finally:
+                self._release_summary(key)
+
+        task = asyncio.create_task(run())
+        # El event loop solo guarda referencias débiles a las tareas
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+
+    @staticmethod
+    def _turn_update(question: str, response: str, metadata: Dict[str, Any], bot_message_id: str) -> Tuple[list, Dict[str, Any]]:
+        """Mensajes de un turno y la actualización que los anexa sin reescribir la conversación."""
+        turn = [
+            {"role": "user", "content": question, "id": str(ObjectId())}, # Add ID to user messages
+            {"role": "assistant", "content": response, "metadata": metadata, "id": bot_message_id},
+        ]
+        update = {"$push": {"messages": {"$each": turn}}, "$set": {"last_updated": datetime.now()}}
+        return turn, update
+
+    def save_turn(self, user_id: str, conversation_id: str, question: str, response: str,
+                  metadata: Dict[str, Any], bot_message_id: str):
+        """
+        Añade la pregunta del usuario y la respuesta del bot al historial con un
+        `$push` (coste constante) y programa la actualización del resumen.
+        """
+        turn, update = self._turn_update(question, response, metadata, bot_message_id)
+        self.collection.update_one({"user_id": user_id, "conversation_id": conversation_id}, update, upsert=True)
+        self.save_backup(user_id, turn) # Re-evaluate backup strategy
+        self.schedule_summary(user_id, conversation_id)
+
     def save_backup(self, user_id: str, history_chunk: list):
         """Guarda una copia de seguridad de un chunk del historial de chat."""
         # This backup mechanism needs to be re-evaluated for conversations
@@ -71,7 +260,61 @@ class OllamaAssistant(Assistant):
         """Borra el historial de chat de una conversación específica SIN eliminar el documento de la conversación."""
         self.collection.update_one(
             {"user_id": user_id, "conversation_id": conversation_id},
-            {"$set": {"messages": []}}
+            {"$set": {"messages": []}, "$unset": {"summary": ""}}
+        )
+
+    # --- Versiones asíncronas del historial ------------------------------------
+
+    async def aload_history(self, user_id: str, conversation_id: str) -> list:
+        """Versión asíncrona de `load_history`."""
+        doc = await self.async_collection.find_one({"user_id": user_id, "conversation_id": conversation_id})
+        return doc["messages"] if doc and "messages" in doc else []
+
+    async def asave_history(self, user_id: str, conversation_id: str, history: list, conversation_title: Optional[str] = None):
+        """Versión asíncrona de `save_history`."""
+        update_fields = {"messages": history, "last_updated": datetime.now()}
+        if conversation_title:
+            update_fields["title"] = conversation_title
+        await self.async_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$set": update_fields},
+            upsert=True
+        )
+
+    async def asave_backup(self, user_id: str, history_chunk: list):
+        """Versión asíncrona de `save_backup`."""
+        await self.async_collection_backup.update_one(
+            {"user_id": user_id},
+            {"$push": {"history": {"$each": history_chunk}}},
+            upsert=True
+        )
+
+    async def ahistory_window(self, user_id: str, conversation_id: str) -> list:
+        """Versión asíncrona de `history_window`."""
+        doc = await self.async_collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                                   self._window_projection())
+        return doc.get("messages", []) if doc else []
+
+    async def amemory(self, user_id: str, conversation_id: str) -> ConversationMemory:
+        """Versión asíncrona de `memory`."""
+        doc = await self.async_collection.find_one({"user_id": user_id, "conversation_id": conversation_id},
+                                                   self._memory_projection())
+        return self._memory(doc)
+
+    async def asave_turn(self, user_id: str, conversation_id: str, question: str, response: str,
+                         metadata: Dict[str, Any], bot_message_id: str):
+        """Versión asíncrona de `save_turn`."""
+        turn, update = self._turn_update(question, response, metadata, bot_message_id)
+        await self.async_collection.update_one({"user_id": user_id, "conversation_id": conversation_id},
+                                               update, upsert=True)
+        await self.asave_backup(user_id, turn)
+        self.aschedule_summary(user_id, conversation_id)
+
+    async def aclear_conversation_history(self, user_id: str, conversation_id: str):
+        """Versión asíncrona de `clear_conversation_history`."""
+        await self.async_collection.update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$set": {"messages": []}, "$unset": {"summary": ""}}
         )
 
     def delete_conversation(self, user_id: str, conversation_id: str):
@@ -80,7 +323,9 @@ class OllamaAssistant(Assistant):
 
 
 
-    def make_metadata(self, response: GenerateResponse, duration: float, references) -> CallMetadata:
+    def make_metadata(self, response: GenerateResponse, duration: float, references,
+                      prompt: Optional[PromptReport] = None,
+                      rerank: Optional[RerankReport] = None) -> CallMetadata:
         """Crea los metadatos para una respuesta del modelo."""
         input_tokens = response.prompt_eval_count
         output_tokens = response.eval_count
@@ -93,29 +338,28 @@ class OllamaAssistant(Assistant):
             output_tokens=output_tokens,
             references=references,
             # Añade el nuevo campo 'disable' a los metadatos, por defecto en False
-            disable=False
+            disable=False,
+            prompt=prompt,
+            rerank=rerank
         )
 
-    def answer(self, question: Question, chunks: Chunks, user_id: str, conversation_id: str) -> Tuple[Generator[str, None, None], str, Dict[str, Any]]: # Updated return type hint
-        """Genera una respuesta a una pregunta del usuario."""
-        user_msg = self.answer_user(question, chunks)
+    def answer(self, question: Question, chunks: Chunks, user_id: str, conversation_id: str,
+               rerank: Optional[RerankReport] = None) -> Tuple[Generator[str, None, None], str, Dict[str, Any], Chunks]:
+        """
+        Genera una respuesta a una pregunta del usuario. Devuelve también los
+        chunks que cupieron en el prompt, que son las referencias de la respuesta.
+        """
         system = self.answer_system()
 
-        history: list = self.load_history(user_id, conversation_id)
-        window = history[-self.memory_window_size:]
-
-        if window:
-            past = "\n".join([f"{m['role']}: {m['content']}" for m in window])
-            prompt = past + "\nuser: " + user_msg
-        else:
-            prompt = user_msg
+        memory = self.memory(user_id, conversation_id)
+        packed = self.prompt_builder.build(question, chunks, memory.messages, system, memory.summary)
+        prompt = packed.prompt
 
         response_tokens = [] # To accumulate tokens for final response
         bot_message_id = str(ObjectId()) # Generate ID early
-        final_metadata = {} # To store final metadata
+        final_metadata = {} # Se rellena al terminar el stream; el llamador conserva la misma referencia
 
         def token_generator_func(): # Define a nested generator function
-            nonlocal response_tokens, final_metadata # Allow modification of outer scope variables
             try:
                 start_time = time.perf_counter()
                 for chunk in api.generate(
@@ -133,74 +377,136 @@ class OllamaAssistant(Assistant):
 
                 duration = end_time - start_time
                 # Use the last chunk for metadata, as it contains final counts
-                final_metadata = self.make_metadata(chunk, duration, chunks).model_dump()
+                self.prompt_builder.counter.observe(system + prompt, chunk.prompt_eval_count)
+                final_metadata.update(self.make_metadata(chunk, duration, packed.references, packed.report, rerank).model_dump())
 
                 # Store both user and bot messages in history
-                history.append({"role": "user", "content": question, "id": str(ObjectId())}) # Add ID to user messages
-                history.append({"role": "assistant", "content": "".join(response_tokens), "metadata": final_metadata, "id": bot_message_id})
+                self.save_turn(user_id, conversation_id, question, "".join(response_tokens),
+                               final_metadata, bot_message_id)
+
+            except Exception as e:
+                raise LLMError("ollama assistant", e)
+
+        return token_generator_func(), bot_message_id, final_metadata, packed.references
+
+    async def aanswer(self, question: Question, chunks: Chunks, user_id: str, conversation_id: str,
+                      rerank: Optional[RerankReport] = None) -> Tuple[AsyncGenerator[str, None], str, Dict[str, Any], Chunks]:
+        """
+        Versión asíncrona de `answer`: genera con `ollama.AsyncClient` y guarda
+        el historial con el cliente asíncrono de Mongo. Devuelve un generador
+        asíncrono de tokens; `final_metadata` se rellena al terminar.
+        """
+        system = self.answer_system()
+        memory = await self.amemory(user_id, conversation_id)
+        packed = self.prompt_builder.build(question, chunks, memory.messages, system, memory.summary)
+        prompt = packed.prompt
 
-                self.save_history(user_id, conversation_id, history)
-                self.save_backup(user_id, [history[-2], history[-1]]) # Re-evaluate backup strategy
+        bot_message_id = str(ObjectId())
+        final_metadata = {}
 
+        async def token_generator_func():
+            response_tokens = []
+            try:
+                start_time = time.perf_counter()
+                async for chunk in await async_api.generate(
+                    model=self.model,
+                    system=system,
+                    options={"temperature": 0},
+                    prompt=prompt,
+                    stream=True
+                ):
+                    if hasattr(chunk, "response"):
+                        response_tokens.append(chunk.response)
+                        yield chunk.response
+                duration = time.perf_counter() - start_time
+
+                self.prompt_builder.counter.observe(system + prompt, chunk.prompt_eval_count)
+                final_metadata.update(self.make_metadata(chunk, duration, packed.references, packed.report, rerank).model_dump())
+                await self.asave_turn(user_id, conversation_id, question, "".join(response_tokens),
+                                      final_metadata, bot_message_id)
             except Exception as e:
                 raise LLMError("ollama assistant", e)
 
-        return token_generator_func(), bot_message_id, final_metadata
+        return token_generator_func(), bot_message_id, final_metadata, packed.references
 
     def update_message_metadata(self, user_id: str, message_id: str, new_metadata: Dict[str, Any]) -> bool:
         """
-        Actualiza los metadatos de un mensaje específico en el historial de un usuario,
-        buscando a través de todas las conversaciones.
+        Actualiza los metadatos de un mensaje del bot en el historial de un usuario,
+        buscando a través de todas las conversaciones. Solo se escriben las claves
+        de `new_metadata` (`$set` posicional), sin leer ni reescribir la conversación.
         """
-        # Find the conversation that contains the message
-        conversation = self.collection.find_one(
-            {"user_id": user_id, "messages.id": message_id}
+        update = {f"messages.$.metadata.{key}": value for key, value in new_metadata.items()}
+        update["last_updated"] = datetime.now()
+        result = self.collection.update_one(
+            {"user_id": user_id, "messages": {"$elemMatch": {"id": message_id, "role": "assistant"}}},
+            {"$set": update}
         )
-        
-        if not conversation:
-            return False # Message not found
-
-        updated = False
-        for i, message in enumerate(conversation["messages"]):
-            if message.get("role") == "assistant" and message.get("id") == message_id:
-                current_metadata = message.get("metadata", {})
-                current_metadata.update(new_metadata)
-                conversation["messages"][i]["metadata"] = current_metadata
-                updated = True
-                break
-        
-        if updated:
-            self.save_history(user_id, conversation["conversation_id"], conversation["messages"])
-        return updated
-
-    def get_liked_solutions(self, user_id: str) -> List[Dict[str, Any]]:
+        return result.matched_count > 0
+
+    def get_message_metadata(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Metadatos guardados de un mensaje del bot, buscándolo en todas las conversaciones."""
+        match = {"$elemMatch": {"id": message_id, "role": "assistant"}}
+        doc = self.collection.find_one({"messages": match}, {"_id": 0, "messages": match})
+        if not doc or not doc.get("messages"):
+            return None
+        return doc["messages"][0].get("metadata", {})
+
+    def get_liked_solutions(self, user_id: str, skip: int = 0, limit: Optional[int] = None,
+                            unprocessed_in: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        Recupera todos los mensajes del bot del historial de UN USUARIO a través de TODAS LAS CONVERSACIONES
-        que están marcados como 'liked' (disable: True).
-        También devuelve la pregunta de usuario precedente.
+        Recupera los mensajes del bot de UN USUARIO, a través de TODAS SUS CONVERSACIONES,
+        que están marcados como 'liked' (disable: True), junto con la pregunta de
+        usuario que la precede. Todo se resuelve en Mongo con una agregación: solo
+        viajan las soluciones de la página pedida (`skip`/`limit`), de la
+        conversación más reciente a la más antigua y en orden dentro de cada una.
+        Con `unprocessed_in` se omiten las soluciones cuyo id ya figura como
+        `reference` en esa colección (las ya añadidas al vectorstore).
         """
-        liked_solutions = []
-        # Iterar sobre todas las conversaciones del usuario
-        conversations = self.collection.find({"user_id": user_id}).sort("last_updated", -1)
-
-        for conversation in conversations:
-            history = conversation.get("messages", [])
-            for i, message in enumerate(history):
-                if message.get("role") == "assistant" and message.get("metadata", {}).get("disable") is True:
-                    # Encuentra la pregunta de usuario precedente en la misma conversación
-                    user_question = None
-                    for j in range(i - 1, -1, -1):
-                        if history[j].get("role") == "user":
-                            user_question = history[j].get("content")
-                            break
-                    liked_solutions.append({
-                        "question": user_question,
-                        "answer": message.get("content"),
-                        "metadata": message.get("metadata"),
-                        "id": message.get("id"),
-                        "conversation_id": conversation.get("conversation_id") # Add conversation_id
-                    })
-        return liked_solutions
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": {"user_id": user_id, "messages.metadata.disable": True}},
+            {"$sort": {"last_updated": -1, "conversation_id": 1}},
+            # Antes del $unwind cada conversación se reduce a sus soluciones, cada una con
+            # la pregunta que la precede (por índice): no se copia el historial completo por fila
+            {"$project": {"_id": 0, "conversation_id": 1, "liked": {"$map": {
+                "input": {"$filter": {
+                    "input": {"$range": [0, {"$size": "$messages"}]},
+                    "as": "i",
+                    "cond": {"$let": {
+                        "vars": {"m": {"$arrayElemAt": ["$messages", "$$i"]}},
+                        "in": {"$and": [{"$eq": ["$$m.role", "assistant"]},
+                                        {"$eq": ["$$m.metadata.disable", True]}]},
+                    }},
+                }},
+                "as": "i",
+                "in": {"$let": {
+                    "vars": {"previous": {"$arrayElemAt": ["$messages", {"$max": [{"$subtract": ["$$i", 1]}, 0]}]}},
+                    "in": {
+                        "message": {"$arrayElemAt": ["$messages", "$$i"]},
+                        "question": {"$cond": [{"$eq": ["$$previous.role", "user"]}, "$$previous.content", None]},
+                    },
+                }},
+            }}}},
+            {"$unwind": "$liked"},
+        ]
+        if unprocessed_in:
+            pipeline += [
+                {"$lookup": {"from": unprocessed_in, "localField": "liked.message.id",
+                             "foreignField": "reference", "as": "processed"}},
+                {"$match": {"processed": {"$size": 0}}},
+            ]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": {
+            "_id": 0,
+            "id": "$liked.message.id",
+            "answer": "$liked.message.content",
+            "metadata": "$liked.message.metadata",
+            "conversation_id": 1,
+            "question": "$liked.question",
+        }})
+        return list(self.collection.aggregate(pipeline))
 
     def get_user_conversations(self, user_id: str) -> List[Dict[str, Any]]:
         """
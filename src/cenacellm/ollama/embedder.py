@@ -1,16 +1,68 @@
+import asyncio
 import numpy as np
+from typing import List, Optional
+from cenacellm.embedcache import EmbeddingCache, normalize_text
 from cenacellm.tools.embedder import Embedder
-from cenacellm.settings.clients import ollama as api
+from cenacellm.types import Matrix
+from cenacellm.settings.clients import ollama as api, ollama_async as async_api
 
 
 class OllamaEmbedder(Embedder):
-    def __init__(self):
+    def __init__(self, cache: Optional[EmbeddingCache] = None):
         self.model = 'bge-m3:latest'
+        self.cache = cache
 
     def vectorize(self, s):
-            response = api.embeddings(self.model, prompt=s)
-            return np.array(response["embedding"], dtype="float32")  # <-- aquí está la clave
+        if self.cache is not None:
+            vector = self.cache.get(self.model, s)
+            if vector is not None:
+                return vector
+        # Mismo endpoint que vectorize_many para que consultas y chunks sean comparables
+        response = api.embed(self.model, input=s)
+        vector = np.array(response["embeddings"][0], dtype="float32")  # <-- aquí está la clave
+        if self.cache is not None:
+            self.cache.put_many(self.model, [s], [vector])
+        return vector
+
+    async def avectorize(self, s):
+        # La caché lee y escribe en sqlite (con commit): se hace en un hilo para no bloquear el event loop
+        if self.cache is not None:
+            vector = await asyncio.to_thread(self.cache.get, self.model, s)
+            if vector is not None:
+                return vector
+        response = await async_api.embed(self.model, input=s)
+        vector = np.array(response["embeddings"][0], dtype="float32")
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, self.model, [s], [vector])
+        return vector
+
+    def vectorize_many(self, texts: List[str], batch_size: int = 64) -> Matrix:
+        """
+        Vectoriza los textos en lotes usando el endpoint multi-entrada de Ollama.
+        Con caché, solo se envían los textos que no están en ella (una vez cada uno).
+        """
+        if not texts:
+            return np.empty((0, 0), dtype="float32")
+        if self.cache is None:
+            return self._embed(texts, batch_size)
+
+        vectors = self.cache.get_many(self.model, texts)
+        # Un texto por clave: variantes que solo difieren en espacios comparten vector
+        missing = {normalize_text(text): text for text, vector in zip(texts, vectors) if vector is None}
+        if missing:
+            computed = dict(zip(missing, self._embed(list(missing.values()), batch_size)))
+            self.cache.put_many(self.model, list(missing.values()), list(computed.values()))
+            vectors = [computed[normalize_text(text)] if vector is None else vector
+                       for text, vector in zip(texts, vectors)]
+        return np.ascontiguousarray(np.vstack(vectors), dtype="float32")
+
+    def _embed(self, texts: List[str], batch_size: int) -> Matrix:
+        blocks = []
+        for start in range(0, len(texts), batch_size):
+            response = api.embed(self.model, input=texts[start:start + batch_size])
+            blocks.append(np.asarray(response["embeddings"], dtype="float32"))
+        return np.ascontiguousarray(np.vstack(blocks))
         
     
     def dim(self):
-        return len(self.vectorize("Hola"))  # <-- aquí está la clave
\ No newline at end of file
+        return len(self.vectorize("Hola"))  # <-- aquí está la clave
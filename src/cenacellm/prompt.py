@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from pydantic import BaseModel
+from cenacellm.settings.config import TOKENIZER_PATH, TOKENIZER_REPO
+from cenacellm.types import Chunks, PromptReport, Question, Text
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Dependencia opcional: sin ella el conteo se estima
+    Tokenizer = None
+
+
+class PromptConfig(BaseModel):
+    max_tokens : int = 3072        # Presupuesto del prompt completo; el resto del contexto queda para la respuesta
+    history_tokens : int = 768     # Parte del presupuesto que puede ocupar el historial
+    max_overlap : int = 200        # Solapamiento máximo entre chunks vecinos (el de DisjointCollection)
+    min_overlap : int = 20         # Coincidencias más cortas no se tratan como solapamiento
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con el tokenizer del modelo si el paquete `tokenizers` está
+    instalado y hay un tokenizer.json en `tokenizer_path`. Si no, estima por
+    caracteres con una razón que se calibra con el `prompt_eval_count` que
+    Ollama devuelve en cada respuesta, es decir, con el tokenizer real del modelo.
+    """
+
+    def __init__(self, tokenizer_path: Optional[str] = TOKENIZER_PATH, chars_per_token: float = 3.0):
+        self.tokenizer = None
+        if Tokenizer is not None and tokenizer_path and os.path.exists(tokenizer_path):
+            self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
+        elif Tokenizer is None:
+            print("Aviso: falta el paquete tokenizers (pip install -e '.[tokenizer]'); "
+                  "el presupuesto del prompt se estima por caracteres.")
+        else:
+            print(f"Aviso: no existe {tokenizer_path} (python -m cenacellm.prompt lo descarga); "
+                  "el presupuesto del prompt se estima por caracteres.")
+        # Por defecto se sobreestima un poco: es preferible quedarse corto de contexto que truncar
+        self.chars_per_token = chars_per_token
+        self._lock = threading.Lock()
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def observe(self, text: str, tokens: Optional[int]):
+        """Ajusta la estimación con los tokens que el modelo contó para `text`."""
+        if self.tokenizer is not None or not tokens:
+            return
+        ratio = len(text) / tokens
+        # Con la caché de prefijos de Ollama el conteo puede cubrir solo una parte del
+        # prompt; esas razones no son plausibles y se ignoran
+        if 2.0 <= ratio <= 6.0:
+            with self._lock:
+                self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * ratio
+
+
+def fetch_tokenizer(repo: str = TOKENIZER_REPO, path: str = TOKENIZER_PATH) -> str:
+    """
+    Descarga el tokenizer.json del modelo de chat desde Hugging Face y lo guarda
+    en `path`. Es un paso de instalación; los repos de Gemma piden aceptar la
+    licencia y un token en HF_TOKEN.
+    """
+    if Tokenizer is None:
+        raise ImportError("Descargar el tokenizer necesita el paquete tokenizers (pip install -e '.[tokenizer]')")
+    tokenizer = Tokenizer.from_pretrained(repo, token=os.getenv("HF_TOKEN"))
+    path = str(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tokenizer.save(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class PackedPrompt(NamedTuple):
+    prompt : str
+    references : Chunks           # Chunks incluidos (sin recortar), en el orden del prompt
+    report : PromptReport
+
+
+def _overlap(head: str, tail: str, max_overlap: int, min_overlap: int) -> int:
+    """Longitud del mayor final de `head` que es también el principio de `tail`."""
+    for size in range(min(len(head), len(tail), max_overlap), min_overlap - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+
+class PromptBuilder:
+    """
+    Arma el prompt del chat dentro de un presupuesto de tokens.
+
+    Primero se cuentan el sistema y la pregunta; después entra el resumen de
+    la conversación (si lo hay) y el historial que aún no cubre, del mensaje
+    más reciente al más antiguo, hasta `history_tokens`; con lo
+    que queda se empaquetan las referencias en orden de relevancia. Antes se
+    quitan los chunks repetidos y el solapamiento entre chunks vecinos del
+    mismo documento, para no pagar dos veces el mismo texto. Lo que no cabe
+    se informa en el `PromptReport`.
+    """
+
+    def __init__(self, assistant, config: Optional[PromptConfig] = None, counter: Optional[TokenCounter] = None):
+        self.assistant = assistant
+        self.config = config or PromptConfig()
+        self.counter = counter or TokenCounter()
+
+    def dedupe(self, chunks: Chunks) -> Tuple[List[Tuple[Text, Text]], int, int]:
+        """
+        Pares (chunk original, chunk para el prompt) sin repetidos y sin el texto
+        que ya aporta otro chunk del mismo documento. Devuelve también cuántos
+        se descartaron y cuántos se recortaron.
+        """
+        kept: List[Tuple[Text, Text]] = []
+        duplicates = trimmed = 0
+        for chunk in chunks:
+            content = chunk.content.strip()
+            same_doc = [packed.content for _, packed in kept
+                        if packed.metadata.reference == chunk.metadata.reference]
+            if not content or any(content in packed.content for _, packed in kept):
+                duplicates += 1
+                continue
+            for other in same_doc:
+                cut = _overlap(other, content, self.config.max_overlap, self.config.min_overlap)
+                content = content[cut:]
+                cut = _overlap(content, other, self.config.max_overlap, self.config.min_overlap)
+                content = content[:len(content) - cut]
+            if content != chunk.content.strip():
+                trimmed += 1
+            kept.append((chunk, chunk.model_copy(update={"content": content.strip()})))
+        return kept, duplicates, trimmed
+
+    def build(self, question: Question, chunks: Chunks, history: List[Dict[str, Any]], system: str = "",
+              summary: Optional[str] = None) -> PackedPrompt:
+        budget = self.config.max_tokens
+        used = self.counter.count(system) + self.counter.count(self.assistant.answer_user(question, []))
+
+        # Resumen primero y después el historial, del más reciente hacia atrás, sin huecos
+        history_budget = min(self.config.history_tokens, max(budget - used, 0))
+        past: List[str] = []
+        history_used = 0
+        summary_line = f"Resumen de la conversación: {summary}" if summary else None
+        if summary_line:
+            history_used = self.counter.count(summary_line + "\n")
+            if history_used > history_budget:
+                summary_line, history_used = None, 0
+        for message in reversed(history):
+            line = f"{message['role']}: {message['content']}"
+            cost = self.counter.count(line + "\n")
+            if history_used + cost > history_budget:
+                break
+            past.insert(0, line)
+            history_used += cost
+        used += history_used
+
+        kept, duplicates, trimmed = self.dedupe(chunks)
+        references: Chunks = []
+        packed: Chunks = []
+        dropped = []
+        for original, chunk in kept:
+            cost = self.counter.count(self.assistant.answer_reference(len(packed) + 1, chunk))
+            if used + cost > budget:
+                dropped.append(original.metadata)
+                continue
+            used += cost
+            references.append(original)
+            packed.append(chunk)
+
+        user_msg = self.assistant.answer_user(question, packed)
+        lines = ([summary_line] if summary_line else []) + past
+        prompt = "\n".join(lines) + "\nuser: " + user_msg if lines else user_msg
+        report = PromptReport(
+            budget=budget,
+            tokens=used,
+            exact=self.counter.exact,
+            references=len(packed),
+            duplicates=duplicates,
+            trimmed=trimmed,
+            dropped=dropped,
+            history_messages=len(past),
+            history_dropped=len(history) - len(past),
+            summary=summary_line is not None,
+        )
+        return PackedPrompt(prompt, references, report)
+
+
+if __name__ == "__main__":
+    print(f"Tokenizer de {TOKENIZER_REPO} guardado en {fetch_tokenizer()}")
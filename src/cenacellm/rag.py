@@ -1,33 +1,63 @@
 import os
-import json
-from typing import List, Dict, Any, Generator, Optional, Union, Tuple
-from datetime import datetime
-from cenacellm.settings.config import VECTORS_DIR, PROCESSED_FILES
+import time
+import asyncio
+import numpy as np
+from typing import AsyncGenerator, Callable, List, Dict, Any, Generator, Literal, Optional, Union, Tuple
+from datetime import datetime, timezone
+from cenacellm.settings.config import VECTORS_DIR, PROCESSED_FILES, EMBEDDINGS_CACHE
 from cenacellm.ollama.embedder import OllamaEmbedder
+from cenacellm.embedcache import EmbeddingCache
+from cenacellm.answercache import AnswerCache, CachedAnswer
+from cenacellm.refstore import ReferenceStore, References, references_payload
 from cenacellm.vectorstore import FAISSVectorStore
+from cenacellm.faissindex import IndexConfig
 from cenacellm.doccollection import DisjointCollection
+from cenacellm.ingest import IngestConfig, IngestFile, IngestPipeline, IngestReport, file_hash
 from cenacellm.ollama.assistant import OllamaAssistant
-from cenacellm.types import Text, TextMetadata # Import Text and TextMetadata
+from cenacellm.tools.reranker import Reranker
+from cenacellm.types import Text, TextMetadata, CallMetadata, RerankReport, StreamEvent # Import Text and TextMetadata
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+type TicketSortField = Literal["created_at", "titulo", "categories", "reference"]
 
 class RAG:
     def __init__(
         self, 
-        vectorstore_path: str = VECTORS_DIR
+        vectorstore_path: str = VECTORS_DIR,
+        index_config: Optional[IndexConfig] = None,
+        ingest_config: Optional[IngestConfig] = None,
+        embedding_cache_path: Optional[str] = EMBEDDINGS_CACHE,
+        answer_cache: Optional[AnswerCache] = None,
+        reranker: Optional[Reranker] = None
     ):
         self.vectorstore_path = vectorstore_path
+        self.ingest_config = ingest_config
         self.processed_files_path = PROCESSED_FILES
         os.makedirs(vectorstore_path, exist_ok=True)
         
         self.assistant = OllamaAssistant()
         self.collection = DisjointCollection()
-        self.embedder = OllamaEmbedder()
+        self.embedder = OllamaEmbedder(cache=EmbeddingCache(embedding_cache_path) if embedding_cache_path else None)
         
         self.vectorstore = FAISSVectorStore(
             dim=self.embedder.dim(),
             embeddings=self.embedder,
-            folder_path=vectorstore_path
+            folder_path=vectorstore_path,
+            index_config=index_config
         )
+
+        # Caché semántica de respuestas (opcional); se invalida con cada borrado
+        # o cambio de metadata de los chunks que usó
+        self.answer_cache = answer_cache
+        if answer_cache is not None:
+            self.vectorstore.add_listener(answer_cache.invalidate_ids)
+
+        # Rerank opcional entre FAISS y el LLM: se recuperan más candidatos y pasan solo los mejores
+        self.reranker = reranker
+
+        # Referencias de cada respuesta, para consultarlas después por id de mensaje
+        self.references = ReferenceStore()
         
         self.client = self.assistant.client 
         self.db = self.client[self.assistant.db_name] 
@@ -37,10 +67,14 @@ class RAG:
         self.tickets_collection = self.db['tickets']
         # Asegurarse de que la colección de tickets tiene un índice único para 'reference'
         self.tickets_collection.create_index("reference", unique=True, sparse=True)
+        self.migrations_collection = self.db["migrations"]
+        self._backfill_ticket_references()
 
 
         # Cargar los datos procesados al iniciar
         self.processed_files : dict = self._load_processed_files()
+        self.file_keys_by_reference : dict = self._index_processed_files()
+        self.file_keys_by_hash : dict = self._index_processed_hashes()
         self.processed_solutions_ids : set = self._load_processed_solutions_ids()
 
 
@@ -55,7 +89,41 @@ class RAG:
             processed_files_dict[doc["file_key"]] = doc
         return processed_files_dict
 
+
+    def _index_processed_files(self) -> Dict[str, str]:
+        """Construye el índice inverso reference -> file_key de los archivos procesados."""
+        return {
+            info["reference"]: file_key
+            for file_key, info in self.processed_files.items()
+            if info.get("reference")
+        }
     
+    def _index_processed_hashes(self) -> Dict[str, str]:
+        """Construye el índice hash de contenido -> file_key para detectar duplicados y renombrados."""
+        return {
+            info["hash"]: file_key
+            for file_key, info in self.processed_files.items()
+            if info.get("hash")
+        }
+
+    def _rename_processed_file(self, old_key: str, new_key: str, path: str) -> None:
+        """Reasigna el registro (y los chunks) de un documento ya indexado que cambió de nombre."""
+        info = self.processed_files[old_key]
+        self._delete_processed_file([old_key])
+        info.update({"source": path, "file_key": new_key})
+        self.processed_files[new_key] = info
+        self.file_keys_by_hash[info["hash"]] = new_key
+        if info.get("reference"):
+            self.file_keys_by_reference[info["reference"]] = new_key
+            renamed = [
+                (idx, text.model_copy(update={"metadata": text.metadata.model_copy(
+                    update={"source": path, "filename": new_key})}))
+                for idx in sorted(self.vectorstore.ids_for(reference=info["reference"]))
+                for text in [self.vectorstore.chunks[idx]]
+            ]
+            self.vectorstore.update_texts(renamed)
+        print(f"{old_key} renombrado a {new_key}; se conservan sus {info.get('chunks', 0)} chunks.")
+
     def _save_processed_files(self) -> None:
         """Guarda los archivos procesados en la base de datos."""
         for file_key, file_info in self.processed_files.items():
@@ -68,10 +136,29 @@ class RAG:
     
     def _delete_processed_file(self, file_key: List[str]) -> None:
         """Elimina archivos procesados de la base de datos (y la caché en memoria)."""
+        self.processed_files_collection.delete_many({"file_key": {"$in": list(file_key)}})
         for file_name in file_key:
-            self.processed_files_collection.delete_one({"file_key": file_name})
-            if file_name in self.processed_files:
-                del self.processed_files[file_name]
+            file_info = self.processed_files.pop(file_name, None)
+            if file_info and file_info.get("reference"):
+                self.file_keys_by_reference.pop(file_info["reference"], None)
+            if file_info and self.file_keys_by_hash.get(file_info.get("hash")) == file_name:
+                self.file_keys_by_hash.pop(file_info["hash"])
+
+    def file_key_for_reference(self, reference_id: str) -> Optional[str]:
+        """Devuelve el file_key del documento con esa referencia, si existe (según la caché de este proceso)."""
+        return self.file_keys_by_reference.get(reference_id)
+
+    def file_keys_for_references(self, reference_ids: List[str]) -> List[str]:
+        """
+        file_keys de los documentos con esas referencias, leídos de la base de
+        datos: el archivo pudo ingerirlo otro worker después de la última
+        `refresh_processed_data` de este.
+        """
+        cursor = self.processed_files_collection.find(
+            {"reference": {"$in": list(reference_ids)}, "file_key": {"$exists": True}},
+            {"_id": 0, "file_key": 1}
+        )
+        return [doc["file_key"] for doc in cursor]
     
     def _load_processed_solutions_ids(self) -> set:
         """Carga los IDs de las soluciones "likeadas" ya procesadas desde la base de datos."""
@@ -95,131 +182,383 @@ class RAG:
 
     def load_documents(self, folder_path: str, 
                        collection_name : str = None,
-                       force_reload : bool = False
+                       force_reload : bool = False,
+                       on_progress: Optional[Callable[[IngestReport], None]] = None
                        ) -> list:
-        """Carga documentos PDF de una carpeta al vectorstore."""
+        """
+        Carga documentos PDF de una carpeta al vectorstore.
+
+        Los archivos se identifican por el hash de su contenido: un PDF sin
+        cambios se omite, uno renombrado conserva sus chunks y una copia de otro
+        ya indexado no se vuelve a indexar. Los PDFs nuevos o modificados pasan
+        por `IngestPipeline`; si ya estaban indexados solo se embeben los chunks
+        cuyo texto cambió y se retiran los que desaparecieron. Con `force_reload`
+        se vuelven a extraer todos, con el mismo reindexado incremental.
+        `on_progress` recibe el avance por etapa.
+        """
         if not os.path.exists(folder_path):
             raise FileNotFoundError(f"La carpeta {folder_path} no existe")
+
+        archivos = sorted(a for a in os.listdir(folder_path) if a.endswith(".pdf"))
+        return self.load_files([(os.path.join(folder_path, archivo), None) for archivo in archivos],
+                               collection_name, force_reload, on_progress)
+
+    def load_files(self, files: List[Tuple[str, Optional[str]]],
+                   collection_name : str = None,
+                   force_reload : bool = False,
+                   on_progress: Optional[Callable[[IngestReport], None]] = None
+                   ) -> list:
+        """
+        Carga solo los PDFs indicados, sin recorrer su carpeta.
+
+        `files` son pares (ruta, hash); si el hash ya se calculó (p. ej. al
+        recibir la subida) no se vuelve a leer el archivo. Las reglas de
+        omisión, renombrado y reindexado son las de `load_documents`.
+        """
+        # Otro worker pudo indexar documentos desde la última vez
+        self.vectorstore.refresh()
+        self.refresh_processed_data()
         
         docs_count = 0
         new_docs_count = 0
         chunks_count = 0
+        pending: List[IngestFile] = []
+        file_stats: Dict[str, Tuple[os.stat_result, str]] = {}
+        registry_changed = False  # Registros renombrados o completados sin reindexar
         
-        
-        for archivo in os.listdir(folder_path):
-            if not archivo.endswith(".pdf"):
-                continue
-                
-            ruta_pdf = os.path.join(folder_path, archivo)
+        for ruta_pdf, digest in files:
             file_stat = os.stat(ruta_pdf)
-            last_modified = int(file_stat.st_mtime)
-            file_size = file_stat.st_size
+            digest = digest or file_hash(ruta_pdf)
             
-            file_key = f"{archivo}"
+            file_key = os.path.basename(ruta_pdf)
             file_info = self.processed_files.get(file_key, {})
+
+            if not file_info.get("hash") and file_info.get("size") == file_stat.st_size and not force_reload:
+                # Registro anterior a los hashes: se da por bueno y se completa
+                file_info["hash"] = digest
+                self.file_keys_by_hash[digest] = file_key
+                registry_changed = True
             
-            if (not force_reload and file_key in self.processed_files and 
-                file_info.get("size") == file_size):
+            if not force_reload and file_info.get("hash") == digest:
                 docs_count += 1
                 continue
-                        
-            textos = self.collection.load_pdf(ruta_pdf, collection=collection_name)
-            chunks = self.collection.get_chunks(textos)
-            
-            doc_chunks_count = 0
-            for chunk in chunks:
-                vector = self.embedder.vectorize(chunk.content)
-                self.vectorstore.add_text(vector, chunk)
-                doc_chunks_count += 1
-                chunks_count += 1
+
+            other_key = self.file_keys_by_hash.get(digest)
+            if other_key not in (None, file_key) and not file_info:
+                if not os.path.exists(os.path.join(os.path.dirname(ruta_pdf), other_key)):
+                    self._rename_processed_file(other_key, file_key, ruta_pdf)
+                    registry_changed = True
+                    docs_count += 1
+                else:
+                    print(f"{file_key} es una copia de {other_key}; no se indexa de nuevo.")
+                continue
+
+            file_stats[file_key] = (file_stat, digest)
+            pending.append(IngestFile(file_key, ruta_pdf, collection_name, file_info.get("reference")))
+
+        pipeline = IngestPipeline(self.collection, self.embedder, self.vectorstore, self.ingest_config)
+        try:
+            for doc in pipeline.run(pending, on_progress):
+                file_stat, digest = file_stats[doc.file_key]
+                chunks_count += doc.embedded
             
-            self.processed_files[file_key] = {
-                "source": ruta_pdf,
-                "last_modified": last_modified,
-                "size": file_size,
-                "processed_at": datetime.now().isoformat(),
-                "chunks": doc_chunks_count,
-                "reference": textos[0].metadata.reference if textos else None,
-                "collection": collection_name 
-            }
+                self.processed_files[doc.file_key] = {
+                    "source": doc.path,
+                    "last_modified": int(file_stat.st_mtime),
+                    "size": file_stat.st_size,
+                    "hash": digest,
+                    "processed_at": datetime.now().isoformat(),
+                    "chunks": doc.chunks,
+                    "reference": doc.reference,
+                    "collection": collection_name 
+                }
+                if doc.reference:
+                    self.file_keys_by_reference[doc.reference] = doc.file_key
+                self.file_keys_by_hash[digest] = doc.file_key
             
-            new_docs_count += 1
-            docs_count += 1
-        
-        if new_docs_count > 0:
-            self.vectorstore.save_index()
-            self._save_processed_files()
+                new_docs_count += 1
+                docs_count += 1
+        finally:
+            # También si se cancela a medias: lo ya ingerido queda guardado y registrado
+            if new_docs_count > 0 or registry_changed:
+                self.vectorstore.save_index()
+                self._save_processed_files()
         
-        # Después de cargar o procesar, refrescar la caché
-        self.refresh_processed_data() 
+            # Después de cargar o procesar, refrescar la caché
+            self.refresh_processed_data() 
         return [docs_count, new_docs_count, chunks_count]
     
     
-    def query(self, 
-              user_id: str,
-              conversation_id: str, # Added conversation_id
-              question: str, 
-              k: int = 10,
-              filter_metadata: Optional[Dict[str, Any]] = None
-             ) -> Tuple[Generator[str, None, None], List, str, Dict[str, Any]]: # Updated return type hint
-
-        query_vector = self.embedder.vectorize(question)
-     
-        if filter_metadata is None:
+    def _retrieve(self, query_vector, k: int, filter_metadata: Optional[Dict[str, Any]],
+                  query_text: Optional[str] = None,
+                  question: Optional[str] = None) -> Tuple[List[int], List[Text], Optional[RerankReport]]:
+        """
+        Busca los chunks relevantes; devuelve sus ids, sus textos y el informe del rerank.
+        Con `query_text` la búsqueda vectorial se fusiona con la léxica (BM25).
+        Con `question` y un reranker configurado se recuperan k·fetch candidatos
+        y el reranker deja los `k` mejores.
+        """
+        reranker = self.reranker if question else None
+        n = k
+        if reranker is not None:
+            k *= reranker.fetch
+        if not filter_metadata:
             # proporción: 80% documentos, 20% soluciones
             k_docs = int(round(k * 0.8))
             k_sols = k - k_docs  # lo que sobra va a soluciones
 
-            relevant_chunks_docs = self.vectorstore.get_similar(
-                query_vector,
-                k=k_docs,
-                filter_metadata="documentos"
-            )
-            relevant_chunks_sols = self.vectorstore.get_similar(
+            # Una sola llamada; si una colección no llega a su cuota, la otra la completa
+            relevant_chunks = self.vectorstore.get_similar_by_collection(
                 query_vector,
-                k=k_sols,
-                filter_metadata="soluciones"
+                {"documentos": k_docs, "soluciones": k_sols},
+                with_ids=True,
+                query_text=query_text
             )
-
-            # unir resultados en una sola lista
-            relevant_chunks = relevant_chunks_docs + relevant_chunks_sols
         else:
             relevant_chunks = self.vectorstore.get_similar(
                 query_vector,
                 k=k,
-                filter_metadata=filter_metadata
+                filter_metadata=filter_metadata,
+                with_ids=True,
+                query_text=query_text
+            )
+
+        report = None
+        if reranker is not None and relevant_chunks:
+            start_time = time.perf_counter()
+            order = reranker.rerank(
+                question,
+                query_vector,
+                np.vstack([chunk[1] for chunk in relevant_chunks]),
+                [chunk[2] for chunk in relevant_chunks],
+                n
+            )
+            report = RerankReport(
+                method=reranker.method,
+                requested=reranker.requested,
+                candidates=len(relevant_chunks),
+                selected=len(order),
+                duration=time.perf_counter() - start_time,
             )
+            relevant_chunks = [relevant_chunks[i] for i in order]
+        return [chunk[0] for chunk in relevant_chunks], [chunk[2] for chunk in relevant_chunks], report
 
+    def query(self, 
+              user_id: str,
+              conversation_id: str, # Added conversation_id
+              question: str, 
+              k: int = 10,
+              filter_metadata: Optional[Dict[str, Any]] = None,
+              hybrid: bool = True,
+              rerank: bool = True
+             ) -> Tuple[Generator[str, None, None], List, str, Dict[str, Any]]: # Updated return type hint
+        """
+        Responde `question` con los `k` chunks más relevantes. Con `hybrid` la
+        recuperación fusiona (RRF) la búsqueda vectorial con BM25, para que los
+        códigos de alarma, subestaciones y equipos exactos no se pierdan. Con
+        `rerank` (y un reranker configurado) los `k` salen de un conjunto mayor
+        de candidatos.
+        """
+        query_vector = self.embedder.vectorize(question)
+        chunk_ids, text_chunks, rerank_report = self._retrieve(
+            query_vector, k, filter_metadata, question if hybrid else None, question if rerank else None
+        )
 
-        text_chunks = [chunk[1] for chunk in relevant_chunks]
+        # La caché solo aplica a preguntas sin historial: con contexto previo la
+        # misma pregunta puede necesitar otra respuesta
+        use_cache = (self.answer_cache is not None
+                     and not self.assistant.history_window(user_id, conversation_id))
+        if use_cache:
+            cached = self.answer_cache.get(query_vector, chunk_ids)
+            if cached is not None:
+                return self._replay_answer(user_id, conversation_id, question, text_chunks, cached, rerank_report)
 
         # Call assistant.answer and unpack the new return values
-        token_generator, bot_message_id, full_metadata = self.assistant.answer(question, text_chunks, user_id=user_id, conversation_id=conversation_id) # Pass conversation_id
+        # Las referencias son los chunks que cupieron en el prompt, no todos los recuperados
+        token_generator, bot_message_id, full_metadata, text_chunks = self.assistant.answer(question, text_chunks, user_id=user_id, conversation_id=conversation_id, rerank=rerank_report) # Pass conversation_id
 
+        if use_cache:
+            token_generator = self._cache_answer(token_generator, query_vector, chunk_ids, full_metadata)
         return token_generator, text_chunks, bot_message_id, full_metadata
 
+    async def aquery(self,
+                     user_id: str,
+                     conversation_id: str,
+                     question: str,
+                     k: int = 10,
+                     filter_metadata: Optional[Dict[str, Any]] = None,
+                     hybrid: bool = True,
+                     rerank: bool = True
+                    ) -> Tuple[AsyncGenerator[str, None], List, str, Dict[str, Any]]:
+        """
+        Versión asíncrona de `query`: embedding y generación con `ollama.AsyncClient`,
+        historial con Mongo asíncrono y la búsqueda en FAISS (y el rerank) en un
+        hilo aparte para no bloquear el event loop.
+        """
+        query_vector = await self.embedder.avectorize(question)
+        chunk_ids, text_chunks, rerank_report = await asyncio.to_thread(
+            self._retrieve, query_vector, k, filter_metadata, question if hybrid else None,
+            question if rerank else None
+        )
+
+        use_cache = (self.answer_cache is not None
+                     and not await self.assistant.ahistory_window(user_id, conversation_id))
+        if use_cache:
+            cached = self.answer_cache.get(query_vector, chunk_ids)
+            if cached is not None:
+                return self._areplay_answer(user_id, conversation_id, question, text_chunks, cached, rerank_report)
+
+        token_generator, bot_message_id, full_metadata, text_chunks = await self.assistant.aanswer(
+            question, text_chunks, user_id=user_id, conversation_id=conversation_id, rerank=rerank_report
+        )
+        if use_cache:
+            token_generator = self._acache_answer(token_generator, query_vector, chunk_ids, full_metadata)
+        return token_generator, text_chunks, bot_message_id, full_metadata
+
+    def _cache_answer(self, token_generator, query_vector, chunk_ids: List[int], full_metadata: Dict[str, Any]):
+        """Reenvía los tokens y, si la respuesta se completa, la guarda en la caché."""
+        tokens = []
+        for token in token_generator:
+            tokens.append(token)
+            yield token
+        self.answer_cache.put(query_vector, chunk_ids, tokens, dict(full_metadata))
+
+    async def _acache_answer(self, token_generator, query_vector, chunk_ids: List[int], full_metadata: Dict[str, Any]):
+        tokens = []
+        async for token in token_generator:
+            tokens.append(token)
+            yield token
+        self.answer_cache.put(query_vector, chunk_ids, tokens, dict(full_metadata))
+
+    @staticmethod
+    def _cached_references(cached: CachedAnswer, text_chunks: List[Text]) -> List[Text]:
+        """Referencias con las que se generó la respuesta cacheada (las que cupieron en su prompt)."""
+        references = cached.metadata.get("references")
+        if references is None:
+            return text_chunks
+        return [Text.model_validate(chunk) for chunk in references]
+
+    @staticmethod
+    def _cached_metadata(cached: CachedAnswer, duration: float, rerank: Optional[RerankReport]) -> Dict[str, Any]:
+        """Metadata de una respuesta servida desde la caché."""
+        return CallMetadata.model_validate({
+            **cached.metadata,
+            "duration": duration,
+            "rerank": rerank,
+            "disable": False,
+            "cached": True,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }).model_dump()
+
+    def _replay_answer(self, user_id: str, conversation_id: str, question: str,
+                       text_chunks: List[Text], cached: CachedAnswer, rerank: Optional[RerankReport] = None):
+        """Devuelve una respuesta cacheada con la misma forma que `assistant.answer`."""
+        bot_message_id = str(ObjectId())
+        full_metadata: Dict[str, Any] = {}
+        text_chunks = self._cached_references(cached, text_chunks)
+
+        def token_generator():
+            start_time = time.perf_counter()
+            for token in cached.tokens:
+                yield token
+            full_metadata.update(self._cached_metadata(cached, time.perf_counter() - start_time, rerank))
+            self.assistant.save_turn(user_id, conversation_id, question, "".join(cached.tokens),
+                                     full_metadata, bot_message_id)
+
+        return token_generator(), text_chunks, bot_message_id, full_metadata
+
+    def _areplay_answer(self, user_id: str, conversation_id: str, question: str,
+                        text_chunks: List[Text], cached: CachedAnswer, rerank: Optional[RerankReport] = None):
+        """Versión asíncrona de `_replay_answer`."""
+        bot_message_id = str(ObjectId())
+        full_metadata: Dict[str, Any] = {}
+        text_chunks = self._cached_references(cached, text_chunks)
+
+        async def token_generator():
+            start_time = time.perf_counter()
+            for token in cached.tokens:
+                yield token
+            full_metadata.update(self._cached_metadata(cached, time.perf_counter() - start_time, rerank))
+            await self.assistant.asave_turn(user_id, conversation_id, question, "".join(cached.tokens),
+                                            full_metadata, bot_message_id)
+
+        return token_generator(), text_chunks, bot_message_id, full_metadata
+
+    def _references_event(self, bot_message_id: str, text_chunks: List[Text]) -> StreamEvent:
+        """Guarda las referencias de la respuesta y devuelve el evento que las anuncia en el stream."""
+        references = references_payload(text_chunks)
+        self.references.put(bot_message_id, references)
+        return StreamEvent("references", {"message_id": bot_message_id, "references": references})
+
+    def get_message_references(self, message_id: str) -> Optional[References]:
+        """
+        Referencias de una respuesta por su id. Las recientes salen de memoria;
+        las demás (caducadas o respondidas por otro worker) del historial en Mongo.
+        """
+        references = self.references.get(message_id)
+        if references is not None:
+            return references
+        metadata = self.assistant.get_message_metadata(message_id)
+        if metadata is None:
+            return None
+        references = references_payload([Text.model_validate(ref) for ref in metadata.get("references", [])])
+        self.references.put(message_id, references)
+        return references
+
     def answer(self, 
             user_id: str,
             conversation_id: str, # Added conversation_id
             question: str, 
             k: int = 10,
-            filter_metadata: Optional[Dict[str, Any]] = None
-            ) -> Generator[Union[str, Dict[str, Any]], None, None]: # Updated return type hint
-
+            filter_metadata: Optional[Dict[str, Any]] = None,
+            hybrid: bool = True,
+            rerank: bool = True
+            ) -> Generator[StreamEvent, None, None]: # Updated return type hint
+        """
+        Responde en streaming como una secuencia de eventos: `references` (antes
+        del primer token), un `token` por fragmento generado y `final` con el id
+        del mensaje y su metadata. El enmarcado SSE lo hace `cenacellm.sse`.
+        """
         token_generator, text_chunks, bot_message_id, full_metadata = self.query(
-            user_id, conversation_id, question, k=k, filter_metadata=filter_metadata # Pass conversation_id
+            user_id, conversation_id, question, k=k, filter_metadata=filter_metadata, hybrid=hybrid, rerank=rerank # Pass conversation_id
         )
 
-        self.last_chunks = text_chunks # This will now contain the chunks used for the answer
+        yield self._references_event(bot_message_id, text_chunks)
         
         for token in token_generator:
-            yield token
+            yield StreamEvent("token", token)
 
         # After all tokens are yielded, send the final message ID and metadata
-        # MODIFICADO: Envía la metadata y el ID en un objeto con una clave específica.
-        yield json.dumps({"final_message_data": {"message_id": bot_message_id, "metadata": full_metadata}})
+        yield StreamEvent("final", {"message_id": bot_message_id, "metadata": full_metadata})
+
+    async def aanswer(self,
+                      user_id: str,
+                      conversation_id: str,
+                      question: str,
+                      k: int = 10,
+                      filter_metadata: Optional[Dict[str, Any]] = None,
+                      hybrid: bool = True,
+                      rerank: bool = True
+                     ) -> AsyncGenerator[StreamEvent, None]:
+        """Versión asíncrona de `answer`, con los mismos eventos."""
+        token_generator, text_chunks, bot_message_id, full_metadata = await self.aquery(
+            user_id, conversation_id, question, k=k, filter_metadata=filter_metadata, hybrid=hybrid, rerank=rerank
+        )
+
+        yield self._references_event(bot_message_id, text_chunks)
+
+        async for token in token_generator:
+            yield StreamEvent("token", token)
+
+        yield StreamEvent("final", {"message_id": bot_message_id, "metadata": full_metadata})
 
         
+    async def aget_user_history(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        return await self.assistant.aload_history(user_id, conversation_id)
+
+    async def aclear_user_history(self, user_id: str, conversation_id: str):
+        return await self.assistant.aclear_conversation_history(user_id, conversation_id)
+
     def get_user_history(self, user_id : str, conversation_id: str) -> List[Dict[str, Any]]: # Added conversation_id
         return self.assistant.load_history(user_id, conversation_id) # Pass conversation_id
     
@@ -250,15 +589,15 @@ class RAG:
         El contenido será la pregunta y respuesta, y los metadatos incluirán información relevante
         de la solución y sus referencias originales.
         """
-        liked_solutions = self.assistant.get_liked_solutions(user_id)
+        # Mongo devuelve solo las soluciones que aún no están en el registro de procesadas
+        liked_solutions = self.assistant.get_liked_solutions(
+            user_id, unprocessed_in=self.processed_files_collection.name
+        )
         solutions_added_count = 0
+        pending: List[Tuple[str, Text]] = [] # (message_id, texto) a vectorizar en un solo lote
 
         for solution in liked_solutions:
             message_id = solution["id"]
-            
-            # Verificar si la solución ya ha sido procesada
-            if message_id in self.processed_solutions_ids:
-                continue # Saltar esta solución si ya está procesada
 
             # Combinar pregunta y respuesta como contenido para el vector
             content = f"Pregunta: {solution['question']}\nRespuesta: {solution['answer']}"
@@ -297,10 +636,12 @@ class RAG:
 
             # Crear el objeto Text con el contenido y los metadatos construidos
             text_obj = Text(content=content, metadata=TextMetadata(**new_text_metadata_dict))
+            pending.append((message_id, text_obj))
 
-            # Vectorizar el contenido y añadirlo al vectorstore
-            vector = self.embedder.vectorize(content)
-            self.vectorstore.add_text(vector, text_obj)
+        # Vectorizar todas las soluciones nuevas en lote y añadirlas al vectorstore
+        vectors = self.embedder.vectorize_many([text_obj.content for _, text_obj in pending])
+        self.vectorstore.add_texts(vectors, [text_obj for _, text_obj in pending])
+        for message_id, _ in pending:
             self._add_processed_solution_id(message_id, user_id) # Pass user_id here
             solutions_added_count += 1
         
@@ -318,36 +659,88 @@ class RAG:
         """
         self.vectorstore.delete_by_reference(reference_id)
         # No necesitas self.processed_files aquí, ya que la colección se actualiza en chat.py
+
+    def delete_many_from_vectorstore(self, reference_ids: List[str]) -> int:
+        """
+        Elimina varios documentos o soluciones del vectorstore en una sola pasada
+        y persiste el índice una vez.
+        """
+        removed = self.vectorstore.delete_by_references(reference_ids)
+        if removed:
+            self.vectorstore.save_index()
+        return removed
     
     def refresh_processed_data(self):
         """Refresca la caché en memoria de processed_files y processed_solutions_ids desde la DB."""
         self.processed_files = self._load_processed_files()
+        self.file_keys_by_reference = self._index_processed_files()
+        self.file_keys_by_hash = self._index_processed_hashes()
         self.processed_solutions_ids = self._load_processed_solutions_ids()
 
-    def get_tickets(self):
+    def _backfill_ticket_references(self) -> int:
+        """
+        Migración única: asigna un `reference` a los tickets antiguos que no lo
+        tienen, con una sola escritura en lote, para que `get_tickets` nunca escriba.
+        Queda registrada en la colección `migrations` y no se repite.
         """
-        Obtiene la lista de tickets de la base de datos, excluyendo _id y solucion.
+        if self.migrations_collection.find_one({"_id": "ticket_references"}):
+            return 0
+        missing = [doc["_id"] for doc in self.tickets_collection.find({"reference": {"$exists": False}}, {"_id": 1})]
+        updated = 0
+        if missing:
+            # Con varios workers arrancando a la vez, solo el primero asigna cada reference
+            updated = self.tickets_collection.bulk_write([
+                UpdateOne({"_id": ticket_id, "reference": {"$exists": False}},
+                          {"$set": {"reference": str(ObjectId())}})
+                for ticket_id in missing
+            ], ordered=False).modified_count
+            print(f"{updated} tickets sin reference actualizados.")
+        self.migrations_collection.update_one(
+            {"_id": "ticket_references"},
+            {"$set": {"applied_at": datetime.now().isoformat(), "tickets": updated}},
+            upsert=True
+        )
+        return updated
+
+    def get_tickets(self,
+                    skip: int = 0,
+                    limit: Optional[int] = None,
+                    sort_by: Optional[TicketSortField] = None,
+                    descending: bool = False,
+                    fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Obtiene la lista de tickets de la base de datos, excluyendo _id.
         Incluye un campo 'is_solved' basado en si su solucion_id está vinculado a una conversación con una solución liked.
+
+        Todo sale de una agregación: ordenación (`sort_by`, por defecto el
+        orden de alta), paginación (`skip`/`limit`) y un `$lookup` a las
+        conversaciones solo para los tickets de la página. Con `fields` se
+        devuelven únicamente esos campos (más 'is_solved').
         """
-        tickets_list = []
-        for ticket in self.tickets_collection.find({}, {'_id': 0}): # Get all fields including solucion_id
-            if 'reference' not in ticket:
-                # Genera un nuevo reference si no existe y actualiza en DB
-                new_reference = str(ObjectId())
-                self.tickets_collection.update_one(
-                    {"titulo": ticket['titulo']}, # Asume que el título es un identificador único si no hay reference
-                    {"$set": {"reference": new_reference}}
-                )
-                ticket['reference'] = new_reference
-            
-            # Check if the ticket's solucion_id is linked to a conversation with a liked solution
-            is_solved = False
-            if ticket.get('solucion_id'): # If there's a linked conversation
-                is_solved = self.assistant.has_liked_solution_in_conversation(ticket['solucion_id'])
-            
-            ticket['is_solved'] = is_solved # Add the solved status to the ticket dictionary
-            tickets_list.append(ticket)
-        return tickets_list
+        pipeline: List[Dict[str, Any]] = [{"$sort": {sort_by or "_id": -1 if descending else 1}}]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline += [
+            {"$lookup": {
+                "from": self.assistant.collection_name,
+                "let": {"conversation_id": "$solucion_id"},
+                "pipeline": [
+                    {"$match": {
+                        "$expr": {"$eq": ["$conversation_id", "$$conversation_id"]},
+                        "messages": {"$elemMatch": {"role": "assistant", "metadata.disable": True}},
+                    }},
+                    {"$limit": 1},
+                    {"$project": {"_id": 1}},
+                ],
+                "as": "liked",
+            }},
+            {"$addFields": {"is_solved": {"$gt": [{"$size": "$liked"}, 0]}}},
+            {"$project": {"_id": 0, **{field: 1 for field in fields}, "is_solved": 1}
+             if fields else {"_id": 0, "liked": 0}},
+        ]
+        return list(self.tickets_collection.aggregate(pipeline))
 
     def add_ticket(self, titulo: str, descripcion: str, categories: str) -> Dict[str, Any]:
         """
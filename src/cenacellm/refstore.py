@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from cenacellm.types import Chunks
+
+type References = List[Dict[str, Any]]
+
+
+def references_payload(chunks: Chunks) -> References:
+    """Referencias de una respuesta tal como las recibe el cliente: reference y metadata de cada chunk."""
+    return [
+        {"reference": chunk.metadata.reference, "metadata": chunk.metadata.model_dump()}
+        for chunk in chunks
+    ]
+
+
+class ReferenceStore:
+    """
+    Referencias de las respuestas recientes, por id del mensaje del bot.
+
+    Cada petición guarda las suyas, así que las consultas posteriores no
+    dependen de cuál fue la última respuesta del worker. Las entradas caducan
+    a los `ttl` segundos y se conservan como mucho `max_entries` (LRU).
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, References]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, message_id: str, references: References):
+        with self._lock:
+            self._entries[message_id] = (time.time(), references)
+            self._entries.move_to_end(message_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, message_id: str) -> Optional[References]:
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                return None
+            created_at, references = entry
+            if time.time() - created_at > self.ttl:
+                del self._entries[message_id]
+                return None
+            self._entries.move_to_end(message_id)
+            return references
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,104 @@
+import threading
+import numpy as np
+from typing import List, Literal, Optional
+from cenacellm.settings.config import RERANK_FETCH, RERANK_MODEL
+from cenacellm.tools.reranker import Reranker
+from cenacellm.types import Chunks, Matrix, Vector
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Dependencia opcional: sin ella solo está disponible MMR
+    CrossEncoder = None
+
+type RerankMethod = Literal["mmr", "cross-encoder"]
+
+
+class MMRReranker(Reranker):
+    """
+    Maximal Marginal Relevance sobre los vectores ya guardados: elige uno a
+    uno el candidato que mejor equilibra relevancia y diferencia con los ya
+    elegidos, así los k puestos no se gastan en chunks casi iguales.
+
+    La relevancia sale del orden de la recuperación (vectorial o híbrida) y
+    no de la distancia al embedding de la pregunta, para no perder los
+    candidatos que aportó BM25. `lambda_mult` = 1 deja el orden original.
+    """
+    method = "mmr"
+
+    def __init__(self, lambda_mult: float = 0.7, fetch: int = RERANK_FETCH, requested: Optional[str] = None):
+        self.lambda_mult = lambda_mult
+        self.fetch = fetch
+        self.requested = requested
+
+    def rerank(self, question: str, query_vector: Vector, vectors: Matrix, chunks: Chunks, n: int) -> List[int]:
+        count = len(chunks)
+        if count == 0 or n <= 0:
+            return []
+        vectors = np.asarray(vectors, dtype="float32").reshape(count, -1)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        relevance = 1.0 - np.arange(count, dtype="float32") / count
+
+        selected: List[int] = []
+        redundancy = np.zeros(count, dtype="float32")   # Máxima similitud con los ya elegidos
+        available = np.ones(count, dtype=bool)
+        for _ in range(min(n, count)):
+            scores = self.lambda_mult * relevance - (1 - self.lambda_mult) * redundancy
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, similarity[best])
+        return selected
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Puntúa cada par (pregunta, chunk) con un cross-encoder local en CPU. Es
+    más preciso que la similitud de embeddings pero cuesta una pasada del
+    modelo por candidato, por eso conviene un `fetch` pequeño. El modelo se
+    carga con el primer rerank.
+    """
+    method = "cross-encoder"
+
+    def __init__(self, model_name: str = RERANK_MODEL, fetch: int = RERANK_FETCH,
+                 batch_size: int = 16, max_length: int = 512):
+        if CrossEncoder is None:
+            raise ImportError("El reranker cross-encoder necesita el paquete sentence-transformers "
+                              "(pip install -e '.[rerank]')")
+        self.model_name = model_name
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                self._model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+            return self._model
+
+    def rerank(self, question: str, query_vector: Vector, vectors: Matrix, chunks: Chunks, n: int) -> List[int]:
+        if not chunks or n <= 0:
+            return []
+        scores = self._load().predict([(question, chunk.content) for chunk in chunks],
+                                      batch_size=self.batch_size, show_progress_bar=False)
+        return np.argsort(-np.asarray(scores), kind="stable")[:n].tolist()
+
+
+def make_reranker(method: Optional[RerankMethod]) -> Optional[Reranker]:
+    """
+    Reranker configurado. Si falta sentence-transformers el cross-encoder se
+    sustituye por MMR con un aviso, y el informe del rerank lo deja anotado.
+    """
+    if method is None:
+        return None
+    if method == "cross-encoder":
+        try:
+            return CrossEncoderReranker()
+        except ImportError as e:
+            print(f"Aviso: RERANKER={method!r} no está disponible ({e}); se usa MMR.")
+            return MMRReranker(requested=method)
+    if method == "mmr":
+        return MMRReranker()
+    raise ValueError(f"Reranker desconocido: {method}")
@@ -13,6 +13,7 @@ mongo_uri: str = os.getenv("MONGO_URI")
 db_name: str = os.getenv("DB_NAME")
 
 ollama = ollama_api.Client() #(host=ollama_base_url)
+ollama_async = AsyncClient() #(host=ollama_base_url)
 
 
 
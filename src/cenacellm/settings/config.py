@@ -12,3 +12,15 @@ HISTORY_FILE = BASE_DIR / "datos" / "historial.json"
 BACKUP_HISTORY_FILE = BASE_DIR / "datos" / "historial_backup.json"
 PROCESSED_FILES = BASE_DIR / "datos" / "processed_files.json"
 DOCUMENTS_DIR = BASE_DIR / "datos" / "documentos"
+EMBEDDINGS_CACHE = BASE_DIR / "datos" / "embeddings_cache.sqlite"
+TOKENIZER_PATH = BASE_DIR / "datos" / "tokenizer.json"  # tokenizer.json del modelo de chat (python -m cenacellm.prompt)
+TOKENIZER_REPO = "google/gemma-3-4b-it"  # Repo de Hugging Face del que se descarga; gemma3 comparte tokenizer entre tamaños
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024  # Tamaño máximo de cada PDF subido
+# Streaming del chat (SSE): los tokens se agrupan hasta cumplir el intervalo o el tamaño
+SSE_FLUSH_INTERVAL = 0.05       # segundos
+SSE_FLUSH_BYTES = 512
+SSE_HEARTBEAT_INTERVAL = 15.0   # segundos sin eventos antes de mandar un heartbeat
+# Rerank entre la recuperación y el LLM: "mmr", "cross-encoder" (extra `rerank`) o None para desactivarlo
+RERANKER = "mmr"
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # Cross-encoder multilingüe (incluye español)
+RERANK_FETCH = 3  # Se recuperan k·RERANK_FETCH candidatos y el reranker deja los k mejores
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import traceback
+from typing import Any, AsyncGenerator, AsyncIterator, List
+from cenacellm.settings.config import SSE_FLUSH_BYTES, SSE_FLUSH_INTERVAL, SSE_HEARTBEAT_INTERVAL
+from cenacellm.types import StreamEvent, StreamEventType
+
+# Evitan que proxies (nginx, etc.) y compresores retengan el stream en su buffer
+SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: StreamEventType, data: Any) -> str:
+    """Un evento SSE con sus datos en JSON (una sola línea `data:`)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(events: AsyncIterator[StreamEvent],
+                     flush_interval: float = SSE_FLUSH_INTERVAL,
+                     flush_bytes: int = SSE_FLUSH_BYTES,
+                     heartbeat_interval: float = SSE_HEARTBEAT_INTERVAL) -> AsyncGenerator[str, None]:
+    """
+    Convierte los eventos del RAG en eventos SSE.
+
+    Los tokens se agrupan en un solo evento `token` hasta que pasan
+    `flush_interval` segundos desde la última escritura o se juntan
+    `flush_bytes`; el primer token tras una pausa sale sin esperar. Cualquier
+    otro evento vacía antes lo pendiente, para conservar el orden. Si no hay
+    nada que escribir durante `heartbeat_interval` segundos (p. ej. mientras el
+    modelo procesa el prompt) se manda un `heartbeat` para que los proxies no
+    corten la conexión. Un error a mitad del stream se envía como evento `error`.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aiter(events)
+    buffer: List[str] = []
+    buffered_bytes = 0
+    last_write = loop.time()
+    pending = None
+
+    def flush() -> str:
+        nonlocal buffered_bytes, last_write
+        text = "".join(buffer)
+        buffer.clear()
+        buffered_bytes = 0
+        last_write = loop.time()
+        return sse_event("token", {"text": text})
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            wait = flush_interval if buffer else heartbeat_interval
+            done, _ = await asyncio.wait({pending}, timeout=max(0.0, last_write + wait - loop.time()))
+            if not done:
+                if buffer:
+                    yield flush()
+                else:
+                    last_write = loop.time()
+                    yield sse_event("heartbeat", {})
+                continue
+
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if event.event == "token":
+                buffer.append(event.data)
+                buffered_bytes += len(event.data.encode("utf-8"))
+                if buffered_bytes >= flush_bytes or loop.time() - last_write >= flush_interval:
+                    yield flush()
+            else:
+                if buffer:
+                    yield flush()
+                last_write = loop.time()
+                yield sse_event(event.event, event.data)
+        if buffer:
+            yield flush()
+    except Exception as e:
+        traceback.print_exc()
+        if buffer:
+            yield flush()
+        # LLMError guarda la excepción original, que es la que explica el fallo
+        cause = getattr(e, "exception", None)
+        yield sse_event("error", {"message": f"{e}: {cause}" if cause else str(e)})
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,100 @@
+import numpy as np
+from uuid import uuid4
+from cenacellm.ingest import IngestConfig, IngestFile, IngestPipeline, _extract, chunk_hash
+from cenacellm.tools.doccollection import DocCollection
+from cenacellm.tools.embedder import Embedder
+from cenacellm.types import Text, TextMetadata
+from cenacellm.vectorstore import FAISSVectorStore
+
+DIM = 8
+
+
+class _Embedder(Embedder):
+    """Vector determinista por contenido; anota qué textos se embebieron."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def vectorize(self, s):
+        return np.random.default_rng(int(chunk_hash(s)[:8], 16)).random(DIM, dtype="float32")
+
+    def vectorize_many(self, texts, batch_size=64):
+        self.embedded.extend(texts)
+        return super().vectorize_many(texts, batch_size)
+
+
+class _Collection(DocCollection):
+    """Cada "PDF" es una lista de páginas en memoria y cada página un chunk."""
+
+    def __init__(self):
+        self.pages = {}
+
+    def load_pdf(self, pdf_path, collection=None):
+        # Como load_pdf real: cada carga genera una reference nueva
+        reference = str(uuid4())
+        return [Text(content=page, metadata=TextMetadata(source=pdf_path, reference=reference,
+                                                         collection=collection, page_number=i + 1))
+                for i, page in enumerate(self.pages[pdf_path])]
+
+    def get_chunks(self, texts):
+        return list(texts)
+
+
+def _pipeline(tmp_path):
+    collection = _Collection()
+    embedder = _Embedder()
+    store = FAISSVectorStore(embedder, DIM, folder_path=str(tmp_path / "vectors"), refresh_interval=None)
+    config = IngestConfig(extract_workers=1, embed_workers=1, embed_batch_size=2)
+    return collection, embedder, store, IngestPipeline(collection, embedder, store, config)
+
+
+def _ids_by_content(store, reference):
+    return {store.chunks[idx].content: idx for idx in store.ids_for(reference=reference)}
+
+
+def test_reindex_reuses_unchanged_chunks_and_removes_changed_pages(tmp_path):
+    collection, embedder, store, pipeline = _pipeline(tmp_path)
+    collection.pages["manual.pdf"] = ["uno", "dos", "tres", "cuatro"]
+    [first] = pipeline.run([IngestFile("k", "manual.pdf", "documentos")])
+    before = _ids_by_content(store, first.reference)
+    assert first.chunks == first.embedded == 4
+
+    # Cambia la página 2 y desaparece la 4
+    embedder.embedded.clear()
+    collection.pages["manual.pdf"] = ["uno", "dos (rev. 2)", "tres"]
+    [second] = pipeline.run([IngestFile("k", "manual.pdf", "documentos", reference=first.reference)])
+
+    assert second.reference == first.reference
+    assert (second.chunks, second.embedded) == (3, 1)
+    assert embedder.embedded == ["dos (rev. 2)"]
+    report = pipeline.report
+    assert (report.chunks, report.chunks_reused, report.chunks_removed) == (1, 2, 2)
+
+    after = _ids_by_content(store, first.reference)
+    assert set(after) == {"uno", "dos (rev. 2)", "tres"}
+    # Los chunks sin cambios conservan id y vector; los de las páginas cambiadas ya no existen
+    assert after["uno"] == before["uno"] and after["tres"] == before["tres"]
+    assert before["dos"] not in store.chunks and before["cuatro"] not in store.chunks
+    ids = np.array([after["uno"], after["tres"]], dtype="int64")
+    np.testing.assert_allclose(store._vectors(ids), [embedder.vectorize("uno"), embedder.vectorize("tres")])
+
+
+def test_diff_updates_metadata_of_moved_chunks(tmp_path):
+    collection, _, store, pipeline = _pipeline(tmp_path)
+    collection.pages["manual.pdf"] = ["uno", "dos", "dos"]
+    [first] = pipeline.run([IngestFile("k", "manual.pdf", "documentos")])
+    ids = sorted(store.ids_for(reference=first.reference))
+
+    # Se inserta una página al principio: el resto se desplaza pero no cambia de contenido
+    collection.pages["manual.pdf"] = ["cero", "uno", "dos", "dos"]
+    extracted, _ = _extract("manual.pdf", "documentos", collection)
+    document = pipeline._diff(IngestFile("k", "manual.pdf", "documentos", reference=first.reference), extracted, 2)
+
+    assert [chunk.content for chunk in document.chunks] == ["cero"]
+    assert document.chunks[0].metadata.reference == first.reference
+    assert document.stale == []
+    # Los chunks repetidos se emparejan uno a uno, en orden
+    assert [(idx, text.content, text.metadata.page_number) for idx, text in document.updates] == [
+        (ids[0], "uno", 2), (ids[1], "dos", 3), (ids[2], "dos", 4),
+    ]
+    assert document.total == 4 and document.batches == 1
@@ -0,0 +1,82 @@
+import asyncio
+import json
+from cenacellm.sse import sse_event, sse_stream
+from cenacellm.types import LLMError, StreamEvent
+
+
+def _parse(frames):
+    """(evento, datos) de cada evento SSE; comprueba el formato de cada frame."""
+    events = []
+    for frame in frames:
+        assert frame.endswith("\n\n")
+        event, data = frame[:-2].split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _collect(events, **options):
+    async def run():
+        return [frame async for frame in sse_stream(events, **options)]
+    return _parse(asyncio.run(run()))
+
+
+async def _chat(*tokens, delay=0.0):
+    yield StreamEvent("references", {"message_id": "m1", "references": [{"source": "a.pdf"}]})
+    for token in tokens:
+        if delay:
+            await asyncio.sleep(delay)
+        yield StreamEvent("token", token)
+    yield StreamEvent("final", {"message_id": "m1", "metadata": {"model": "test"}})
+
+
+def test_sse_event_framing():
+    frame = sse_event("token", {"text": "línea 1\nlínea 2"})
+    # Los saltos de línea van escapados en el JSON: un solo campo data por evento
+    assert frame == 'event: token\ndata: {"text": "línea 1\\nlínea 2"}\n\n'
+
+
+def test_event_sequence_coalesces_tokens():
+    events = _collect(_chat("Hola", ", ", "mundo", "."), flush_interval=60, heartbeat_interval=60)
+    # Los tokens sin pausa entre ellos se agrupan y se vacían antes de `final`
+    assert events == [
+        ("references", {"message_id": "m1", "references": [{"source": "a.pdf"}]}),
+        ("token", {"text": "Hola, mundo."}),
+        ("final", {"message_id": "m1", "metadata": {"model": "test"}}),
+    ]
+
+
+def test_tokens_flush_by_size():
+    events = _collect(_chat("a" * 3, "b" * 3, "c" * 3, "d"), flush_interval=60, flush_bytes=6, heartbeat_interval=60)
+    assert [data["text"] for event, data in events if event == "token"] == ["aaabbb", "cccd"]
+
+
+def test_tokens_flush_by_interval():
+    # Tras una pausa de más de `flush_interval` cada token sale sin esperar
+    events = _collect(_chat("a", "b", "c", delay=0.05), flush_interval=0.01, heartbeat_interval=60)
+    assert [data["text"] for event, data in events if event == "token"] == ["a", "b", "c"]
+
+
+def test_heartbeat_while_waiting():
+    async def slow():
+        await asyncio.sleep(0.25)
+        yield StreamEvent("token", "hola")
+        yield StreamEvent("final", {})
+
+    events = _collect(slow(), heartbeat_interval=0.1)
+    names = [event for event, _ in events]
+    assert names[:2] == ["heartbeat", "heartbeat"]
+    assert names[-2:] == ["token", "final"]
+
+
+def test_error_after_flushing_pending_tokens():
+    async def failing():
+        yield StreamEvent("token", "Hola")
+        yield StreamEvent("token", " mun")
+        raise LLMError("Fallo del modelo", ConnectionError("sin conexión"))
+
+    events = _collect(failing(), flush_interval=60, heartbeat_interval=60)
+    assert events == [
+        ("token", {"text": "Hola mun"}),
+        ("error", {"message": "Fallo del modelo: sin conexión"}),
+    ]
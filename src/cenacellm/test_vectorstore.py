@@ -0,0 +1,37 @@
+import faiss
+import numpy as np
+import pickle
+from cenacellm.tools.embedder import Embedder
+from cenacellm.types import Text, TextMetadata
+from cenacellm.vectorstore import FAISSVectorStore
+
+DIM = 4
+
+
+class _Embedder(Embedder):
+    def vectorize(self, s):
+        return np.ones(DIM, dtype="float32")
+
+
+def _text(content):
+    return Text(content=content, metadata=TextMetadata(source="test.pdf", reference="doc", collection="documentos"))
+
+
+def test_legacy_store_migrates_with_normalized_vectors(tmp_path):
+    # Store v1: IndexFlatL2 posicional + {posición: (vector, Text)} con vectores sin normalizar
+    vectors = np.array([[3, 4, 0, 0], [0, 0, 0, 2], [1, 1, 1, 1]], dtype="float32")
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors)
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+    # La posición 1 se borró: las claves ya no coinciden con las posiciones del índice
+    stored = {0: (vectors[0], _text("cero")), 2: (vectors[2], _text("dos"))}
+    with open(tmp_path / "index.pkl", "wb") as f:
+        pickle.dump(stored, f)
+
+    store = FAISSVectorStore(_Embedder(), DIM, folder_path=str(tmp_path), refresh_interval=None)
+
+    assert sorted(store.chunks) == [0, 2]
+    assert store.chunks[2].content == "dos"
+    migrated = store._vectors(np.array([0, 2], dtype="int64"))
+    np.testing.assert_allclose(migrated, [[0.6, 0.8, 0, 0], [0.5, 0.5, 0.5, 0.5]], rtol=1e-6)
+    assert (tmp_path / "index.faiss.v1.bak").exists() and (tmp_path / "index.pkl.v1.bak").exists()
@@ -0,0 +1,86 @@
+import numpy as np
+from cenacellm.tools.embedder import Embedder
+from cenacellm.types import Text, TextMetadata
+from cenacellm.vectorstore import FAISSVectorStore, wal_name
+from cenacellm.wal import WriteAheadLog, _FRAME, add_record, delete_record, update_record
+
+DIM = 4
+
+
+class _Embedder(Embedder):
+    def vectorize(self, s):
+        return np.ones(DIM, dtype="float32")
+
+
+def _texts(*contents, reference="doc"):
+    return [Text(content=c, metadata=TextMetadata(source="test.pdf", reference=reference, collection="documentos")) for c in contents]
+
+
+def _matrix(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype="float32")
+
+
+def test_read_stops_before_truncated_frame(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal.log"))
+    complete = wal.append([add_record([0, 1], _matrix(2), _texts("a", "b")), delete_record([0])])
+    tail = update_record(1, _texts("b2")[0])
+    with open(wal.path, "ab") as f:
+        # Caída a mitad de escritura: cabecera completa y solo parte del payload
+        f.write(_FRAME.pack(len(tail), 0) + tail[:len(tail) // 2])
+
+    records, offset = wal.read()
+    assert [header["op"] for header, _ in records] == ["add", "delete"]
+    assert offset == complete
+    np.testing.assert_array_equal(records[0][1], _matrix(2))
+
+    # Leer desde el final válido no devuelve nada ni avanza
+    assert wal.read(offset) == ([], offset)
+
+    wal.truncate(offset)
+    assert wal.size() == complete
+    assert wal.append([tail]) > complete
+    records, _ = wal.read(offset)
+    assert [header["op"] for header, _ in records] == ["update"]
+
+
+def test_read_stops_at_corrupt_frame(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal.log"))
+    first = wal.append([delete_record([0])])
+    wal.append([delete_record([1])])
+    with open(wal.path, "r+b") as f:
+        # Un byte cambiado en el payload del segundo registro: el crc ya no coincide
+        f.seek(first + _FRAME.size + 2)
+        f.write(b"X")
+
+    records, offset = wal.read()
+    assert [header["ids"] for header, _ in records] == [[0]]
+    assert offset == first
+
+
+def test_store_replays_wal_and_discards_truncated_tail(tmp_path):
+    folder = str(tmp_path)
+    store = FAISSVectorStore(_Embedder(), DIM, folder_path=folder, refresh_interval=None)
+    ids = store.add_texts(_matrix(3), _texts("uno", "dos", "tres"))
+    store.delete_ids([ids[0]])
+    store.update_texts([(ids[1], _texts("dos bis")[0])])
+    store.save_index()
+
+    wal_path = tmp_path / wal_name(store.generation)
+    valid = wal_path.stat().st_size
+    tail = add_record([ids[-1] + 1], _matrix(1, seed=1), _texts("cuatro"))
+    with open(wal_path, "ab") as f:
+        f.write(_FRAME.pack(len(tail), 0) + tail[:10])
+
+    reopened = FAISSVectorStore(_Embedder(), DIM, folder_path=folder, refresh_interval=None)
+    assert sorted(reopened.chunks) == ids[1:]
+    assert reopened.chunks[ids[1]].content == "dos bis"
+    assert reopened.chunks[ids[2]].content == "tres"
+    assert reopened.next_id == ids[-1] + 1
+    # Con el cerrojo de escritura el registro a medias se recorta
+    assert wal_path.stat().st_size == valid
+
+    # Lo que se escribe después queda tras el último registro válido
+    new = reopened.add_texts(_matrix(1, seed=2), _texts("cinco"))
+    assert new == [ids[-1] + 1]
+    store.refresh()
+    assert store.chunks[new[0]].content == "cinco"
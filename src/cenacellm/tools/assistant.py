@@ -1,6 +1,6 @@
 from cenacellm.types import CallMetadata, Text, Chunks, Question
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from string import Template
 
 class Assistant(ABC):
@@ -19,22 +19,45 @@ class Assistant(ABC):
             """
         )
 
-    def answer_user(self, q : Question, cs : Chunks) -> str:
+    def answer_reference(self, n : int, chunk : Text) -> str:
         ref_tpl = Template(
             """            
 Referencia ${n}: ${path} en ${ref}
 ${content}
             """
         )
+        return ref_tpl.substitute(
+            n = n,
+            path = chunk.metadata.source,
+            ref = chunk.metadata.reference,
+            content = chunk.content,
+        )
+
+    def summary_user(self, summary : Optional[str], messages : List[Dict[str, Any]], max_chars : int = 2000) -> str:
+        # Las respuestas largas se recortan: para el resumen basta con su inicio
+        lines = "\n".join(f"{m['role']}: {m['content'][:max_chars]}" for m in messages)
+
+        summary_tpl = Template(
+            """
+Resume la siguiente conversación entre un usuario y un asistente técnico.
+Conserva lo necesario para continuarla: el problema planteado, los equipos, códigos
+de alarma y subestaciones mencionados, lo que ya se intentó y lo que quedó pendiente.
+Responde solo con el resumen, en un párrafo.
+
+Resumen anterior:
+${summary}
 
-        refs = ""
-        for n, chunk in enumerate(cs):
-            refs += ref_tpl.substitute(
-                n = n + 1,
-                path = chunk.metadata.source,
-                ref = chunk.metadata.reference,
-                content = chunk.content,
-            )
+Mensajes nuevos:
+${messages}
+            """
+        )
+        return summary_tpl.substitute(
+            summary=summary or "(ninguno)",
+            messages=lines,
+        )
+
+    def answer_user(self, q : Question, cs : Chunks) -> str:
+        refs = "".join(self.answer_reference(n + 1, chunk) for n, chunk in enumerate(cs))
         
         prompt_tpl = Template(
             """
@@ -1,8 +1,22 @@
+import asyncio
 from abc import ABC, abstractmethod
-from cenacellm.types import Vector
-from typing import Dict
+from cenacellm.types import Vector, Matrix
+from typing import Dict, List
+import numpy as np
 
 class Embedder(ABC):
     @abstractmethod
     def vectorize(self, s : str) -> Dict[str, Vector]:
         pass
+
+    def vectorize_many(self, texts : List[str], batch_size : int = 64) -> Matrix:
+        """Vectoriza varios textos y devuelve una matriz float32 contigua (n, dim)."""
+        if not texts:
+            return np.empty((0, 0), dtype="float32")
+        return np.ascontiguousarray(
+            np.vstack([self.vectorize(s) for s in texts]), dtype="float32"
+        )
+
+    async def avectorize(self, s : str) -> Vector:
+        """Versión asíncrona de `vectorize`; por defecto la ejecuta en un hilo."""
+        return await asyncio.to_thread(self.vectorize, s)
@@ -19,10 +19,7 @@ class RAG:
 
     def add_doc(self, t : Text):
         chunks = self.d.get_chunks(t)
-        vectors = [
-            self.e.vectorize(chunk.content)
-            for chunk in chunks
-        ]
+        vectors = self.e.vectorize_many([chunk.content for chunk in chunks])
         for vector, chunk in zip(vectors, chunks):
             ok = self.v.add_text(vector, chunk)
             if not ok:
@@ -30,10 +27,7 @@ class RAG:
 
     def del_doc(self, t : Text):
         chunks = self.d.get_chunks(t)
-        vectors = [
-            self.e.vectorize(chunk.content)
-            for chunk in chunks
-        ]
+        vectors = self.e.vectorize_many([chunk.content for chunk in chunks])
         for vector in vectors:
             ok = self.v.del_text(vector)
             if not ok:
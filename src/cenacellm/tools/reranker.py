@@ -0,0 +1,13 @@
+from abc import ABC, abstractmethod
+from cenacellm.types import Chunks, Matrix, Vector
+from typing import List, Optional
+
+class Reranker(ABC):
+    method : str
+    fetch : int     # Se recuperan k·fetch candidatos para que el reranker deje k
+    requested : Optional[str] = None    # Método configurado que este reranker sustituye
+
+    @abstractmethod
+    def rerank(self, question : str, query_vector : Vector, vectors : Matrix, chunks : Chunks, n : int) -> List[int]:
+        """Posiciones en `chunks` de los `n` mejores candidatos, del mejor al peor."""
+        pass
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Any, Dict, Literal, NamedTuple, Optional, List
 import numpy as np
 
 
@@ -30,6 +30,37 @@ type Question = Text
 
 type Vector = np.ndarray
 
+type Matrix = np.ndarray  # (n, dim) float32, una fila por texto
+
+type StreamEventType = Literal["token", "references", "final", "error", "heartbeat"]
+
+class ConversationMemory(NamedTuple):
+    summary : Optional[str]                 # Resumen de los mensajes anteriores, si ya se calculó
+    messages : List[Dict[str, Any]]         # Mensajes recientes que el resumen aún no cubre
+
+class StreamEvent(NamedTuple):
+    event : StreamEventType   # Tipo de evento del stream del chat
+    data : Any                # Texto del token o payload JSON del evento
+
+class PromptReport(BaseModel):
+    budget : int                  # Presupuesto de tokens del prompt
+    tokens : int                  # Tokens del prompt armado (sistema incluido)
+    exact : bool                  # Contados con el tokenizer del modelo (False = estimación)
+    references : int              # Referencias incluidas
+    duplicates : int = 0          # Chunks descartados por repetir otro ya incluido
+    trimmed : int = 0             # Chunks recortados por solaparse con otro incluido
+    dropped : List[TextMetadata] = []   # Referencias que no cupieron en el presupuesto
+    history_messages : int = 0    # Mensajes del historial incluidos
+    history_dropped : int = 0     # Mensajes del historial que no cupieron
+    summary : bool = False        # Se incluyó el resumen de la conversación
+
+class RerankReport(BaseModel):
+    method : str                  # Método que se aplicó: "mmr" o "cross-encoder"
+    requested : Optional[str] = None  # Método configurado, si no estaba disponible y se sustituyó
+    candidates : int              # Chunks recuperados antes del rerank
+    selected : int                # Chunks que pasaron al prompt builder
+    duration : float              # Segundos que tardó el rerank
+
 class CallMetadata(BaseModel):
     provider : str        # Provider name
     model : str           # Model name
@@ -40,6 +71,9 @@ class CallMetadata(BaseModel):
     references :  Chunks # List of references used in the response
 
     disable : bool = False  # New field to disable the response, default is False
+    cached : bool = False   # Respuesta servida desde la caché semántica
+    prompt : Optional[PromptReport] = None  # Cómo se armó el prompt (presupuesto, descartes)
+    rerank : Optional[RerankReport] = None  # Rerank aplicado a la recuperación, si lo hubo
     timestamp : str   # Response timestamp in UTC
 
 def call_metadata(
@@ -50,7 +84,9 @@ def call_metadata(
         input_tokens : Optional[int],
         output_tokens : Optional[int],
         references : Chunks,
-        disable: bool = False
+        disable: bool = False,
+        prompt: Optional[PromptReport] = None,
+        rerank: Optional[RerankReport] = None
 ) -> CallMetadata:
     return CallMetadata(
         provider=provider,
@@ -61,6 +97,8 @@ def call_metadata(
         output_tokens=output_tokens,
         references=references,
         disable=disable,
+        prompt=prompt,
+        rerank=rerank,
         timestamp=datetime.now(timezone.utc).isoformat(),
     )
 
@@ -1,114 +1,825 @@
 import faiss
+import json
 import numpy as np
 import pickle
 import os
-from typing import Dict, List, Tuple
+import re
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from cenacellm.chunkstore import ChunkStore
+from cenacellm.lexical import LexicalIndex, rrf_fuse
+from cenacellm.wal import WriteAheadLog, add_record, delete_record, update_record
 from cenacellm.types import Text, TextMetadata
 from cenacellm.tools.embedder import Embedder
 from cenacellm.tools.vectorstore import VectorStore
 from cenacellm.settings.config import VECTORS_DIR
+from cenacellm.faissindex import (
+    IndexConfig,
+    IndexType,
+    IVF_TYPES,
+    build_index,
+    index_kind,
+    prepare_index,
+    remove_ids,
+    search_params,
+    supports_remove,
+)
+
+STORE_VERSION = 3
+
+# Tamaño del WAL a partir del cual save_index lanza una compactación en segundo plano
+WAL_COMPACT_BYTES = 64 * 1024 * 1024
+# Ids borrados del snapshot (ocultos con un selector) a partir de los cuales también se compacta
+MASKED_COMPACT_IDS = 10_000
+
+# En la búsqueda híbrida cada lista (vectorial y BM25) aporta k·HYBRID_FETCH candidatos a la fusión
+HYBRID_FETCH = 3
+
+# Los snapshots se abren mapeados y de solo lectura: los procesos que abren el
+# mismo archivo comparten sus páginas en lugar de tener cada uno su copia
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def snapshot_names(generation: int) -> Tuple[str, str, str]:
+    """Nombres del índice y de los prefijos de chunks y BM25 de una generación (la 0 conserva los nombres sin sufijo)."""
+    suffix = f"-{generation}" if generation else ""
+    return f"index{suffix}.faiss", f"chunks{suffix}", f"bm25{suffix}"
+
+
+def wal_name(generation: int) -> str:
+    return f"wal-{generation}.log"
+
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _read_store_info(path: str) -> Dict[str, int]:
+    if not os.path.exists(path):
+        return {"generation": 0, "next_id": 0}
+    with open(path, encoding="utf-8") as f:
+        info = json.load(f)
+    return {"generation": info.get("generation", 0), "next_id": info["next_id"]}
+
+
+def _id_batch(ids: Set[int]) -> faiss.IDSelectorBatch:
+    return faiss.IDSelectorBatch(np.fromiter(ids, dtype="int64", count=len(ids)))
+
+
+class _FileLock:
+    """
+    Cerrojo exclusivo entre procesos sobre un archivo. Es reentrante dentro
+    del proceso porque siempre se toma con `_write_lock` ya adquirido.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        if not self._depth:
+            f = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass  # LK_LOCK se rinde tras 10 s; se sigue esperando
+            self._file = f
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if not self._depth:
+            f, self._file = self._file, None
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            f.close()
+
+
+def _write_store_info(folder_path: str, next_id: int, generation: int = 0):
+    """Escribe store.json de forma atómica; es lo que decide qué generación está vigente."""
+    path = os.path.join(folder_path, "store.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "generation": generation, "next_id": next_id}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def migrate_legacy_store(folder_path: str = VECTORS_DIR) -> bool:
+    """
+    Convierte un store con index.pkl al formato actual (índice con ids estables
+    + ChunkStore en disco).
+
+    - v1: IndexFlatL2 posicional con {posición: (vector, Text)}. El índice se
+      reconstruye con los vectores del diccionario y no con los del índice,
+      porque tras cualquier `remove_ids` las posiciones ya no coinciden con sus claves.
+      Esos vectores salieron del endpoint `embeddings` de Ollama, sin normalizar;
+      las consultas ahora usan `embed`, que devuelve el mismo vector del modelo
+      normalizado a norma 1. Por eso se normalizan aquí: quedan iguales a los
+      que daría `embed` sin volver a embeber los textos.
+    - v2: IndexIDMap2 con {"texts": {id: Text}, ...}. Solo se mueven los textos.
+
+    Los archivos originales se conservan con la extensión `.bak`.
+    Devuelve True si hubo migración.
+    """
+    index_path = os.path.join(folder_path, "index.faiss")
+    dict_path = os.path.join(folder_path, "index.pkl")
+    if not (os.path.exists(index_path) and os.path.exists(dict_path)):
+        return False
+
+    with open(dict_path, "rb") as f:
+        stored = pickle.load(f)
+
+    chunks = ChunkStore(folder_path)
+    if "version" not in stored:
+        old_index = faiss.read_index(index_path)
+        ids = np.array(sorted(stored), dtype="int64")
+        new_index = faiss.IndexIDMap2(faiss.IndexFlatL2(old_index.d))
+        if len(ids):
+            matrix = np.vstack([np.asarray(stored[idx][0], dtype="float32").reshape(1, -1) for idx in ids])
+            faiss.normalize_L2(matrix)
+            new_index.add_with_ids(matrix, ids)
+        for idx in ids.tolist():
+            chunks.add(idx, stored[idx][1])
+        next_id = int(ids.max()) + 1 if len(ids) else 0
+        # Índice nuevo completo en .tmp, copia del original y solo entonces el reemplazo:
+        # en ningún momento falta index.faiss, así que un corte a medias se vuelve a migrar
+        faiss.write_index(new_index, index_path + ".tmp")
+        _fsync_file(index_path + ".tmp")
+        if not os.path.exists(index_path + ".v1.bak"):  # Un reintento no pisa la copia del original
+            shutil.copy2(index_path, index_path + ".v1.bak")
+        os.replace(index_path + ".tmp", index_path)
+    else:
+        for idx, text in stored["texts"].items():
+            chunks.add(idx, text)
+        next_id = stored["next_id"]
+
+    chunks.write()
+    print(f"Vectorstore migrado: {len(chunks)} chunks en {folder_path}")
+    chunks.close()
+    _write_store_info(folder_path, next_id)
+    os.replace(dict_path, dict_path + f".v{stored.get('version', 1)}.bak")
+    return True
+
 
 class FAISSVectorStore(VectorStore):
-    def __init__(self, embeddings: Embedder, dim: int, folder_path: str = VECTORS_DIR):
+    """
+    Vector store sobre FAISS con persistencia incremental, compartible entre procesos.
+
+    En disco hay un snapshot por generación (índice FAISS + ChunkStore +
+    índice léxico BM25) y un registro de operaciones (WAL) con todo lo
+    ocurrido después. El snapshot se
+    abre mapeado en memoria y de solo lectura, así que todos los workers que
+    sirven la misma carpeta comparten una sola copia en la caché de páginas.
+    Lo posterior al snapshot vive en memoria: los vectores nuevos en un índice
+    Flat pequeño (`delta`) y los borrados como ids ocultos (`masked`).
+
+    Las escrituras de cualquier proceso se serializan con un cerrojo de archivo
+    y van directas al WAL; los demás procesos las incorporan al buscar (como
+    mucho cada `refresh_interval` segundos) y, cuando una compactación publica
+    una generación nueva en `store.json`, pasan a leer de ella sin reiniciar.
+    """
+
+    def __init__(self, embeddings: Embedder, dim: int, folder_path: str = VECTORS_DIR,
+                 index_config: Optional[IndexConfig] = None, wal_compact_bytes: int = WAL_COMPACT_BYTES,
+                 refresh_interval: Optional[float] = 1.0):
         self.embeddings = embeddings
-        self.text_dict: Dict[int, Tuple[np.ndarray, str, Dict[str, str]]] = {}
+        self.dim = dim
+        self.config = index_config or IndexConfig()
+        self.wal_compact_bytes = wal_compact_bytes
+        self.refresh_interval = refresh_interval
+
+        # Mutaciones, guardado y compactación van serializados; las búsquedas
+        # solo esperan a que termine la modificación puntual del índice.
+        # _index_lock es reentrante: al cambiar de generación se abre el
+        # snapshot y se aplica el WAL sin soltarlo
+        self._write_lock = threading.RLock()
+        self._index_lock = threading.RLock()
+        self._unsaved = 0
+        self._needs_snapshot = False
+        self._compaction: Optional[threading.Thread] = None
+        self._last_refresh = time.monotonic()
+        # Avisos de chunks borrados o modificados (p. ej. para invalidar cachés)
+        self._listeners: List[Callable[[List[int]], None]] = []
 
         # Asegura que el folder exista
         os.makedirs(folder_path, exist_ok=True)
 
         self.folder_path = folder_path
-        self.index_path = os.path.join(folder_path, "index.faiss")
-        self.dict_path = os.path.join(folder_path, "index.pkl")
+        self.info_path = os.path.join(folder_path, "store.json")
+        # Los workers de uvicorn/gunicorn comparten la carpeta: un solo escritor a la vez
+        self._store_lock = _FileLock(os.path.join(folder_path, "store.lock"))
 
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-            print(f"Índice cargado desde {self.index_path}")
-            if os.path.exists(self.dict_path):
-                with open(self.dict_path, "rb") as f:
-                    self.text_dict = pickle.load(f)
-                print(f"Diccionario cargado desde {self.dict_path}")
+        with self._write_lock, self._store_lock:
+            migrate_legacy_store(folder_path)
+            self._open(_read_store_info(self.info_path))
+            if not self.lexical.persisted and len(self.chunks):
+                # Store anterior al índice léxico: se guarda el que _open construyó
+                self.lexical.write()
+                self.lexical = LexicalIndex(folder_path, self.lexical.prefix)
+            replayed = self._sync()
+            self._remove_stale_files()
+        print(f"Chunks disponibles en {folder_path}: {len(self.chunks)} ({replayed} operaciones del WAL)")
+
+        self._maybe_upgrade()
+
+    def _open(self, info: Dict[str, int]):
+        """Pasa a leer del snapshot de `info["generation"]`, con el delta vacío."""
+        generation = info["generation"]
+        index_name, chunks_prefix, lexical_prefix = snapshot_names(generation)
+        index_path = os.path.join(self.folder_path, index_name)
+
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path, MMAP_FLAGS)
+            print(f"Índice cargado desde {index_path}")
         else:
             print("No se encontró el archivo de índice, creando nuevo índice.")
-            self.index = faiss.IndexFlatL2(dim)
+            # Los IVF empiezan como Flat hasta tener vectores suficientes para entrenar
+            start_kind = "flat" if self.config.index_type in IVF_TYPES else self.config.index_type
+            index = build_index(start_kind, self.dim, self.config)
+        prepare_index(index, self.config)
+        # Texto y metadata viven en disco (mmap); los vectores solo en el índice
+        chunks = ChunkStore(self.folder_path, chunks_prefix)
+        lexical = LexicalIndex(self.folder_path, lexical_prefix)
+        if _read_store_info(self.info_path)["generation"] != generation:
+            # Otro proceso compactó mientras se abría: los archivos pueden estar ya borrados
+            raise FileNotFoundError(f"La generación {generation} ya no es la vigente")
+        if not lexical.persisted and len(chunks):
+            print(f"Construyendo el índice léxico de {len(chunks)} chunks...")
+            for idx in chunks:
+                lexical.add(idx, chunks[idx].content)
 
-    def get_similar(self, v: np.ndarray, k: int = 10, filter_metadata: Dict[str, str] = None):
-        v = np.array([v]).astype("float32")
-        D, I = self.index.search(v, k)
-        resultados = []
+        with self._index_lock:
+            self.generation, self.index_path, self.next_id = generation, index_path, info["next_id"]
+            self.index = index
+            self.delta = build_index("flat", index.d, self.config)
+            self._delta_ids: Set[int] = set()
+            self.masked: Set[int] = set()
+            self.chunks = chunks
+            self.lexical = lexical
+            # Índices inversos para localizar chunks sin recorrer el almacén
+            self.by_reference, self.by_collection = chunks.reverse_index()
+            self.wal = WriteAheadLog(os.path.join(self.folder_path, wal_name(generation)))
+            self._wal_offset = 0
 
-        for idx in I[0]:
-            if idx == -1 or idx not in self.text_dict:
-                continue
+    def _target_kind(self) -> IndexType:
+        """Tipo de índice que corresponde a la configuración y al tamaño actual."""
+        kind = self.config.index_type
+        ntotal = len(self.chunks)
+        if kind == "flat" and self.config.auto_ivf_threshold and ntotal >= self.config.auto_ivf_threshold:
+            kind = "ivf_flat"
+        if kind in IVF_TYPES and ntotal < self.config.train_min:
+            kind = "flat"
+        return kind
+
+    def _maybe_upgrade(self):
+        """Pide una compactación en cuanto el índice Flat inicial puede pasar al tipo configurado."""
+        if index_kind(self.index) == "flat" and self._target_kind() != "flat":
+            self._needs_snapshot = True
+
+    def _vectors(self, ids: np.ndarray) -> np.ndarray:
+        """Vectores de esos ids, del delta o del snapshot según dónde esté cada uno (con _index_lock)."""
+        matrix = np.empty((len(ids), self.index.d), dtype="float32")
+        in_delta = np.fromiter((idx in self._delta_ids for idx in ids.tolist()), dtype=bool, count=len(ids))
+        if in_delta.any():
+            matrix[in_delta] = self.delta.reconstruct_batch(ids[in_delta])
+        if not in_delta.all():
+            matrix[~in_delta] = self.index.reconstruct_batch(ids[~in_delta])
+        return matrix
+
+    def _all_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.array(sorted(self.chunks), dtype="int64")
+        if not len(ids):
+            return ids, np.empty((0, self.index.d), dtype="float32")
+        with self._index_lock:
+            return ids, self._vectors(ids)
+
+    def rebuild_index(self, kind: IndexType) -> faiss.Index:
+        """Crea un índice de otro tipo con todos los vectores vivos y sus ids; los IVF se entrenan aquí."""
+        ids, matrix = self._all_vectors()
+        training = None
+        if kind in IVF_TYPES:
+            sample_size = min(len(matrix), max(self.config.train_min, 256 * 1024))
+            sample = np.random.default_rng(0).choice(len(matrix), sample_size, replace=False)
+            training = matrix[np.sort(sample)]
+        index = build_index(kind, self.index.d, self.config, training)
+        if len(ids):
+            index.add_with_ids(matrix, ids)
+        print(f"Índice reconstruido como {kind} con {len(ids)} vectores.")
+        return index
+
+    def _merged_index(self) -> faiss.Index:
+        """Índice de la generación siguiente: el snapshot sin los ids ocultos y con el delta."""
+        kind = self._target_kind()
+        if index_kind(self.index) != kind or self.masked and not supports_remove(self.index):
+            # Cambio de tipo, o HNSW (no admite borrados): se reconstruye entero
+            return self.rebuild_index(kind)
+        if os.path.exists(self.index_path):
+            # El snapshot mapeado es de solo lectura: se trabaja sobre una copia en memoria
+            index = faiss.read_index(self.index_path)
+            prepare_index(index, self.config)
+        else:
+            index = faiss.clone_index(self.index)
+        if self.masked:
+            remove_ids(index, np.fromiter(self.masked, dtype="int64", count=len(self.masked)))
+        if self.delta.ntotal:
+            ids = faiss.vector_to_array(self.delta.id_map)
+            index.add_with_ids(self.delta.reconstruct_batch(ids), ids)
+        return index
+
+    def get_similar(self, v: np.ndarray, k: int = 10, filter_metadata: Union[Dict[str, Any], str] = None,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None, with_ids: bool = False,
+                    query_text: Optional[str] = None):
+        """
+        Devuelve los `k` chunks más cercanos que cumplen `filter_metadata`.
+
+        El filtro se aplica dentro de la búsqueda de FAISS (IDSelector), no sobre
+        el top-k ya calculado, así que siempre se devuelven `k` resultados si existen.
+        `filter_metadata` puede ser un dict de metadatos o el nombre de una colección.
+        `nprobe` (IVF) y `ef_search` (HNSW) ajustan precisión/latencia por consulta.
+        Con `with_ids` cada resultado es (id, vector, Text) en lugar de (vector, Text).
+        Con `query_text` la búsqueda es híbrida: se fusiona con la de BM25 (ver `_hybrid_search`).
+        """
+        self._maybe_refresh()
+        allowed = self._matching_ids(filter_metadata)
+        return self._results(self._ranked(v, k, allowed, nprobe, ef_search, query_text), with_ids)
+
+    def get_similar_by_collection(self, v: np.ndarray, quotas: Dict[str, int],
+                                  nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                                  with_ids: bool = False, query_text: Optional[str] = None):
+        """
+        Búsqueda repartida por colección, p. ej. {"documentos": 8, "soluciones": 2}.
+        Si una colección tiene menos chunks que su cuota, el sobrante pasa a las demás.
+        Los resultados se devuelven ordenados por distancia (o por la fusión, con `query_text`).
+        """
+        self._maybe_refresh()
+        hits: List[Tuple[float, int]] = []
+        carry = 0
+        # De la colección más pequeña a la más grande, para que el sobrante siempre tenga a dónde ir
+        for collection in sorted(quotas, key=lambda c: len(self.by_collection.get(c, ()))):
+            wanted = quotas[collection] + carry
+            found = self._ranked(v, wanted, self.ids_for(collection=collection), nprobe, ef_search, query_text)
+            carry = wanted - len(found)
+            hits.extend(found)
+        hits.sort()
+        return self._results(hits, with_ids)
+
+    def _results(self, hits: List[Tuple[float, int]], with_ids: bool = False) -> List[tuple]:
+        with self._index_lock:
+            # Un chunk puede haberse borrado (aquí o en otro proceso) después de encontrarlo
+            ids = np.array([idx for _, idx in hits if idx in self.chunks], dtype="int64")
+            vectors = self._vectors(ids) if len(ids) else []
+            texts = [self.chunks[idx] for idx in ids.tolist()]
+        if with_ids:
+            return list(zip(ids.tolist(), vectors, texts))
+        return list(zip(vectors, texts))
 
-            vector, text = self.text_dict[idx]
+    def _matching_ids(self, filter_metadata: Union[Dict[str, Any], str, None]) -> Optional[Set[int]]:
+        """Resuelve un filtro de metadatos a un conjunto de ids (None = sin filtro)."""
+        if not filter_metadata:
+            return None
+        if isinstance(filter_metadata, str):
+            filter_metadata = {"collection": filter_metadata}
 
-            if filter_metadata:
-                if not all(text.metadata.dict().get(k) == v for k, v in filter_metadata.items()):
-                    continue
+        # reference y collection salen de los índices inversos; el resto se
+        # comprueba solo sobre los candidatos que dejaron esos dos
+        filters = dict(filter_metadata)
+        candidates = self.ids_for(
+            reference=filters.pop("reference", None),
+            collection=filters.pop("collection", None),
+        )
+        if filters:
+            candidates = {
+                idx for idx in candidates
+                if all(self.chunks[idx].metadata.model_dump().get(key) == value
+                       for key, value in filters.items())
+            }
+        return candidates
 
-            resultados.append((vector, text))
+    def _snapshot_selector(self, allowed: Optional[Set[int]]) -> Optional[faiss.IDSelector]:
+        """Selector para el snapshot: los ids permitidos, sin los ocultos por borrados posteriores."""
+        if allowed is None or len(allowed) >= len(self.chunks):
+            return faiss.IDSelectorNot(_id_batch(self.masked)) if self.masked else None
+        # Se usa la representación más pequeña: los ids permitidos o los excluidos.
+        # Los permitidos son chunks vivos, así que nunca incluyen ids ocultos
+        if len(allowed) <= len(self.chunks) // 2:
+            return _id_batch(allowed)
+        return faiss.IDSelectorNot(_id_batch((self.chunks.keys() - allowed) | self.masked))
 
-        return resultados
+    def _search(self, v: np.ndarray, k: int, allowed: Optional[Set[int]] = None,
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[float, int]]:
+        """Busca los `k` vecinos de `v` restringidos a `allowed`; devuelve pares (distancia, id)."""
+        if k <= 0 or allowed is not None and not allowed:
+            return []
+        v = np.asarray(v, dtype="float32").reshape(1, -1)
+
+        with self._index_lock:
+            selector = self._snapshot_selector(allowed)
+            params = search_params(self.index, selector, nprobe, ef_search)
+            D, I = self.index.search(v, k, params=params)
+            hits = list(zip(D[0], I[0]))
+            if self.delta.ntotal:
+                params = search_params(self.delta, _id_batch(allowed) if allowed is not None else None)
+                D, I = self.delta.search(v, k, params=params)
+                hits += zip(D[0], I[0])
+            exact = index_kind(self.index) == "flat"
+        found = sorted((float(d), int(idx)) for d, idx in hits if idx != -1 and idx in self.chunks)[:k]
+
+        # Con índices aproximados un filtro muy selectivo puede dejar la búsqueda corta;
+        # en ese caso se resuelve de forma exacta sobre los ids permitidos
+        if allowed is not None and len(found) < min(k, len(allowed)) and not exact:
+            found = self._exact_search(v, k, allowed)
+        return found
+
+    def _ranked(self, v: np.ndarray, k: int, allowed: Optional[Set[int]], nprobe: Optional[int],
+                ef_search: Optional[int], query_text: Optional[str]) -> List[Tuple[float, int]]:
+        if query_text:
+            return self._hybrid_search(v, query_text, k, allowed, nprobe, ef_search)
+        return self._search(v, k, allowed, nprobe, ef_search)
+
+    def lexical_search(self, query_text: str, k: int, allowed: Optional[Set[int]] = None) -> List[Tuple[float, int]]:
+        """Los `k` chunks con mayor puntuación BM25; pares (puntuación, id)."""
+        with self._index_lock:
+            return self.lexical.search(query_text, k, allowed)
+
+    def _hybrid_search(self, v: np.ndarray, query_text: str, k: int, allowed: Optional[Set[int]] = None,
+                       nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[float, int]]:
+        """
+        Fusiona con RRF los candidatos de FAISS y de BM25 (k·HYBRID_FETCH de cada
+        uno). Así un código de alarma o de equipo que el embedding no distingue
+        entra por la lista léxica sin tener que subir `k`. Devuelve pares
+        (-puntuación, id) para que se ordenen igual que las distancias.
+        """
+        if k <= 0 or allowed is not None and not allowed:
+            return []
+        depth = k * HYBRID_FETCH
+        dense = self._search(v, depth, allowed, nprobe, ef_search)
+        lexical = self.lexical_search(query_text, depth, allowed)
+        fused = rrf_fuse([[idx for _, idx in dense], [idx for _, idx in lexical]], k)
+        return [(-score, idx) for score, idx in fused]
+
+    def _exact_search(self, v: np.ndarray, k: int, allowed: Set[int]) -> List[Tuple[float, int]]:
+        with self._index_lock:
+            ids = np.fromiter((idx for idx in allowed if idx in self.chunks), dtype="int64")
+            matrix = self._vectors(ids)
+        distances = ((matrix - v) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return [(float(distances[i]), int(ids[i])) for i in top]
 
     def add_text(self, v: np.ndarray, t: Text):
-        v = np.array([v]).astype("float32")
-        self.index.add(v)
-        idx = self.index.ntotal - 1
-        self.text_dict[idx] = (v, t)
+        self.add_texts(np.asarray(v, dtype="float32").reshape(1, -1), [t])
+
+    def add_texts(self, matrix: np.ndarray, texts: List[Text]) -> List[int]:
+        """
+        Añade un bloque (n, dim) de vectores con una sola llamada a FAISS.
+        Devuelve los ids asignados a cada texto, en el mismo orden.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype="float32")
+        if matrix.shape[0] != len(texts):
+            raise ValueError(f"Se recibieron {matrix.shape[0]} vectores para {len(texts)} textos")
+        if not texts:
+            return []
+
+        with self._write_lock, self._store_lock:
+            self._sync()
+            # Ids monótonos: nunca se reutilizan aunque se borren chunks
+            ids = list(range(self.next_id, self.next_id + len(texts)))
+            self._apply_add(ids, matrix, texts)
+            self._log(add_record(ids, matrix, texts))
+            self._maybe_upgrade()
+        return ids
+
+    def _apply_add(self, ids: List[int], matrix: np.ndarray, texts: List[Text]):
+        with self._index_lock:
+            self.delta.add_with_ids(matrix, np.array(ids, dtype="int64"))
+            self._delta_ids.update(ids)
+            self.next_id = max(self.next_id, ids[-1] + 1)
+            for idx, text in zip(ids, texts):
+                self.chunks.add(idx, text)
+                self._index_text(idx, text)
+                self.lexical.add(idx, text.content)
+
+    def _apply_delete(self, ids: List[int]) -> int:
+        with self._index_lock:
+            for idx in ids:
+                self._unindex_text(idx, self.chunks[idx])
+                self.chunks.delete(idx)
+                self.lexical.remove(idx)
+            # Lo que está en el delta se borra de verdad; lo del snapshot se oculta hasta compactar
+            in_delta = {idx for idx in ids if idx in self._delta_ids}
+            if in_delta:
+                self.delta.remove_ids(np.fromiter(in_delta, dtype="int64", count=len(in_delta)))
+                self._delta_ids -= in_delta
+            self.masked.update(idx for idx in ids if idx not in in_delta)
+        return len(ids)
+
+    def _apply_update(self, idx: int, text: Text):
+        with self._index_lock:
+            old = self.chunks[idx]
+            self._unindex_text(idx, old)
+            self.chunks.update(idx, text)
+            self._index_text(idx, text)
+            if text.content != old.content:
+                self.lexical.add(idx, text.content)
+
+    def _replay_wal(self, changed: List[int]) -> int:
+        """Aplica los registros del WAL posteriores a `_wal_offset`; anota en `changed` los ids borrados o modificados."""
+        records, self._wal_offset = self.wal.read(self._wal_offset)
+        for header, matrix in records:
+            op = header["op"]
+            if op == "add":
+                self._apply_add(header["ids"], matrix, [Text.model_validate(t) for t in header["texts"]])
+            elif op == "delete":
+                ids = [idx for idx in header["ids"] if idx in self.chunks]
+                if ids:
+                    self._apply_delete(ids)
+                    changed.extend(ids)
+            elif op == "update" and header["id"] in self.chunks:
+                self._apply_update(header["id"], Text.model_validate(header["text"]))
+                changed.append(header["id"])
+        return len(records)
+
+    def _catch_up(self) -> int:
+        """
+        Incorpora lo que otros procesos escribieron desde la última vez: si
+        `store.json` apunta a otra generación se abre su snapshot, y después se
+        aplican los registros nuevos del WAL. Devuelve cuántos se aplicaron.
+        """
+        info = _read_store_info(self.info_path)
+        changed: List[int] = []
+        if info["generation"] != self.generation:
+            with self._index_lock:
+                self._open(info)
+                count = self._replay_wal(changed)
+            # Lo ocurrido entre el último registro leído y el snapshot nuevo
+            # no se conoce en detalle: se avisa de todos los chunks
+            changed = list(self.chunks)
+            print(f"Vectorstore recargado en la generación {self.generation} ({len(self.chunks)} chunks).")
+        else:
+            count = self._replay_wal(changed)
+        self._notify(changed)
+        return count
+
+    def _sync(self) -> int:
+        """Puesta al día antes de escribir; requiere el cerrojo de archivo."""
+        count = self._catch_up()
+        # Con el cerrojo nadie más escribe: lo que sobra es un registro a medias de una caída
+        self.wal.truncate(self._wal_offset)
+        return count
+
+    def _log(self, record: bytes):
+        """Anexa un registro al WAL (sin fsync: lo hace save_index) para que lo vean los demás procesos."""
+        self._wal_offset = self.wal.append([record], sync=False)
+        self._unsaved += 1
+
+    def refresh(self) -> int:
+        """
+        Incorpora ahora los cambios que otros procesos hayan escrito en la carpeta.
+        Si la generación vigente desaparece mientras se abre, se reintenta en la siguiente llamada.
+        """
+        with self._write_lock:
+            self._last_refresh = time.monotonic()
+            try:
+                return self._catch_up()
+            except (OSError, RuntimeError) as e:
+                print(f"No se pudo abrir la generación nueva del vectorstore: {e}")
+                return 0
+
+    def _maybe_refresh(self):
+        """Antes de buscar, como mucho cada `refresh_interval` segundos."""
+        if self.refresh_interval is None or time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        # Si hay una escritura o compactación local en curso, esa ya se pone al día
+        if self._write_lock.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self._write_lock.release()
+
+    def _index_text(self, idx: int, text: Text):
+        self.by_reference.setdefault(text.metadata.reference, set()).add(idx)
+        self.by_collection.setdefault(text.metadata.collection, set()).add(idx)
+
+    def _unindex_text(self, idx: int, text: Text):
+        for index, key in ((self.by_reference, text.metadata.reference),
+                           (self.by_collection, text.metadata.collection)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(idx)
+                if not ids:
+                    del index[key]
+
+    def ids_for(self, reference: Optional[str] = None, collection: Optional[str] = None) -> Set[int]:
+        """Devuelve los ids de los chunks con esa reference y/o collection."""
+        if reference is None and collection is None:
+            return set(self.chunks)
+        if reference is None:
+            return set(self.by_collection.get(collection, ()))
+        ids = set(self.by_reference.get(reference, ()))
+        if collection is not None:
+            ids &= self.by_collection.get(collection, set())
+        return ids
 
     def save_index(self):
-        os.makedirs(self.folder_path, exist_ok=True)
-        faiss.write_index(self.index, self.index_path)
-        print(f"Índice guardado en {self.index_path}")
+        """
+        Hace duraderos los cambios (fsync del WAL, que ya los contiene).
+        Si el WAL supera `wal_compact_bytes`, hay muchos ids ocultos o toca
+        cambiar de tipo de índice, lanza una compactación en segundo plano.
+        """
+        with self._write_lock:
+            self.wal.sync()
+            if self._unsaved:
+                print(f"{self._unsaved} operaciones guardadas en {self.wal.path}")
+                self._unsaved = 0
+            if (self._needs_snapshot or self.wal.size() > self.wal_compact_bytes
+                    or len(self.masked) > max(MASKED_COMPACT_IDS, len(self.chunks) // 10)):
+                self.compact_in_background()
+
+    def compact_in_background(self) -> threading.Thread:
+        """Lanza `compact` en un hilo si no hay otra compactación en curso."""
+        with self._write_lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(
+                    target=self.compact, name="vectorstore-compaction", daemon=True
+                )
+                self._compaction.start()
+            return self._compaction
+
+    def compact(self):
+        """
+        Escribe la generación siguiente (índice, chunks y BM25) con el estado actual,
+        la activa con un rename atómico de store.json y descarta la anterior y su WAL.
+        Una caída en cualquier punto deja intacta la generación vigente.
+        Mientras dura, las búsquedas siguen funcionando; las escrituras (de
+        cualquier proceso) esperan. Los demás procesos cambian de generación
+        en su siguiente `refresh`.
+        """
+        with self._write_lock, self._store_lock:
+            self._sync()
+            old_wal, old_index_path, old_prefix = self.wal, self.index_path, self.chunks.prefix
+            old_lexical_prefix = self.lexical.prefix
 
-        with open(self.dict_path, "wb") as f:
-            pickle.dump(self.text_dict, f)
-        print(f"Diccionario guardado en {self.dict_path}")
+            generation = self.generation + 1
+            index_name, chunks_prefix, lexical_prefix = snapshot_names(generation)
+            index_path = os.path.join(self.folder_path, index_name)
+            merged = self._merged_index()
+            faiss.write_index(merged, index_path + ".tmp")
+            del merged
+            _fsync_file(index_path + ".tmp")
+            os.replace(index_path + ".tmp", index_path)
+            self.chunks.write(chunks_prefix)
+            self.lexical.write(lexical_prefix)
+
+            _write_store_info(self.folder_path, self.next_id, generation)
+            index = faiss.read_index(index_path, MMAP_FLAGS)
+            prepare_index(index, self.config)
+            lexical = LexicalIndex(self.folder_path, lexical_prefix)
+            with self._index_lock:
+                self.generation, self.index_path, self.index = generation, index_path, index
+                self.lexical = lexical
+                self.delta = build_index("flat", index.d, self.config)
+                self._delta_ids, self.masked = set(), set()
+                self.wal = WriteAheadLog(os.path.join(self.folder_path, wal_name(generation)))
+                self._wal_offset = 0
+            self._needs_snapshot = False
+
+            # Otros procesos pueden tener aún mapeados los archivos viejos:
+            # en POSIX siguen siendo legibles; en Windows se borrarán al arrancar
+            for remove in (old_wal.remove, lambda: os.remove(old_index_path),
+                           lambda: ChunkStore.remove_files(self.folder_path, old_prefix),
+                           lambda: LexicalIndex.remove_files(self.folder_path, old_lexical_prefix)):
+                try:
+                    remove()
+                except OSError:
+                    pass
+            print(f"Vectorstore compactado en la generación {generation} ({len(self.chunks)} chunks).")
+
+    def _remove_stale_files(self):
+        """
+        Borra snapshots y WAL de generaciones anteriores a la vigente, y los
+        temporales que dejó una compactación interrumpida. Los de generaciones
+        posteriores se respetan: pueden ser de una compactación en curso.
+        """
+        pattern = re.compile(r"^(?:index|chunks|bm25|wal)(?:-(\d+))?[.]")
+        for name in os.listdir(self.folder_path):
+            match = pattern.match(name)
+            if not match or name.endswith(".bak"):
+                continue
+            generation = int(match.group(1) or 0)
+            if name.endswith((".tmp", ".tmp.npy")):
+                stale = generation <= self.generation
+            else:
+                stale = generation < self.generation
+            if stale:
+                try:
+                    os.remove(os.path.join(self.folder_path, name))
+                except OSError:
+                    pass  # Aún mapeado por otro proceso (Windows)
 
     def distance(self, v1: np.ndarray, v2: np.ndarray) -> float:
         v1 = np.array([v1]).astype("float32")
         v2 = np.array([v2]).astype("float32")
         return np.linalg.norm(v1 - v2)
-    
+
+    def delete_ids(self, ids: Iterable[int]) -> int:
+        """Elimina varios chunks con una sola llamada a `remove_ids`. Devuelve cuántos se eliminaron."""
+        with self._write_lock, self._store_lock:
+            self._sync()
+            ids = [int(idx) for idx in ids if idx in self.chunks]
+            if not ids:
+                return 0
+            removed = self._apply_delete(ids)
+            self._log(delete_record(ids))
+        self._notify(ids)
+        return removed
+
     def delete(self, idx: int):
-        if idx in self.text_dict:
-            del self.text_dict[idx]
-            self.index.remove_ids(np.array([idx]))
+        if self.delete_ids([idx]):
             print(f"Elemento con índice {idx} eliminado.")
         else:
             print(f"Índice {idx} no encontrado en el diccionario.")
 
     def update_metadata(self, idx: int, new_metadata: Dict[str, str]):
-        if idx in self.text_dict:
-            vector, text_obj = self.text_dict[idx]
-            if hasattr(text_obj, 'metadata') and isinstance(text_obj.metadata, TextMetadata):
-                # Creamos una copia actualizada del TextMetadata usando model_copy
-                updated_metadata = text_obj.metadata.model_copy(update=new_metadata)
-                # Creamos una copia actualizada del Text con la nueva metadata
-                updated_text = text_obj.model_copy(update={'metadata': updated_metadata})
-                # Guardamos de vuelta en el diccionario
-                self.text_dict[idx] = (vector, updated_text)
-                print(f"Metadata actualizada para índice {idx}")
-            else:
+        with self._write_lock, self._store_lock:
+            self._sync()
+            if idx not in self.chunks:
+                print(f"Índice {idx} no encontrado en el diccionario.")
+                return
+            text_obj = self.chunks[idx]
+            if not (hasattr(text_obj, 'metadata') and isinstance(text_obj.metadata, TextMetadata)):
                 print(f"El objeto en índice {idx} no tiene metadata válida.")
-        else:
-            print(f"Índice {idx} no encontrado en el diccionario.")
+                return
+            # Creamos una copia actualizada del TextMetadata usando model_copy
+            updated_metadata = text_obj.metadata.model_copy(update=new_metadata)
+            # Creamos una copia actualizada del Text con la nueva metadata
+            updated_text = text_obj.model_copy(update={'metadata': updated_metadata})
+            # Guardamos de vuelta en el almacén de chunks
+            self._apply_update(idx, updated_text)
+            self._log(update_record(idx, updated_text))
+        self._notify([idx])
+        print(f"Metadata actualizada para índice {idx}")
+
+
+    def update_texts(self, updates: Iterable[Tuple[int, Text]]) -> int:
+        """Sustituye texto y metadata de varios chunks conservando su id y su vector."""
+        changed = []
+        with self._write_lock, self._store_lock:
+            self._sync()
+            for idx, text in updates:
+                if idx in self.chunks:
+                    self._apply_update(idx, text)
+                    self._log(update_record(idx, text))
+                    changed.append(idx)
+        self._notify(changed)
+        return len(changed)
 
+    def add_listener(self, callback: Callable[[List[int]], None]):
+        """Registra una función que recibe los ids de chunks borrados o modificados."""
+        self._listeners.append(callback)
+
+    def _notify(self, ids: List[int]):
+        if ids:
+            for callback in self._listeners:
+                callback(ids)
 
     def delete_by_reference(self, reference_id: str):
         """
         Elimina todos los vectores asociados a un mismo documento (por metadata.reference).
         """
-        to_delete = [
-            idx for idx, (_, text_obj) in self.text_dict.items()
-            if hasattr(text_obj, "metadata") and getattr(text_obj.metadata, "reference", None) == reference_id
-        ]
-
-        for idx in to_delete:
-            del self.text_dict[idx]
-            self.index.remove_ids(np.array([idx]))
-            print(f"Chunk del documento con reference='{reference_id}' (índice {idx}) eliminado.")
-
-        if not to_delete:
+        removed = self.delete_ids(self.ids_for(reference=reference_id))
+        if removed:
+            print(f"{removed} chunks del documento con reference='{reference_id}' eliminados.")
+        else:
             print(f"No se encontró ningún chunk con reference='{reference_id}'.")
 
+    def delete_by_references(self, reference_ids: Iterable[str]) -> int:
+        """
+        Elimina los chunks de varios documentos con una sola llamada a `remove_ids`.
+        El coste es proporcional al número de chunks eliminados.
+        """
+        reference_ids = list(reference_ids)  # Acepta generadores y vistas; se recorre y se cuenta
+        to_delete = set()
+        for reference_id in reference_ids:
+            to_delete |= self.by_reference.get(reference_id, set())
+        removed = self.delete_ids(to_delete)
+        print(f"{removed} chunks eliminados de {len(reference_ids)} referencias.")
+        return removed
@@ -0,0 +1,108 @@
+import json
+import os
+import struct
+import zlib
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from cenacellm.types import Text
+
+# Cada registro: longitud (uint32) + crc32 (uint32) + payload.
+# El payload es una cabecera JSON terminada en "\n", seguida de los vectores
+# float32 en crudo para las operaciones "add".
+_FRAME = struct.Struct("<II")
+
+type WalRecord = Tuple[Dict[str, Any], Optional[np.ndarray]]
+
+
+def add_record(ids: List[int], matrix: np.ndarray, texts: List[Text]) -> bytes:
+    header = {
+        "op": "add",
+        "ids": ids,
+        "dim": int(matrix.shape[1]),
+        "texts": [text.model_dump(mode="json") for text in texts],
+    }
+    return _payload(header, np.ascontiguousarray(matrix, dtype="float32").tobytes())
+
+
+def delete_record(ids: List[int]) -> bytes:
+    return _payload({"op": "delete", "ids": ids})
+
+
+def update_record(idx: int, text: Text) -> bytes:
+    return _payload({"op": "update", "id": idx, "text": text.model_dump(mode="json")})
+
+
+def _payload(header: Dict[str, Any], body: bytes = b"") -> bytes:
+    return json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + body
+
+
+class WriteAheadLog:
+    """
+    Registro de operaciones de solo anexado. Varios procesos pueden leerlo
+    mientras uno escribe: `read` solo entrega registros completos y nunca
+    modifica el archivo. Un registro incompleto al final (caída a mitad de
+    escritura) lo recorta con `truncate` quien tiene el cerrojo de escritura.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def append(self, payloads: List[bytes], sync: bool = True) -> int:
+        """Anexa los registros (con fsync si `sync`) y devuelve el tamaño del archivo tras escribirlos."""
+        frames = b"".join(_FRAME.pack(len(p), zlib.crc32(p)) + p for p in payloads)
+        with open(self.path, "ab") as f:
+            f.write(frames)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            return f.tell()
+
+    def sync(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                os.fsync(f.fileno())
+
+    def read(self, offset: int = 0) -> Tuple[List[WalRecord], int]:
+        """
+        Registros válidos a partir de `offset`, en orden, y la posición tras el
+        último. Lo que sigue puede ser un registro que otro proceso aún está escribiendo.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        records: List[WalRecord] = []
+        valid_end = 0
+        while valid_end + _FRAME.size <= len(data):
+            length, crc = _FRAME.unpack_from(data, valid_end)
+            start = valid_end + _FRAME.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            header_end = payload.index(b"\n")
+            header = json.loads(payload[:header_end])
+            matrix = None
+            if header["op"] == "add":
+                matrix = np.frombuffer(payload[header_end + 1:], dtype="float32").reshape(-1, header["dim"])
+            records.append((header, matrix))
+            valid_end = start + length
+        return records, offset + valid_end
+
+    def truncate(self, size: int):
+        """Descarta lo que haya después de `size` (la cola de una escritura interrumpida)."""
+        excess = self.size() - size
+        if excess > 0:
+            print(f"WAL {self.path}: se descartan {excess} bytes incompletos al final.")
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass